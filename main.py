@@ -24,7 +24,7 @@ def run_etl_pipeline():
     print("执行ETL流程...")
     os.system("bash scripts/run_etl.sh")
 
-def run_rfm_analysis():
+def run_rfm_analysis(refit=False):
     """执行RFM分析"""
     print("执行RFM分析...")
     from rfm_analysis.rfm_calculator import RFMCalculator
@@ -37,9 +37,66 @@ def run_rfm_analysis():
     rfm_calc = RFMCalculator(rfm_config)
     rfm_calc.calculate_rfm_scores()
     
+    # 生成图表预聚合数据
+    if rfm_config['rfm_analysis'].get('aggregates', {}).get('enabled', True):
+        rfm_calc.build_chart_aggregates()
+    
     # 执行用户分群
     segmentation = UserSegmentation(rfm_config)
-    segmentation.perform_clustering()
+    segmentation.perform_clustering(refit)
+
+def run_k_selection():
+    """扫描聚类数量k并可选写回配置"""
+    print("聚类数量选择...")
+    from clustering.user_segmentation import UserSegmentation
+    from clustering.k_selection import pin_n_clusters
+    
+    config_path = 'config/rfm_config.yaml'
+    rfm_config = load_config(config_path)
+    best_k = UserSegmentation(rfm_config).select_k()
+    
+    if best_k is not None and rfm_config['clustering'].get('k_selection', {}).get('pin', False):
+        pin_n_clusters(config_path, best_k)
+        print(f"已将 n_clusters={best_k} 写入 {config_path}")
+
+def run_rfm_parallel():
+    """多进程并行执行RFM分析"""
+    print("并行执行RFM分析...")
+    from rfm_analysis.rfm_calculator import RFMCalculator
+    
+    rfm_config = load_config('config/rfm_config.yaml')
+    RFMCalculator(rfm_config).calculate_rfm_parallel()
+
+def run_rfm_incremental(partition=None, rebuild=False):
+    """执行RFM增量更新或全量重建"""
+    from rfm_analysis.rfm_calculator import RFMCalculator
+    
+    rfm_config = load_config('config/rfm_config.yaml')
+    rfm_calc = RFMCalculator(rfm_config)
+    
+    if rebuild:
+        print("全量重建RFM状态...")
+        rfm_calc.rebuild_rfm_state()
+    else:
+        print("增量更新RFM状态...")
+        rfm_calc.update_rfm_incremental(partition)
+    
+    # 留存矩阵与活跃度立方体随每日分区增量刷新
+    if rfm_config['rfm_analysis'].get('aggregates', {}).get('enabled', True):
+        if rebuild:
+            rfm_calc.rebuild_retention_state()
+        else:
+            from retention.incremental_retention import RetentionBackfillError
+            try:
+                rfm_calc.update_retention_incremental(partition)
+            except RetentionBackfillError as e:
+                # 补数分区无法增量合并进留存状态，以退出码2提示调度方执行 rfm_rebuild
+                print(f"错误: {e}")
+                sys.exit(2)
+        rfm_calc.update_activity_cube(partition, rebuild=rebuild)
+    
+    if rfm_config['rfm_analysis'].get('activity_index', {}).get('enabled', False):
+        rfm_calc.update_activity_index(partition, rebuild=rebuild)
 
 def run_visualization():
     """执行可视化生成"""
@@ -56,12 +113,16 @@ def run_visualization():
 def main():
     """主函数"""
     parser = argparse.ArgumentParser(description='视频平台RFM分析系统')
-    parser.add_argument('--mode', choices=['etl', 'rfm', 'viz', 'all'], 
+    parser.add_argument('--mode', choices=['etl', 'rfm', 'rfm_daily', 'rfm_rebuild', 'rfm_parallel', 'cluster_select', 'viz', 'all'], 
                        default='all', help='运行模式')
     parser.add_argument('--config', default='config', 
                        help='配置文件目录')
     parser.add_argument('--generate-data', action='store_true',
                        help='生成模拟数据')
+    parser.add_argument('--dt', default=None,
+                       help='rfm_daily模式处理的分区日期(yyyy-MM-dd)，默认处理所有未处理分区')
+    parser.add_argument('--refit', action='store_true',
+                       help='强制重新训练聚类模型（默认按计划或漂移时重训）')
     
     args = parser.parse_args()
     
@@ -78,7 +139,16 @@ def main():
             run_etl_pipeline()
             
         if args.mode in ['rfm', 'all']:
-            run_rfm_analysis()
+            run_rfm_analysis(args.refit)
+            
+        if args.mode == 'rfm_parallel':
+            run_rfm_parallel()
+            
+        if args.mode == 'cluster_select':
+            run_k_selection()
+            
+        if args.mode in ['rfm_daily', 'rfm_rebuild']:
+            run_rfm_incremental(args.dt, rebuild=args.mode == 'rfm_rebuild')
             
         if args.mode in ['viz', 'all']:
             run_visualization()
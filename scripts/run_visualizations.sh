@@ -18,7 +18,7 @@ echo "生成时段热力图..."
 python scripts/generate_heatmap.py
 
 echo "生成留存曲线..."
-python scripts/generate_retention.py
+python src/clustering/generate_retention_curve.py
 
 echo "可视化文档生成完成! 查看docs目录:"
 ls -lh docs/
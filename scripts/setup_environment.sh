@@ -11,7 +11,7 @@ export PYTHONPATH="${PYTHONPATH}:$(pwd)/src"
 # 创建HDFS目录结构
 echo "创建HDFS目录结构..."
 hadoop fs -mkdir -p /data/video_analysis/{raw/{media,users},cleaned,dwh,results}
-hadoop fs -mkdir -p /results/{user_rfm,time_heatmap,retention_curve}
+hadoop fs -mkdir -p /results/{user_rfm,activity_cube,retention_matrix}
 
 # 设置HDFS权限
 hadoop fs -chmod -R 755 /data/video_analysis
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+用户聚类性能基准（全量KMeans vs 流式Mini-batch K-means）
+Clustering Benchmark
+
+用法: python src/clustering/benchmark_clustering.py --sizes 1000000 5000000
+"""
+
+import os
+import sys
+import argparse
+
+import numpy as np
+import yaml
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from clustering.streaming_kmeans import compare_with_full_batch
+
+
+def synthetic_rfm(n_users, seed=42):
+    """生成与RFM结果分布相近的随机特征（最近天数、长尾频次与时长）"""
+    rng = np.random.default_rng(seed)
+    frequency = rng.geometric(0.05, n_users).astype(np.float64)
+    return np.column_stack([
+        rng.integers(0, 31, n_users).astype(np.float64),
+        frequency,
+        frequency * rng.gamma(2.0, 20.0, n_users)
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='用户聚类性能基准')
+    parser.add_argument('--config', default='config/rfm_config.yaml', help='RFM配置文件')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000000, 5000000],
+                        help='测试的用户数量')
+    args = parser.parse_args()
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        cluster_config = yaml.safe_load(f)['clustering']
+    minibatch_config = cluster_config.get('minibatch', {})
+    chunk_size = minibatch_config.get('chunk_size', 1000000)
+
+    for n_users in args.sizes:
+        X = synthetic_rfm(n_users)
+
+        def chunks():
+            for start in range(0, len(X), chunk_size):
+                yield X[start:start + chunk_size]
+
+        compare_with_full_batch(chunks, cluster_config['n_clusters'],
+                                cluster_config.get('random_state', 42),
+                                minibatch_config.get('batch_size', 16384),
+                                minibatch_config.get('max_epochs', 1))
+
+
+if __name__ == "__main__":
+    main()
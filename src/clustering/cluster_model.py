@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+持久化聚类模型（标准化参数 + 聚类中心 + 版本）
+Persisted Clustering Model
+"""
+
+import os
+import json
+from datetime import datetime, timedelta
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+ASSIGNMENT_METADATA_KEY = b'cluster_assignments'
+ASSIGNMENT_COLUMNS = ['user_key', 'recency_days', 'frequency', 'monetary_value', 'cluster']
+
+# 按RFM价值从低到高排列的分群名称（n_clusters为4时使用）
+VALUE_LABELS = ["低价值用户", "潜力用户", "活跃用户", "高价值用户"]
+
+
+def value_labels(n_clusters):
+    """按价值排序的分群名称"""
+    if n_clusters == len(VALUE_LABELS):
+        return list(VALUE_LABELS)
+    return [f"用户群{i + 1}" for i in range(n_clusters)]
+
+
+class ClusterModel:
+    """已拟合的标准化器参数与聚类中心（标准化空间），可向量化地为新用户分配最近中心
+
+    簇编号按RFM价值画像排序（0为价值最低），重新训练时与上一版本中心做最优匹配，
+    保证同一画像的簇在不同版本间编号不变。
+    """
+
+    def __init__(self, mean, scale, centroids, version=1, fitted_at=None,
+                 n_samples=0, mean_sq_distance=0.0, labels=None):
+        """初始化聚类模型"""
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.centroids = np.asarray(centroids, dtype=np.float64)
+        self.version = version
+        self.fitted_at = fitted_at or datetime.now().isoformat()
+        self.n_samples = n_samples
+        self.mean_sq_distance = mean_sq_distance
+        self.labels = labels or value_labels(len(self.centroids))
+
+    @property
+    def n_clusters(self):
+        return len(self.centroids)
+
+    @classmethod
+    def from_fit(cls, scaler, centroids, labels, inertia, previous=None):
+        """由一次训练结果构建模型，返回 (model, 重新编号后的labels)
+
+        有上一版本且簇数一致时按中心距离做最优匹配，否则按价值画像排序编号。
+        """
+        centroids = np.asarray(centroids, dtype=np.float64)
+        if previous is not None and previous.n_clusters == len(centroids):
+            # 将上一版本的中心换算到本次的标准化空间后匹配
+            previous_centroids = (previous.centroids * previous.scale + previous.mean
+                                  - scaler.mean_) / scaler.scale_
+            cost = ((previous_centroids[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2)
+            _, order = linear_sum_assignment(cost)
+            version, names = previous.version + 1, previous.labels
+        else:
+            # 价值画像: 最近活跃天数越小、频次和时长越大价值越高
+            order = np.argsort(-centroids[:, 0] + centroids[:, 1] + centroids[:, 2], kind='stable')
+            version = previous.version + 1 if previous is not None else 1
+            names = None
+
+        # order[新编号] = 本次训练的原始编号
+        remap = np.empty(len(order), dtype=np.int16)
+        remap[order] = np.arange(len(order))
+        labels = np.asarray(labels)
+        model = cls(scaler.mean_, scaler.scale_, centroids[order], version,
+                    n_samples=len(labels),
+                    mean_sq_distance=inertia / max(len(labels), 1), labels=names)
+        return model, remap[labels]
+
+    def transform(self, X):
+        """按保存的参数标准化"""
+        return (np.asarray(X, dtype=np.float64) - self.mean) / self.scale
+
+    def assign(self, X, chunk_size=1000000):
+        """向量化最近中心分配，返回 (簇编号, 到中心的距离平方)
+
+        ||x - c||^2 = ||x||^2 - 2 x·c + ||c||^2，按块计算避免 n×k×d 的中间数组。
+        """
+        X = np.asarray(X, dtype=np.float64)
+        clusters = np.empty(len(X), dtype=np.int16)
+        distances = np.empty(len(X), dtype=np.float64)
+        centroid_norms = (self.centroids ** 2).sum(axis=1)
+
+        for start in range(0, len(X), chunk_size):
+            X_scaled = self.transform(X[start:start + chunk_size])
+            sq = (X_scaled ** 2).sum(axis=1)[:, None] - 2 * X_scaled @ self.centroids.T + centroid_norms
+            nearest = sq.argmin(axis=1)
+            clusters[start:start + len(nearest)] = nearest
+            distances[start:start + len(nearest)] = np.maximum(sq[np.arange(len(nearest)), nearest], 0)
+        return clusters, distances
+
+    def drift_ratio(self, distances):
+        """新分配用户的平均距离平方相对训练时的比值（越大说明分布偏离越多）"""
+        if len(distances) == 0 or self.mean_sq_distance <= 0:
+            return 1.0
+        return float(np.mean(distances) / self.mean_sq_distance)
+
+    def refit_due(self, interval_days):
+        """是否已到定期重新训练时间"""
+        if not interval_days:
+            return False
+        fitted_at = datetime.fromisoformat(self.fitted_at)
+        return datetime.now() - fitted_at >= timedelta(days=interval_days)
+
+    def to_dict(self):
+        return {
+            'version': self.version,
+            'fitted_at': self.fitted_at,
+            'n_samples': self.n_samples,
+            'mean_sq_distance': self.mean_sq_distance,
+            'mean': self.mean.tolist(),
+            'scale': self.scale.tolist(),
+            'centroids': self.centroids.tolist(),
+            'labels': self.labels
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+    def save(self, path):
+        """原子写入模型文件（JSON）"""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """加载模型文件，不存在时返回None"""
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+
+def save_assignments(df, path, model_version):
+    """原子写入每个用户的特征与簇编号（模型版本存于Parquet schema元数据）"""
+    save_assignment_chunks([df], path, model_version)
+
+
+def save_assignment_chunks(frames, path, model_version):
+    """逐块写入分配结果（每块一个row group），全部写完后原子替换"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    writer = None
+    for df in frames:
+        table = pa.Table.from_pandas(df[ASSIGNMENT_COLUMNS], preserve_index=False)
+        if writer is None:
+            schema_metadata = dict(table.schema.metadata or {})
+            schema_metadata[ASSIGNMENT_METADATA_KEY] = json.dumps(
+                {'model_version': model_version}).encode('utf-8')
+            writer = pq.ParquetWriter(tmp_path, table.schema.with_metadata(schema_metadata))
+        writer.write_table(table)
+    if writer is None:
+        return
+    writer.close()
+    os.replace(tmp_path, path)
+
+
+def load_assignments(path):
+    """读取上次的分配结果，返回 (DataFrame, 模型版本)，不存在时返回 (None, None)"""
+    import pyarrow.parquet as pq
+
+    if not os.path.exists(path):
+        return None, None
+    table = pq.read_table(path)
+    metadata = json.loads(table.schema.metadata[ASSIGNMENT_METADATA_KEY])
+    return table.to_pandas(), metadata['model_version']
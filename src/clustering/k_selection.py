@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+聚类数量自动选择（肘部法则 + 轮廓系数，分层抽样、多进程扫描）
+Automatic k Selection
+"""
+
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import numpy as np
+from sklearn.cluster import KMeans
+from sklearn.metrics import silhouette_score
+from sklearn.preprocessing import StandardScaler
+from threadpoolctl import threadpool_limits
+
+STRATA_COLUMNS = ['R_score', 'F_score', 'M_score']
+
+
+def stratified_sample(df, sample_size, seed=42):
+    """按 R/F/M 分数组合分层、按比例抽样，返回行下标（小分层也保留代表）"""
+    n = len(df)
+    if sample_size >= n:
+        return np.arange(n)
+    rng = np.random.default_rng(seed)
+    if not all(column in df for column in STRATA_COLUMNS):
+        return np.sort(rng.choice(n, sample_size, replace=False))
+
+    strata = (df['R_score'].to_numpy(np.int64) * 25 + df['F_score'].to_numpy(np.int64) * 5
+              + df['M_score'].to_numpy(np.int64))
+    codes, strata = np.unique(strata, return_inverse=True)
+    counts = np.bincount(strata)
+    quotas = np.maximum(np.round(counts * sample_size / n), 1).astype(np.int64)
+
+    # 分层内随机排序，取每层前 quota 个
+    order = np.lexsort((rng.random(n), strata))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    position = np.arange(n) - starts[strata[order]]
+    return np.sort(order[position < quotas[strata[order]]])
+
+
+def evaluate_k(X, X_silhouette, k, random_state=42):
+    """进程池任务: 在抽样数据上训练一个k，返回惯性与轮廓系数"""
+    # 每个进程单线程运行，避免多进程 × OpenMP 线程超额订阅
+    with threadpool_limits(limits=1):
+        start = time.perf_counter()
+        kmeans = KMeans(n_clusters=k, random_state=random_state).fit(X)
+        labels = kmeans.predict(X_silhouette)
+        silhouette = silhouette_score(X_silhouette, labels) if len(np.unique(labels)) > 1 else np.nan
+    return {
+        'k': k,
+        'inertia': kmeans.inertia_,
+        'mean_sq_distance': kmeans.inertia_ / len(X),
+        'silhouette': silhouette,
+        'seconds': time.perf_counter() - start
+    }
+
+
+def elbow_k(report):
+    """肘部法则: 惯性曲线二阶差分最大处"""
+    if len(report) < 3:
+        return int(report['k'].iloc[0])
+    inertia = report['inertia'].to_numpy()
+    return int(report['k'].iloc[1 + np.argmax(np.diff(inertia, 2))])
+
+
+def sweep_k(df, features, k_values, sample_size=200000, silhouette_sample_size=20000,
+            workers=None, random_state=42):
+    """多进程扫描k: 训练样本与轮廓系数样本均为分层抽样，返回按k排序的报告"""
+    sample = stratified_sample(df, sample_size, random_state)
+    X = StandardScaler().fit_transform(df[features].to_numpy(dtype=np.float64)[sample])
+    silhouette_rows = stratified_sample(df.iloc[sample], silhouette_sample_size, random_state + 1)
+    X_silhouette = X[silhouette_rows]
+    print(f"k扫描: {list(k_values)}, 训练样本 {len(X)}, 轮廓系数样本 {len(X_silhouette)}")
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(evaluate_k, X, X_silhouette, k, random_state) for k in k_values]
+        rows = [future.result() for future in futures]
+    return pd.DataFrame(rows).sort_values('k').reset_index(drop=True)
+
+
+def pin_n_clusters(config_path, k):
+    """将选定的k写回配置文件的 clustering.n_clusters（保留文件中的注释）"""
+    with open(config_path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    text, count = re.subn(r'^(\s*n_clusters:\s*)\d+', rf'\g<1>{k}', text, count=1, flags=re.M)
+    if count == 0:
+        raise ValueError(f"{config_path} 中未找到 n_clusters 配置")
+    with open(config_path, 'w', encoding='utf-8') as f:
+        f.write(text)
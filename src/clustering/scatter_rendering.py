@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大规模聚类散点图渲染（全量 / 分簇抽样 / 网格密度）
+Scalable Cluster Scatter Rendering
+"""
+
+import numpy as np
+import matplotlib
+
+
+def choose_scatter_mode(n_points, max_points=50000, density_threshold=1000000):
+    """按点数自动选择渲染方式"""
+    if n_points <= max_points:
+        return 'scatter'
+    if n_points <= density_threshold:
+        return 'sample'
+    return 'density'
+
+
+def sample_per_cluster(clusters, max_points, seed=42):
+    """按簇分层抽样约max_points个点（按比例分配，每个簇至少保留少量点），返回行下标"""
+    clusters = np.asarray(clusters)
+    n = len(clusters)
+    if n <= max_points:
+        return np.arange(n)
+
+    codes, strata = np.unique(clusters, return_inverse=True)
+    counts = np.bincount(strata)
+    quotas = np.minimum(np.maximum(np.round(counts * max_points / n), 100), counts).astype(np.int64)
+
+    rng = np.random.default_rng(seed)
+    order = np.lexsort((rng.random(n), strata))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    position = np.arange(n) - starts[strata[order]]
+    return np.sort(order[position < quotas[strata[order]]])
+
+
+def density_image(x, y, clusters, n_clusters, gridsize=300, cmap='viridis'):
+    """将点聚合到固定网格: 颜色为格内占多数的簇，透明度为对数密度，返回 (RGBA图像, extent)"""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    clusters = np.asarray(clusters, dtype=np.int64)
+    x_min, x_max = x.min(), x.max()
+    y_min, y_max = y.min(), y.max()
+
+    ix = np.clip(((x - x_min) / ((x_max - x_min) or 1) * gridsize).astype(np.int64), 0, gridsize - 1)
+    iy = np.clip(((y - y_min) / ((y_max - y_min) or 1) * gridsize).astype(np.int64), 0, gridsize - 1)
+    counts = np.bincount((clusters * gridsize + iy) * gridsize + ix,
+                         minlength=n_clusters * gridsize * gridsize)
+    counts = counts.reshape(n_clusters, gridsize, gridsize)
+
+    total = counts.sum(axis=0)
+    dominant = counts.argmax(axis=0)
+    image = matplotlib.colormaps.get_cmap(cmap)(dominant / max(n_clusters - 1, 1))
+    image[..., 3] = np.log1p(total) / np.log1p(max(total.max(), 1))
+    return image, (x_min, x_max, y_min, y_max)
+
+
+def plot_cluster_scatter(ax, x, y, clusters, mode='auto', max_points=50000,
+                         density_threshold=1000000, gridsize=300, cmap='viridis',
+                         alpha=0.6, seed=42):
+    """按簇着色的散点图，点数较多时抽样或按网格密度渲染，返回实际使用的方式"""
+    x, y, clusters = np.asarray(x), np.asarray(y), np.asarray(clusters)
+    n_clusters = int(clusters.max()) + 1 if len(clusters) else 1
+    if mode == 'auto':
+        mode = choose_scatter_mode(len(x), max_points, density_threshold)
+
+    if mode == 'density':
+        image, extent = density_image(x, y, clusters, n_clusters, gridsize, cmap)
+        ax.imshow(image, extent=extent, origin='lower', aspect='auto', interpolation='nearest')
+        return mode
+
+    if mode == 'sample':
+        rows = sample_per_cluster(clusters, max_points, seed)
+        x, y, clusters = x[rows], y[rows], clusters[rows]
+    elif mode != 'scatter':
+        raise ValueError(f"未知的散点图渲染方式: {mode}")
+
+    # 颜色范围固定为全部簇，抽样后颜色与全量一致
+    ax.scatter(x, y, c=clusters, cmap=cmap, alpha=alpha, s=4 if mode == 'sample' else None,
+               vmin=0, vmax=max(n_clusters - 1, 1))
+    return mode
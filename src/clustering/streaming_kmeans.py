@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式（Mini-batch）K-means聚类
+Streaming Mini-batch K-means
+"""
+
+import os
+import time
+
+import pandas as pd
+import numpy as np
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.preprocessing import StandardScaler
+
+from rfm_analysis.result_store import open_rfm_store
+
+FEATURES = ['recency_days', 'frequency', 'monetary_value']
+
+
+def feature_chunk_source(store_path, csv_path, chunk_size):
+    """返回可重复遍历的特征分块生成函数（优先内存映射结果文件，其次分块读取CSV）"""
+    if os.path.exists(store_path):
+        def chunks():
+            records = open_rfm_store(store_path)
+            for start in range(0, len(records), chunk_size):
+                block = records[start:start + chunk_size]
+                yield np.column_stack([block[column].astype(np.float64) for column in FEATURES])
+        return chunks
+
+    if os.path.exists(csv_path):
+        def chunks():
+            for chunk in pd.read_csv(csv_path, usecols=FEATURES, chunksize=chunk_size):
+                yield chunk[FEATURES].to_numpy(dtype=np.float64)
+        return chunks
+
+    return None
+
+
+def fit_streaming_kmeans(chunks, n_clusters, random_state=42, batch_size=16384, max_epochs=1):
+    """两阶段流式拟合: 先逐块partial_fit标准化器，再逐块partial_fit Mini-batch K-means
+
+    chunks 为可重复调用的分块生成函数，每次调用从头遍历一遍数据。
+    """
+    scaler = StandardScaler()
+    for X in chunks():
+        scaler.partial_fit(X)
+
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=random_state,
+                             batch_size=batch_size, n_init=3)
+    rng = np.random.default_rng(random_state)
+    for _ in range(max_epochs):
+        for X in chunks():
+            X_scaled = scaler.transform(X)
+            # 块内打乱后按batch_size切分，避免按用户顺序的批次偏差
+            X_scaled = X_scaled[rng.permutation(len(X_scaled))]
+            for start in range(0, len(X_scaled), batch_size):
+                batch = X_scaled[start:start + batch_size]
+                if len(batch) >= n_clusters:
+                    kmeans.partial_fit(batch)
+    return scaler, kmeans
+
+
+def predict_chunks(chunks, scaler, kmeans):
+    """逐块分配簇标签，同时累计惯性（样本到所属中心的距离平方和）"""
+    labels = []
+    inertia = 0.0
+    for X in chunks():
+        X_scaled = scaler.transform(X)
+        labels.append(kmeans.predict(X_scaled).astype(np.int16))
+        inertia -= kmeans.score(X_scaled)
+    labels = np.concatenate(labels) if labels else np.empty(0, dtype=np.int16)
+    return labels, inertia
+
+
+def fit_full_batch(X, n_clusters, random_state=42):
+    """全量基线: 一次性标准化并执行KMeans，返回 (labels, inertia, scaler, kmeans)"""
+    scaler = StandardScaler()
+    X_scaled = scaler.fit_transform(X)
+    kmeans = KMeans(n_clusters=n_clusters, random_state=random_state)
+    labels = kmeans.fit_predict(X_scaled)
+    return labels, kmeans.inertia_, scaler, kmeans
+
+
+def compare_with_full_batch(chunks, n_clusters, random_state=42, batch_size=16384, max_epochs=1):
+    """在同一份数据上对比流式与全量聚类的耗时和惯性"""
+    start = time.perf_counter()
+    scaler, kmeans = fit_streaming_kmeans(chunks, n_clusters, random_state, batch_size, max_epochs)
+    _, streaming_inertia = predict_chunks(chunks, scaler, kmeans)
+    streaming_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    X = np.concatenate(list(chunks()))
+    _, full_inertia, _, _ = fit_full_batch(X, n_clusters, random_state)
+    full_seconds = time.perf_counter() - start
+
+    print(f"[{len(X):>10,d} 用户] 全量KMeans: {full_seconds:.2f}s, 惯性 {full_inertia:,.1f}")
+    print(f"[{len(X):>10,d} 用户] Mini-batch: {streaming_seconds:.2f}s, 惯性 {streaming_inertia:,.1f} "
+          f"(加速 {full_seconds / streaming_seconds:.1f}x, "
+          f"惯性偏差 {(streaming_inertia / full_inertia - 1) * 100:+.2f}%)")
+    return {
+        'n_users': len(X),
+        'full_seconds': full_seconds,
+        'full_inertia': full_inertia,
+        'streaming_seconds': streaming_seconds,
+        'streaming_inertia': streaming_inertia
+    }
+
+
+class ClusterProfileAccumulator:
+    """逐块累计各簇用户数、R/F/M均值与标准差（Chan合并公式），并按固定比例均匀抽样
+
+    抽样用于分位数与散点图，内存只与抽样数相关，不随用户数增长。
+    """
+
+    def __init__(self, n_clusters, sample_rate=1.0, random_state=42):
+        self.counts = np.zeros(n_clusters, dtype=np.int64)
+        self.mean = np.zeros((n_clusters, len(FEATURES)))
+        self.comoment = np.zeros((n_clusters, len(FEATURES)))  # Σ(x-均值)^2
+        self.sample_rate = sample_rate
+        self.rng = np.random.default_rng(random_state)
+        self.samples = []
+
+    def update(self, df):
+        """加入一块带 cluster 列的RFM结果"""
+        grouped = df.groupby('cluster')[FEATURES]
+        clusters = grouped.size().index.to_numpy()
+        n = grouped.size().to_numpy()[:, None]
+        mean = grouped.mean().to_numpy()
+        comoment = grouped.var(ddof=0).to_numpy() * n
+
+        total = self.counts[clusters][:, None] + n
+        delta = mean - self.mean[clusters]
+        self.comoment[clusters] += comoment + delta ** 2 * self.counts[clusters][:, None] * n / total
+        self.mean[clusters] += delta * n / total
+        self.counts[clusters] = total[:, 0]
+
+        keep = self.rng.random(len(df)) < self.sample_rate
+        self.samples.append(df[keep])
+
+    def sample(self):
+        """抽样得到的用户（含 cluster 列）"""
+        return pd.concat(self.samples, ignore_index=True) if self.samples else pd.DataFrame(
+            columns=FEATURES + ['cluster'])
+
+    def stats(self):
+        """各簇 (用户数, 均值/标准差) ，列为 (特征, mean|std)"""
+        present = self.counts > 0
+        std = np.sqrt(self.comoment / np.maximum(self.counts - 1, 1)[:, None])
+        columns = pd.MultiIndex.from_product([FEATURES, ['mean', 'std']])
+        values = np.stack([self.mean, std], axis=2).reshape(len(self.counts), -1)
+        index = pd.Index(np.flatnonzero(present), name='cluster')
+        return pd.Series(self.counts[present], index=index), pd.DataFrame(values[present], index=index,
+                                                                           columns=columns)
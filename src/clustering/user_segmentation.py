@@ -5,15 +5,29 @@
 User Segmentation Module
 """
 
+import os
+import time
 import pandas as pd
 import numpy as np
-from sklearn.cluster import KMeans
 from sklearn.preprocessing import StandardScaler
-import matplotlib.pyplot as plt
+import matplotlib
+from matplotlib.figure import Figure
 import seaborn as sns
 from fpdf import FPDF
 import yaml
 
+from rfm_analysis.result_store import store_to_frame, iter_store_frames, open_rfm_store
+from clustering.streaming_kmeans import (
+    FEATURES, feature_chunk_source, fit_streaming_kmeans, predict_chunks, fit_full_batch,
+    compare_with_full_batch, ClusterProfileAccumulator
+)
+from clustering.cluster_model import (
+    ClusterModel, save_assignments, save_assignment_chunks, load_assignments
+)
+from clustering.k_selection import sweep_k, elbow_k
+from clustering.scatter_rendering import plot_cluster_scatter
+from visualization.render_pipeline import save_figure
+
 class UserSegmentation:
     """用户分群分析"""
     
@@ -21,9 +35,22 @@ class UserSegmentation:
         """初始化用户分群"""
         self.config = config
         self.scaler = StandardScaler()
+        self.model = None
+        self.profile = None
         
+    @property
+    def store_path(self):
+        return self.config.get('rfm_analysis', {}).get('output', {}).get(
+            'store_path', 'data/results/rfm_scores.npy')
+    
     def load_rfm_data(self):
-        """加载RFM数据"""
+        """加载RFM数据（优先读取定长二进制结果，其次CSV）"""
+        store_path = self.store_path
+        if os.path.exists(store_path):
+            df = store_to_frame(store_path)
+            print(f"加载RFM数据: {len(df)} 条记录 ({store_path})")
+            return df
+        
         try:
             df = pd.read_csv('data/results/rfm_scores.csv')
             print(f"加载RFM数据: {len(df)} 条记录")
@@ -32,26 +59,52 @@ class UserSegmentation:
             print("RFM数据文件不存在，请先运行RFM分析")
             return None
     
-    def perform_clustering(self):
-        """执行K-means聚类"""
+    def _refit_reason(self, previous, refit):
+        """需要重新训练的原因，无需重新训练时返回None"""
+        cluster_config = self.config['clustering']
+        if refit or previous is None:
+            return "手动指定" if refit else "无已保存模型"
+        if previous.n_clusters != cluster_config['n_clusters']:
+            return "簇数量变化"
+        if previous.refit_due(cluster_config.get('model', {}).get('refit_interval_days', 7)):
+            return f"模型版本 {previous.version} 已到重新训练周期"
+        return None
+    
+    def perform_clustering(self, refit=False):
+        """执行K-means聚类: 已有模型时只为新增/变化的用户分配簇，按计划或漂移时重新训练"""
         print("开始用户聚类分析...")
         
+        cluster_config = self.config['clustering']
+        if cluster_config.get('mode', 'full') == 'minibatch' and os.path.exists(self.store_path):
+            return self.perform_clustering_minibatch(refit)
+        
         # 加载数据
         df = self.load_rfm_data()
         if df is None:
             return
-        
-        # 准备特征数据
-        features = ['recency_days', 'frequency', 'monetary_value']
-        X = df[features].values
-        
-        # 标准化数据
-        X_scaled = self.scaler.fit_transform(X)
-        
-        # K-means聚类
-        n_clusters = self.config['clustering']['n_clusters']
-        kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-        df['cluster'] = kmeans.fit_predict(X_scaled)
+        self.profile = None
+        
+        model_config = cluster_config.get('model', {})
+        model_path = model_config.get('path', 'data/state/cluster_model.json')
+        previous = ClusterModel.load(model_path)
+        
+        reason = self._refit_reason(previous, refit)
+        if reason is None:
+            labels, drift = self.assign(df, previous)
+            if drift > model_config.get('drift_threshold', 1.5):
+                reason = f"分布漂移（距离比 {drift:.2f}）"
+            else:
+                self.model = previous
+                df['cluster'] = labels
+        
+        if reason is not None:
+            print(f"重新训练聚类模型: {reason}")
+            df['cluster'] = self.refit(df, previous)
+            self.model.save(model_path)
+            print(f"聚类模型版本 {self.model.version} 已保存到 {model_path}")
+        
+        save_assignments(df, model_config.get('assignments_path', 'data/state/cluster_assignments.parquet'),
+                         self.model.version)
         
         # 分析聚类结果
         self.analyze_clusters(df)
@@ -68,28 +121,226 @@ class UserSegmentation:
         
         return df
     
+    def perform_clustering_minibatch(self, refit=False):
+        """流式聚类全流程: 训练、分配与结果输出都按块读取内存映射的RFM结果，不加载完整数据
+        
+        簇画像的用户数、均值与标准差为精确值，分位数与散点图基于按比例均匀抽样的用户。
+        """
+        cluster_config = self.config['clustering']
+        model_config = cluster_config.get('model', {})
+        model_path = model_config.get('path', 'data/state/cluster_model.json')
+        chunk_size = cluster_config.get('minibatch', {}).get('chunk_size', 1000000)
+        self.profile = None
+        previous = ClusterModel.load(model_path)
+        
+        reason = self._refit_reason(previous, refit)
+        if reason is None:
+            labels, drift = self.assign_store(previous, chunk_size)
+            if drift > model_config.get('drift_threshold', 1.5):
+                reason = f"分布漂移（距离比 {drift:.2f}）"
+            else:
+                self.model = previous
+        
+        if reason is not None:
+            print(f"重新训练聚类模型: {reason}")
+            start = time.perf_counter()
+            labels, inertia, kmeans = self.cluster_minibatch()
+            print(f"聚类完成（minibatch）: 耗时 {time.perf_counter() - start:.2f}s, 惯性 {inertia:,.1f}")
+            self.model, labels = ClusterModel.from_fit(self.scaler, kmeans.cluster_centers_, labels,
+                                                       inertia, previous)
+            self.model.save(model_path)
+            print(f"聚类模型版本 {self.model.version} 已保存到 {model_path}")
+        
+        sample = self.write_minibatch_results(labels, chunk_size)
+        
+        # 分析、可视化与报告使用流式画像和抽样用户
+        self.analyze_clusters(sample)
+        self.generate_cluster_visualization(sample)
+        self.generate_segmentation_report(sample)
+        print("用户聚类分析完成")
+        return sample
+    
+    def assign_store(self, model, chunk_size):
+        """按块为全部用户分配最近中心，返回 (簇编号, 漂移比)"""
+        start = time.perf_counter()
+        records = open_rfm_store(self.store_path)
+        clusters = np.empty(len(records), dtype=np.int16)
+        squared = 0.0
+        for offset in range(0, len(records), chunk_size):
+            block = records[offset:offset + chunk_size]
+            X = np.column_stack([block[column].astype(np.float64) for column in FEATURES])
+            clusters[offset:offset + len(X)], distances = model.assign(X)
+            squared += distances.sum()
+        drift = model.drift_ratio(np.array([squared / max(len(records), 1)]))
+        print(f"模型版本 {model.version} 分块分配: {len(records)} 个用户, "
+              f"漂移比 {drift:.2f}, 耗时 {time.perf_counter() - start:.2f}s")
+        return clusters, drift
+    
+    def write_minibatch_results(self, labels, chunk_size):
+        """按块写出分配结果与 clustered_users.csv，同时累计簇画像，返回抽样用户"""
+        cluster_config = self.config['clustering']
+        model_config = cluster_config.get('model', {})
+        max_points = cluster_config.get('visualization', {}).get('max_points', 50000)
+        accumulator = ClusterProfileAccumulator(self.model.n_clusters, min(1.0, max_points / max(len(labels), 1)),
+                                                cluster_config.get('random_state', 42))
+        names = dict(enumerate(self.model.labels))
+        csv_path = 'data/results/clustered_users.csv'
+        tmp_path = csv_path + '.tmp'
+        
+        def frames():
+            offset = 0
+            for i, df in enumerate(iter_store_frames(self.store_path, chunk_size)):
+                df['cluster'] = labels[offset:offset + len(df)]
+                offset += len(df)
+                accumulator.update(df)
+                df.assign(cluster_label=df['cluster'].map(names)).to_csv(
+                    tmp_path, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+                yield df
+        
+        save_assignment_chunks(frames(), model_config.get(
+            'assignments_path', 'data/state/cluster_assignments.parquet'), self.model.version)
+        if os.path.exists(tmp_path):
+            os.replace(tmp_path, csv_path)
+        
+        sample = accumulator.sample()
+        counts, stats = accumulator.stats()
+        self.profile = self.build_profile(counts, stats, self.sample_quantiles(sample).reindex(counts.index))
+        print(f"分块写出 {len(labels)} 个用户的分群结果，画像抽样 {len(sample)} 个用户")
+        return sample
+    
+    def refit(self, df, previous=None):
+        """完整训练聚类模型（全量或流式），与上一版本对齐编号后返回簇编号"""
+        cluster_config = self.config['clustering']
+        mode = cluster_config.get('mode', 'full')
+        start = time.perf_counter()
+        if mode == 'minibatch':
+            labels, inertia, kmeans = self.cluster_minibatch()
+        elif mode == 'full':
+            # 准备特征数据并全量标准化、K-means聚类
+            labels, inertia, self.scaler, kmeans = fit_full_batch(
+                df[FEATURES].values, cluster_config['n_clusters'],
+                cluster_config.get('random_state', 42))
+        else:
+            raise ValueError(f"未知的聚类模式: {mode}")
+        print(f"聚类完成（{mode}）: 耗时 {time.perf_counter() - start:.2f}s, 惯性 {inertia:,.1f}")
+        
+        self.model, labels = ClusterModel.from_fit(self.scaler, kmeans.cluster_centers_, labels,
+                                                   inertia, previous)
+        return labels
+    
+    def assign(self, df, model):
+        """用已保存模型为新增或RFM值变化的用户分配簇，其余用户沿用上次结果
+
+        返回 (簇编号, 漂移比)；漂移比为本次分配用户的平均距离平方与训练时之比。
+        """
+        start = time.perf_counter()
+        assignments_path = self.config['clustering'].get('model', {}).get(
+            'assignments_path', 'data/state/cluster_assignments.parquet')
+        previous, version = load_assignments(assignments_path)
+        
+        clusters = np.full(len(df), -1, dtype=np.int16)
+        if previous is not None and version == model.version:
+            merged = df[['user_key'] + FEATURES].merge(previous, on='user_key', how='left',
+                                                      suffixes=('', '_previous'))
+            unchanged = np.ones(len(df), dtype=bool)
+            for column in FEATURES:
+                unchanged &= (merged[column] == merged[column + '_previous']).to_numpy()
+            clusters[unchanged] = merged['cluster'].to_numpy()[unchanged]
+        changed = clusters < 0
+        
+        clusters[changed], distances = model.assign(df.loc[changed, FEATURES].to_numpy())
+        drift = model.drift_ratio(distances)
+        print(f"模型版本 {model.version} 增量分配: {int(changed.sum())}/{len(df)} 个用户, "
+              f"漂移比 {drift:.2f}, 耗时 {time.perf_counter() - start:.2f}s")
+        return clusters, drift
+    
+    def cluster_minibatch(self):
+        """流式聚类: 分块读取RFM结果，增量拟合标准化器和Mini-batch K-means，返回 (labels, inertia, kmeans)"""
+        cluster_config = self.config['clustering']
+        minibatch_config = cluster_config.get('minibatch', {})
+        chunks = feature_chunk_source(self.store_path, 'data/results/rfm_scores.csv',
+                                      minibatch_config.get('chunk_size', 1000000))
+        
+        options = {
+            'n_clusters': cluster_config['n_clusters'],
+            'random_state': cluster_config.get('random_state', 42),
+            'batch_size': minibatch_config.get('batch_size', 16384),
+            'max_epochs': minibatch_config.get('max_epochs', 1)
+        }
+        if minibatch_config.get('compare_full_batch', False):
+            compare_with_full_batch(chunks, **options)
+        
+        self.scaler, kmeans = fit_streaming_kmeans(chunks, **options)
+        labels, inertia = predict_chunks(chunks, self.scaler, kmeans)
+        return labels, inertia, kmeans
+    
+    def select_k(self):
+        """模型选择: 多进程扫描k范围，输出惯性/轮廓系数报告，返回轮廓系数最高的k"""
+        df = self.load_rfm_data()
+        if df is None:
+            return None
+        
+        cluster_config = self.config['clustering']
+        selection_config = cluster_config.get('k_selection', {})
+        k_values = range(selection_config.get('k_min', 2), selection_config.get('k_max', 10) + 1)
+        
+        start = time.perf_counter()
+        report = sweep_k(df, FEATURES, k_values,
+                         sample_size=selection_config.get('sample_size', 200000),
+                         silhouette_sample_size=selection_config.get('silhouette_sample_size', 20000),
+                         workers=selection_config.get('workers'),
+                         random_state=cluster_config.get('random_state', 42))
+        best_k = int(report.loc[report['silhouette'].idxmax(), 'k'])
+        report['chosen'] = report['k'] == best_k
+        
+        report_path = selection_config.get('report_path', 'data/results/k_selection.csv')
+        os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+        report.round(4).to_csv(report_path, index=False)
+        print(report.round(4).to_string(index=False))
+        print(f"k扫描完成: 耗时 {time.perf_counter() - start:.1f}s, 轮廓系数最优 k={best_k}, "
+              f"肘部 k={elbow_k(report)}, 当前配置 k={cluster_config['n_clusters']}")
+        print(f"模型选择报告已保存到 {report_path}")
+        return best_k
+    
+    def get_cluster_profile(self, df):
+        """各簇画像（用户数、占比、R/F/M均值/标准差/四分位数），一次分组计算后缓存，供摘要、图表和报告共用"""
+        if self.profile is not None:
+            return self.profile
+        
+        grouped = df.groupby('cluster', sort=True)[FEATURES]
+        self.profile = self.build_profile(grouped.size(), grouped.agg(['mean', 'std']),
+                                          self.sample_quantiles(df))
+        return self.profile
+    
+    @staticmethod
+    def sample_quantiles(df):
+        """各簇R/F/M四分位数，列为 (特征, p25|p50|p75)"""
+        quantiles = df.groupby('cluster', sort=True)[FEATURES].quantile([0.25, 0.5, 0.75]).unstack()
+        quantiles.columns = pd.MultiIndex.from_tuples(
+            [(feature, f'p{int(q * 100)}') for feature, q in quantiles.columns])
+        return quantiles
+    
+    def build_profile(self, counts, stats, quantiles):
+        """由各簇用户数、均值/标准差与四分位数组装画像表"""
+        profile = pd.concat([stats, quantiles], axis=1)
+        profile = profile[[(feature, stat) for feature in FEATURES
+                           for stat in ('mean', 'std', 'p25', 'p50', 'p75')]]
+        profile.columns = [f'{feature}_{stat}' for feature, stat in profile.columns]
+        
+        profile.insert(0, 'user_count', counts)
+        profile.insert(1, 'share', counts / counts.sum())
+        # 聚类标签: 簇编号已按RFM价值画像对齐，与模型中保存的名称一一对应
+        profile.insert(0, 'cluster_label', [self.model.labels[cluster] for cluster in profile.index])
+        return profile
+    
     def analyze_clusters(self, df):
         """分析聚类结果"""
         print("\n=== 聚类结果分析 ===")
         
-        cluster_summary = df.groupby('cluster').agg({
-            'recency_days': ['mean', 'std'],
-            'frequency': ['mean', 'std'],
-            'monetary_value': ['mean', 'std'],
-            'user_key': 'count'
-        }).round(2)
-        
+        cluster_summary = self.get_cluster_profile(df).round(2)
         print(cluster_summary)
         
-        # 定义聚类标签
-        cluster_labels = {
-            0: "低价值用户",
-            1: "潜力用户", 
-            2: "活跃用户",
-            3: "高价值用户"
-        }
-        
-        df['cluster_label'] = df['cluster'].map(cluster_labels)
+        df['cluster_label'] = df['cluster'].map(dict(enumerate(self.model.labels)))
         
         # 保存聚类摘要
         cluster_summary.to_csv('data/results/cluster_summary.csv')
@@ -99,34 +350,46 @@ class UserSegmentation:
         print("生成聚类可视化图表...")
         
         # 设置中文字体
-        plt.rcParams['font.sans-serif'] = ['SimHei']
-        plt.rcParams['axes.unicode_minus'] = False
-        
-        # 创建子图
-        fig, axes = plt.subplots(2, 2, figsize=(15, 12))
+        matplotlib.rcParams['font.sans-serif'] = ['SimHei']
+        matplotlib.rcParams['axes.unicode_minus'] = False
+        
+        # 创建子图（面向对象API，不经过pyplot全局状态）
+        fig = Figure(figsize=(15, 12))
+        axes = fig.subplots(2, 2)
+        
+        # 散点图渲染方式: 点数较多时自动切换为分簇抽样或网格密度图，渲染耗时不随用户数增长
+        scatter_config = self.config['clustering'].get('visualization', {})
+        scatter_options = {
+            'mode': scatter_config.get('scatter_mode', 'auto'),
+            'max_points': scatter_config.get('max_points', 50000),
+            'density_threshold': scatter_config.get('density_threshold', 1000000),
+            'gridsize': scatter_config.get('gridsize', 300)
+        }
         
         # RFM散点图
-        axes[0, 0].scatter(df['recency_days'], df['monetary_value'], 
-                          c=df['cluster'], cmap='viridis', alpha=0.6)
+        mode = plot_cluster_scatter(axes[0, 0], df['recency_days'], df['monetary_value'],
+                                    df['cluster'], **scatter_options)
         axes[0, 0].set_xlabel('最近活跃天数')
         axes[0, 0].set_ylabel('观看时长(分钟)')
         axes[0, 0].set_title('用户聚类分布 (R-M)')
         
         # 频次-价值散点图
-        axes[0, 1].scatter(df['frequency'], df['monetary_value'], 
-                          c=df['cluster'], cmap='viridis', alpha=0.6)
+        plot_cluster_scatter(axes[0, 1], df['frequency'], df['monetary_value'],
+                             df['cluster'], **scatter_options)
         axes[0, 1].set_xlabel('观看频次')
         axes[0, 1].set_ylabel('观看时长(分钟)')
         axes[0, 1].set_title('用户聚类分布 (F-M)')
+        print(f"散点图渲染方式: {mode}（{len(df)} 个用户）")
+        
+        profile = self.get_cluster_profile(df).set_index('cluster_label')
         
         # 聚类分布饼图
-        cluster_counts = df['cluster_label'].value_counts()
-        axes[1, 0].pie(cluster_counts.values, labels=cluster_counts.index, 
+        axes[1, 0].pie(profile['user_count'].values, labels=profile.index, 
                        autopct='%1.1f%%', startangle=90)
         axes[1, 0].set_title('用户分群比例')
         
         # RFM雷达图
-        cluster_means = df.groupby('cluster_label')[['recency_days', 'frequency', 'monetary_value']].mean()
+        cluster_means = profile[[f'{feature}_mean' for feature in FEATURES]]
         cluster_means = cluster_means.div(cluster_means.max())  # 归一化
         
         for i, (cluster, values) in enumerate(cluster_means.iterrows()):
@@ -137,11 +400,11 @@ class UserSegmentation:
         axes[1, 1].legend()
         axes[1, 1].grid(True)
         
-        plt.tight_layout()
-        plt.savefig('outputs/charts/user_segmentation.png', dpi=300, bbox_inches='tight')
-        plt.close()
+        fig.tight_layout()
+        paths = save_figure(fig, 'outputs/charts', 'user_segmentation',
+                            scatter_config.get('formats', ['png']), 300)
         
-        print("聚类可视化图表已保存到 outputs/charts/user_segmentation.png")
+        print(f"聚类可视化图表已保存到 {', '.join(paths)}")
     
     def generate_segmentation_report(self, df):
         """生成分群报告"""
@@ -159,10 +422,9 @@ class UserSegmentation:
         pdf.cell(0, 10, '聚类统计信息', 0, 1)
         pdf.set_font('Arial', '', 10)
         
-        cluster_stats = df.groupby('cluster_label').size()
-        for cluster, count in cluster_stats.items():
-            percentage = count / len(df) * 100
-            pdf.cell(0, 8, f'{cluster}: {count} 用户 ({percentage:.1f}%)', 0, 1)
+        profile = self.get_cluster_profile(df)
+        for _, row in profile.iterrows():
+            pdf.cell(0, 8, f'{row["cluster_label"]}: {row["user_count"]} 用户 ({row["share"] * 100:.1f}%)', 0, 1)
         
         pdf.ln(10)
         
@@ -171,12 +433,11 @@ class UserSegmentation:
         pdf.cell(0, 10, '各分群特征分析', 0, 1)
         pdf.set_font('Arial', '', 10)
         
-        for cluster in df['cluster_label'].unique():
-            cluster_data = df[df['cluster_label'] == cluster]
-            pdf.cell(0, 8, f'{cluster}:', 0, 1)
-            pdf.cell(0, 6, f'  平均活跃天数: {cluster_data["recency_days"].mean():.1f}', 0, 1)
-            pdf.cell(0, 6, f'  平均观看频次: {cluster_data["frequency"].mean():.1f}', 0, 1)
-            pdf.cell(0, 6, f'  平均观看时长: {cluster_data["monetary_value"].mean():.1f}分钟', 0, 1)
+        for _, row in profile.iterrows():
+            pdf.cell(0, 8, f'{row["cluster_label"]}:', 0, 1)
+            pdf.cell(0, 6, f'  平均活跃天数: {row["recency_days_mean"]:.1f}', 0, 1)
+            pdf.cell(0, 6, f'  平均观看频次: {row["frequency_mean"]:.1f}', 0, 1)
+            pdf.cell(0, 6, f'  平均观看时长: {row["monetary_value_mean"]:.1f}分钟', 0, 1)
             pdf.ln(5)
         
         # 保存报告
@@ -1,17 +1,43 @@
 # generate_simulated_data.py
+import os
+import gzip
+import argparse
 import pandas as pd
 import numpy as np
+import yaml
 from faker import Faker
 from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
 import random
 
 # 初始化Faker
 fake = Faker('zh_CN')
 
-# 用户相关配置
-user_count = 10000
-video_count = 500
-watch_records = 500000
+# 默认生成参数（可由 config/data_generation_config.yaml 或命令行覆盖）
+default_params = {
+    'user_count': 10000,
+    'video_count': 500,
+    'watch_records': 500000,
+    'random_seed': 42,
+    'sharded': False,
+    'shards': 8,
+    'workers': None,
+    'batch_size': 1000000,
+    'format': 'csv',
+    'schema': 'watch_records',
+    'output_dir': 'data/simulated',
+    'profile': 'uniform',
+    'workload_profiles': {}
+}
+
+# 高等级用户（观看时长额外增加）
+premium_levels = ['钻石', '星耀', '王者']
+
+# 网络类型配置
+network_types = ['4G', '5G', 'WIFI', '有线']
+
+# 码率配置（raw_media.bitrate）
+bitrates = ['360P', '480P', '720P', '1080P', '4K']
 
 # 用户等级配置
 user_levels = ['青铜', '白银', '黄金', '铂金', '钻石', '星耀', '王者']
@@ -33,7 +59,7 @@ video_categories = {
 # 平台配置
 platforms = ['腾讯视频', '爱奇艺', '优酷', '芒果TV', 'Bilibili', '西瓜视频']
 
-def generate_users():
+def generate_users(user_count=default_params['user_count']):
     """生成用户数据"""
     users = []
     for i in range(user_count):
@@ -50,7 +76,7 @@ def generate_users():
         })
     return pd.DataFrame(users)
 
-def generate_videos():
+def generate_videos(video_count=default_params['video_count']):
     """生成影视作品数据"""
     videos = []
     for i in range(video_count):
@@ -70,36 +96,261 @@ def generate_videos():
         })
     return pd.DataFrame(videos)
 
-def generate_watch_records(users_df, videos_df):
-    """生成观看记录数据"""
-    records = []
-    user_ids = users_df['user_id'].tolist()
-    video_ids = videos_df['video_id'].tolist()
-    
-    for i in range(watch_records):
-        user_id = random.choice(user_ids)
-        video_id = random.choice(video_ids)
-        user_data = users_df[users_df['user_id'] == user_id].iloc[0]
-        video_data = videos_df[videos_df['video_id'] == video_id].iloc[0]
+def seed_streams(seed):
+    """由随机种子派生两条相互独立的种子序列: (负载画像, 观看记录)"""
+    workload, records = np.random.SeedSequence(seed).spawn(2)
+    return workload, records
+
+def build_lookup_tables(users_df, videos_df, profile=None, seed=default_params['random_seed']):
+    """提取按下标取值的用户/视频属性数组，并按负载画像预计算抽样分布"""
+    tables = {
+        'user_id': users_df['user_id'].to_numpy(),
+        'phone_no': users_df['phone_no'].to_numpy(),
+        'is_premium': users_df['user_level'].isin(premium_levels).to_numpy(),
+        'device_preference': users_df['device_preference'].to_numpy(),
+        'video_id': videos_df['video_id'].to_numpy(),
+        'video_duration': videos_df['duration'].to_numpy(),
+        'platform': videos_df['platform'].to_numpy()
+    }
+    if profile:
+        build_workload_tables(tables, users_df, videos_df, profile, seed)
+    return tables
+
+def _cdf(weights):
+    """权重归一化为累积概率"""
+    cdf = np.cumsum(np.asarray(weights, dtype=np.float64))
+    return cdf / cdf[-1]
+
+def _sample(rng, cdf, n):
+    """按累积概率批量抽取下标"""
+    return np.minimum(np.searchsorted(cdf, rng.random(n), side='right'), len(cdf) - 1)
+
+def build_workload_tables(tables, users_df, videos_df, profile, seed):
+    """按负载画像预计算抽样分布（热门视频、重度用户、星期/小时曲线、突发流量）"""
+    rng = np.random.default_rng(seed_streams(seed)[0])
+    
+    # 视频热度服从Zipf分布: 按popularity_score排名，权重 ∝ 1 / rank^s
+    hot_order = np.argsort(-videos_df['popularity_score'].to_numpy(), kind='stable')
+    if profile.get('video_zipf_exponent'):
+        ranks = np.empty(len(videos_df))
+        ranks[hot_order] = np.arange(1, len(videos_df) + 1)
+        tables['video_cdf'] = _cdf(ranks ** -profile['video_zipf_exponent'])
+    
+    # 用户活跃度服从幂律（Pareto）分布，少数重度用户贡献大量观看
+    if profile.get('user_pareto_alpha'):
+        tables['user_cdf'] = _cdf(rng.pareto(profile['user_pareto_alpha'], len(users_df)) + 1)
+    
+    if profile.get('weekday_weights') or profile.get('hour_weights'):
+        tables['weekday_weights'] = np.asarray(profile.get('weekday_weights', [1] * 7), dtype=np.float64)
+        tables['hour_cdf'] = _cdf(profile.get('hour_weights', [1] * 24))
+    
+    tables['bursts'] = profile.get('bursts', [])
+    tables['hot_videos'] = hot_order
+    return tables
+
+def draw_timestamps(rng, tables, n_records, end_time):
+    """抽样观看时间: 默认最近30天均匀分布；配置星期/小时曲线时按曲线抽样最近30个整天"""
+    window = 30 * 24 * 3600
+    if 'hour_cdf' not in tables:
+        return end_time - window + rng.integers(0, window + 1, n_records).astype('timedelta64[s]')
+    
+    days = end_time.astype('datetime64[D]') - np.arange(30, 0, -1)
+    weekday = (days.astype(np.int64) + 3) % 7  # 1970-01-01为周四，0表示周一
+    day_idx = _sample(rng, _cdf(tables['weekday_weights'][weekday]), n_records)
+    hour = _sample(rng, tables['hour_cdf'], n_records)
+    seconds = hour * 3600 + rng.integers(0, 3600, n_records)
+    return days[day_idx].astype('datetime64[s]') + seconds.astype('timedelta64[s]')
+
+def draw_watch_arrays(rng, tables, n_records, end_time):
+    """批量抽样一批观看行为（NumPy数组）"""
+    # 批量抽取用户和视频下标，按下标取属性，避免逐条过滤DataFrame
+    if 'user_cdf' in tables:
+        user_idx = _sample(rng, tables['user_cdf'], n_records)
+    else:
+        user_idx = rng.integers(0, len(tables['user_id']), n_records)
+    if 'video_cdf' in tables:
+        video_idx = _sample(rng, tables['video_cdf'], n_records)
+    else:
+        video_idx = rng.integers(0, len(tables['video_id']), n_records)
+    
+    # 突发流量: 按比例选出部分记录，集中到指定时段和最热门的几个视频
+    bursts = tables.get('bursts', [])
+    burst_masks = [rng.random(n_records) < burst['share'] for burst in bursts]
+    for burst, mask in zip(bursts, burst_masks):
+        hot = tables['hot_videos'][:burst.get('hot_videos', len(tables['video_id']))]
+        video_idx[mask] = hot[rng.integers(0, len(hot), int(mask.sum()))]
+    
+    video_duration = tables['video_duration'][video_idx]
+    is_premium = tables['is_premium'][user_idx]
+    
+    # 基于用户等级调整观看行为: 高等级用户额外观看10-30分钟，不超过片长
+    watch_duration = rng.integers(5, video_duration + 1)
+    boost = rng.integers(10, 31, n_records)
+    watch_duration = np.where(is_premium, np.minimum(watch_duration + boost, video_duration), watch_duration)
+    
+    watch_date = draw_timestamps(rng, tables, n_records, end_time)
+    for burst, mask in zip(bursts, burst_masks):
+        start = (end_time.astype('datetime64[D]') - burst['days_ago']).astype('datetime64[s]') \
+            + np.timedelta64(burst['hour'] * 3600, 's')
+        offsets = rng.integers(0, burst.get('hours', 1) * 3600, int(mask.sum()))
+        watch_date[mask] = start + offsets.astype('timedelta64[s]')
+    
+    return {
+        'user_idx': user_idx,
+        'video_idx': video_idx,
+        'watch_date': watch_date,
+        'watch_duration': watch_duration,
+        'video_duration': video_duration,
+        'network_idx': rng.integers(0, len(network_types), n_records),
+        'bitrate_idx': rng.integers(0, len(bitrates), n_records)
+    }
+
+def format_watch_records(arrays, tables, start_index, id_width=8):
+    """按 simulated_watch_records 结构组织一批观看记录"""
+    n_records = len(arrays['user_idx'])
+    record_no = np.arange(start_index, start_index + n_records).astype(str)
+    
+    return pd.DataFrame({
+        'record_id': np.char.add('R', np.char.zfill(record_no, id_width)),
+        'user_id': tables['user_id'][arrays['user_idx']],
+        'video_id': tables['video_id'][arrays['video_idx']],
+        'watch_date': arrays['watch_date'],
+        'watch_duration': arrays['watch_duration'],
+        'device_type': tables['device_preference'][arrays['user_idx']],
+        'network_type': np.asarray(network_types)[arrays['network_idx']],
+        'complete_rate': arrays['watch_duration'] / arrays['video_duration']
+    })
+
+def format_raw_media(arrays, tables):
+    """按 raw_media 表结构（01_ddl_table_creation.hql）组织一批观看记录"""
+    return pd.DataFrame({
+        'phone_no': tables['phone_no'][arrays['user_idx']],
+        'duration': arrays['watch_duration'] * 60,
+        'station_name': tables['platform'][arrays['video_idx']],
+        'origin_time': np.char.replace(np.datetime_as_string(arrays['watch_date'], unit='s'), 'T', ' '),
+        'channel_id': tables['video_id'][arrays['video_idx']],
+        'bitrate': np.asarray(bitrates)[arrays['bitrate_idx']],
+        'network_type': np.asarray(network_types)[arrays['network_idx']]
+    })
+
+def generate_watch_records(users_df, videos_df, n_records=default_params['watch_records'],
+                           seed=default_params['random_seed'], end_time=None, profile=None):
+    """生成观看记录数据（NumPy批量抽样，end_time默认为当前时间，profile为负载画像）"""
+    rng = np.random.default_rng(seed_streams(seed)[1])
+    tables = build_lookup_tables(users_df, videos_df, profile, seed)
+    end = np.datetime64(end_time or datetime.now().replace(microsecond=0), 's')
+    
+    width = max(8, len(str(max(n_records - 1, 0))))
+    return format_watch_records(draw_watch_arrays(rng, tables, n_records, end), tables, 0, width)
+
+class PartitionedShardWriter:
+    """单个分片的流式写出器: 按 dt=yyyy-MM-dd 目录分区，每个分区一个压缩文件"""
+    
+    def __init__(self, output_dir, shard_index, file_format):
+        self.output_dir = output_dir
+        self.shard_index = shard_index
+        self.file_format = file_format
+        self.writers = {}
+        self.rows = 0
+    
+    def _open(self, partition, frame):
+        directory = os.path.join(self.output_dir, f'dt={partition}')
+        os.makedirs(directory, exist_ok=True)
         
-        # 基于用户等级和设备类型调整观看行为
-        watch_duration = random.randint(5, video_data['duration'])
-        if user_data['user_level'] in ['钻石', '星耀', '王者']:
-            watch_duration = min(watch_duration + random.randint(10, 30), video_data['duration'])
+        if self.file_format == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            
+            path = os.path.join(directory, f'part-{self.shard_index:05d}.parquet')
+            schema = pa.Table.from_pandas(frame, preserve_index=False).schema
+            return pq.ParquetWriter(path, schema, compression='snappy')
         
-        records.append({
-            'record_id': f'R{i:08d}',
-            'user_id': user_id,
-            'video_id': video_id,
-            'watch_date': fake.date_time_between(start_date='-30d', end_date='now'),
-            'watch_duration': watch_duration,
-            'device_type': user_data['device_preference'],
-            'network_type': random.choice(['4G', '5G', 'WIFI', '有线']),
-            'complete_rate': watch_duration / video_data['duration']
-        })
-    return pd.DataFrame(records)
+        path = os.path.join(directory, f'part-{self.shard_index:05d}.csv.gz')
+        return gzip.open(path, 'wt', compresslevel=6, encoding='utf-8', newline='')
+    
+    def write(self, frame, watch_date):
+        """按观看日期拆分后追加写入对应分区文件"""
+        days = np.datetime_as_string(watch_date.astype('datetime64[D]'))
+        codes, partitions = pd.factorize(days)
+        
+        for code, partition in enumerate(partitions):
+            part = frame[codes == code]
+            is_new = partition not in self.writers
+            if is_new:
+                self.writers[partition] = self._open(partition, part)
+            
+            if self.file_format == 'parquet':
+                import pyarrow as pa
+                
+                self.writers[partition].write_table(pa.Table.from_pandas(part, preserve_index=False))
+            else:
+                part.to_csv(self.writers[partition], header=is_new, index=False)
+        
+        self.rows += len(frame)
+    
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+
+# 进程池worker共享的用户/视频属性数组（由initializer设置一次）
+_worker_tables = None
+
+def _init_worker(tables):
+    global _worker_tables
+    _worker_tables = tables
+
+def generate_shard(shard_index, n_records, start_index, seed_sequence, end_time, params):
+    """生成一个分片: 以独立种子流分批抽样并流式写出，内存只与batch_size相关"""
+    rng = np.random.default_rng(seed_sequence)
+    id_width = max(8, len(str(max(params['watch_records'] - 1, 0))))
+    writer = PartitionedShardWriter(params['output_dir'], shard_index, params['format'])
+    
+    try:
+        for offset in range(0, n_records, params['batch_size']):
+            batch_size = min(params['batch_size'], n_records - offset)
+            arrays = draw_watch_arrays(rng, _worker_tables, batch_size, end_time)
+            if params['schema'] == 'raw_media':
+                frame = format_raw_media(arrays, _worker_tables)
+            else:
+                frame = format_watch_records(arrays, _worker_tables, start_index + offset, id_width)
+            writer.write(frame, arrays['watch_date'])
+    finally:
+        writer.close()
+    
+    print(f"分片 {shard_index} 完成: {writer.rows} 条记录")
+    return writer.rows
+
+def generate_sharded_dataset(params):
+    """多进程分片生成观看记录，按dt分区流式写出"""
+    print(f"分片生成模式: {params['watch_records']} 条记录, {params['shards']} 个分片, "
+          f"格式 {params['format']}, 结构 {params['schema']}, 负载画像 {params['profile']}")
+    os.makedirs(params['output_dir'], exist_ok=True)
+    
+    users_df = generate_users(params['user_count'])
+    videos_df = generate_videos(params['video_count'])
+    users_df.to_csv(os.path.join(params['output_dir'], 'users.csv'), index=False, encoding='utf-8')
+    videos_df.to_csv(os.path.join(params['output_dir'], 'videos.csv'), index=False, encoding='utf-8')
+    tables = build_lookup_tables(users_df, videos_df, params['workload'], params['random_seed'])
+    
+    # 每个分片独立、确定的种子流（由观看记录种子序列派生，与负载画像种子序列互不相关）；所有分片共用同一时间窗口
+    seed_sequences = seed_streams(params['random_seed'])[1].spawn(params['shards'])
+    end_time = np.datetime64(datetime.now().replace(microsecond=0), 's')
+    base, remainder = divmod(params['watch_records'], params['shards'])
+    counts = [base + (1 if i < remainder else 0) for i in range(params['shards'])]
+    starts = np.cumsum([0] + counts[:-1])
+    
+    with ProcessPoolExecutor(max_workers=params['workers'], initializer=_init_worker,
+                             initargs=(tables,)) as pool:
+        futures = [pool.submit(generate_shard, i, counts[i], int(starts[i]), seed_sequences[i],
+                               end_time, params)
+                   for i in range(params['shards'])]
+        total = sum(future.result() for future in futures)
+    
+    print(f"分片生成完成: {total} 条记录写入 {params['output_dir']}")
+    return total
 
-def generate_category_rankings(videos_df, watch_df):
+def generate_category_rankings(videos_df, watch_df, users_df):
     """生成各类别榜单"""
     # 合并数据
     merged_df = watch_df.merge(videos_df, on='video_id')
@@ -127,27 +378,50 @@ def generate_category_rankings(videos_df, watch_df):
     
     return total_watch_rank, platform_rank, user_watch_rank
 
-if __name__ == "__main__":
+def load_generation_params(args):
+    """合并默认参数、配置文件与命令行参数"""
+    params = dict(default_params)
+    if args.config and os.path.exists(args.config):
+        with open(args.config, 'r', encoding='utf-8') as f:
+            params.update(yaml.safe_load(f).get('data_generation', {}))
+    
+    for key in default_params:
+        value = getattr(args, key, None)
+        if value is not None and value is not False:
+            params[key] = value
+    
+    # 解析负载画像（uniform为原始的均匀分布）
+    if params['profile'] == 'uniform':
+        params['workload'] = params['workload_profiles'].get('uniform', {})
+    elif params['profile'] in params['workload_profiles']:
+        params['workload'] = params['workload_profiles'][params['profile']]
+    else:
+        raise ValueError(f"未定义的负载画像: {params['profile']}")
+    return params
+
+def generate_default_dataset(params):
+    """单进程生成用户、影视作品、观看记录及榜单（写入 data/ 目录）"""
     print("开始生成模拟数据...")
     
     # 生成用户数据
     print("生成用户数据...")
-    users_df = generate_users()
+    users_df = generate_users(params['user_count'])
     users_df.to_csv('data/simulated_users.csv', index=False, encoding='utf-8')
     
     # 生成视频数据
     print("生成影视作品数据...")
-    videos_df = generate_videos()
+    videos_df = generate_videos(params['video_count'])
     videos_df.to_csv('data/simulated_videos.csv', index=False, encoding='utf-8')
     
     # 生成观看记录
     print("生成观看记录数据...")
-    watch_df = generate_watch_records(users_df, videos_df)
+    watch_df = generate_watch_records(users_df, videos_df, params['watch_records'], params['random_seed'],
+                                      profile=params['workload'])
     watch_df.to_csv('data/simulated_watch_records.csv', index=False, encoding='utf-8')
     
     # 生成榜单数据
     print("生成各类榜单...")
-    total_rank, platform_rank, user_rank = generate_category_rankings(videos_df, watch_df)
+    total_rank, platform_rank, user_rank = generate_category_rankings(videos_df, watch_df, users_df)
     
     total_rank.to_csv('data/category_ranking.csv', index=False, encoding='utf-8')
     platform_rank.to_csv('data/platform_ranking.csv', index=False, encoding='utf-8')
@@ -166,3 +440,32 @@ if __name__ == "__main__":
     print(users_df['device_preference'].value_counts())
     print("\n影视类别分布:")
     print(videos_df['main_category'].value_counts())
+
+def main():
+    parser = argparse.ArgumentParser(description='生成模拟视频观看数据')
+    parser.add_argument('--config', default='config/data_generation_config.yaml', help='数据生成配置文件')
+    parser.add_argument('--users', dest='user_count', type=int, help='用户数量')
+    parser.add_argument('--videos', dest='video_count', type=int, help='影视作品数量')
+    parser.add_argument('--records', dest='watch_records', type=int, help='观看记录数量')
+    parser.add_argument('--seed', dest='random_seed', type=int, help='随机种子')
+    parser.add_argument('--sharded', action='store_true', help='多进程分片流式生成（压测数据）')
+    parser.add_argument('--shards', type=int, help='分片数量')
+    parser.add_argument('--workers', type=int, help='进程数，默认CPU核数')
+    parser.add_argument('--batch-size', dest='batch_size', type=int, help='每批生成的记录数')
+    parser.add_argument('--format', choices=['csv', 'parquet'], help='分片文件格式（csv为gzip压缩）')
+    parser.add_argument('--schema', choices=['watch_records', 'raw_media'], help='输出表结构')
+    parser.add_argument('--output-dir', dest='output_dir', help='分片输出目录')
+    parser.add_argument('--profile', help='负载画像（见配置 workload_profiles）')
+    params = load_generation_params(parser.parse_args())
+    
+    # 固定随机种子
+    random.seed(params['random_seed'])
+    Faker.seed(params['random_seed'])
+    
+    if params['sharded']:
+        generate_sharded_dataset(params)
+    else:
+        generate_default_dataset(params)
+
+if __name__ == "__main__":
+    main()
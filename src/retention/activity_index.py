@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按日活跃用户位图索引（DAU/WAU/MAU、N日留存、分群与活跃交集）
+Daily Active User Bitmap Index
+
+用户标识映射为稠密编号（按首次出现顺序分配，存于 users.npy），每天一个活跃用户集合：
+稀疏时存为排序的uint32编号数组，稠密时存为uint64位图，取两者中较小者（同Roaring的数组/位图容器）。
+查询时统一展开为位图，用按位与/或 + popcount 计算。
+按日期顺序追加时，某天的新用户恰好是一段连续编号，同期群无需单独存储。
+"""
+
+import os
+import json
+from datetime import date, timedelta
+
+import pandas as pd
+import numpy as np
+
+from rfm_analysis.incremental import validate_partition
+
+MANIFEST_FILE = 'manifest.json'
+USERS_FILE = 'users.npy'
+
+
+def _popcount(words):
+    """uint64位图中置位的个数"""
+    if hasattr(np, 'bitwise_count'):
+        return int(np.bitwise_count(words).sum())
+    return int(np.unpackbits(words.view(np.uint8)).sum())
+
+
+def _shift_day(day, days):
+    return (date.fromisoformat(day) + timedelta(days=days)).isoformat()
+
+
+class ActivityIndex:
+    """本地磁盘上的按日活跃用户位图索引"""
+
+    def __init__(self, directory='data/activity_index'):
+        """打开（或新建）索引目录"""
+        self.directory = directory
+        manifest_path = os.path.join(directory, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                self.manifest = json.load(f)
+            self.users = pd.Index(np.load(os.path.join(directory, USERS_FILE), allow_pickle=False))
+        else:
+            self.manifest = {'days': {}}
+            self.users = pd.Index([])
+        self._cache = {}
+
+    @property
+    def days(self):
+        return sorted(self.manifest['days'])
+
+    @property
+    def last_day(self):
+        return self.days[-1] if self.manifest['days'] else None
+
+    @property
+    def n_words(self):
+        return (len(self.users) + 63) // 64
+
+    def _day_path(self, day):
+        return os.path.join(self.directory, f'day={day}.npy')
+
+    def _write_manifest(self):
+        os.makedirs(self.directory, exist_ok=True)
+        users_tmp = os.path.join(self.directory, USERS_FILE + '.tmp.npy')
+        values = self.users.to_numpy()
+        np.save(users_tmp, values if values.dtype.kind in 'iu' else values.astype(str))
+        os.replace(users_tmp, os.path.join(self.directory, USERS_FILE))
+
+        manifest_tmp = os.path.join(self.directory, MANIFEST_FILE + '.tmp')
+        with open(manifest_tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+        os.replace(manifest_tmp, os.path.join(self.directory, MANIFEST_FILE))
+
+    def bitmap_of(self, ids):
+        """稠密编号数组转换为覆盖全部用户的uint64位图"""
+        ids = np.asarray(ids, dtype=np.int64)
+        words = np.zeros(self.n_words, dtype=np.uint64)
+        np.bitwise_or.at(words, ids >> 6, np.uint64(1) << (ids & 63).astype(np.uint64))
+        return words
+
+    def user_bitmap(self, user_keys):
+        """任意用户集合（如某个分群）的位图，索引中不存在的用户忽略"""
+        ids = self.users.get_indexer(pd.Index(user_keys))
+        return self.bitmap_of(ids[ids >= 0])
+
+    def append_day(self, day, user_keys):
+        """追加一天的活跃用户（日期须晚于已有的最后一天），返回当天活跃用户数"""
+        validate_partition(day)
+        if self.last_day is not None and day <= self.last_day:
+            raise ValueError(f"日期 {day} 不晚于索引最后一天 {self.last_day}，补数需重建索引")
+
+        user_keys = pd.Index(user_keys).unique()
+        ids = self.users.get_indexer(user_keys)
+        new = ids < 0
+        new_start = len(self.users)
+        if new.any():
+            ids[new] = np.arange(new_start, new_start + int(new.sum()))
+            self.users = self.users.append(user_keys[new])
+        ids = np.sort(ids).astype(np.uint32)
+
+        # 数组容器每个用户4字节，位图容器每64个用户8字节，取较小者
+        container = ids if len(ids) * 32 <= self.n_words * 64 else self.bitmap_of(ids)
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self._day_path(day) + '.tmp.npy'
+        np.save(tmp_path, container)
+        os.replace(tmp_path, self._day_path(day))
+
+        self.manifest['days'][day] = {'active': len(ids), 'new_start': new_start,
+                                      'new_end': len(self.users),
+                                      'container': 'array' if container is ids else 'bitmap'}
+        self._write_manifest()
+        return len(ids)
+
+    def append_partition(self, partition, chunks, user_column='user_key'):
+        """由一个dt分区的观看事件追加当天位图，已索引的日期直接跳过"""
+        if self.last_day is not None and partition <= self.last_day:
+            print(f"分区 dt={partition} 不晚于活跃索引最后一天 {self.last_day}，跳过")
+            return False
+        users = [pd.unique(np.asarray(chunk[user_column])) for chunk in chunks]
+        users = np.concatenate(users) if users else np.empty(0, dtype=np.int64)
+        n_active = self.append_day(partition, users)
+        print(f"活跃索引追加 dt={partition}: {n_active} 个活跃用户, 累计 {len(self.users)} 个用户")
+        return True
+
+    def active(self, day):
+        """某天活跃用户位图，未索引的日期为空集"""
+        if day not in self.manifest['days']:
+            return np.zeros(self.n_words, dtype=np.uint64)
+        if day not in self._cache:
+            stored = np.load(self._day_path(day))
+            bitmap = self.bitmap_of(stored) if stored.dtype == np.uint32 else stored
+            self._cache[day] = bitmap
+        bitmap = self._cache[day]
+        if len(bitmap) < self.n_words:
+            bitmap = np.concatenate([bitmap, np.zeros(self.n_words - len(bitmap), dtype=np.uint64)])
+        return bitmap
+
+    def active_between(self, start, end):
+        """[start, end] 区间内任意一天活跃的用户位图"""
+        bitmap = np.zeros(self.n_words, dtype=np.uint64)
+        for day in self.days:
+            if start <= day <= end:
+                bitmap |= self.active(day)
+        return bitmap
+
+    def count(self, bitmap):
+        return _popcount(bitmap)
+
+    def dau(self, day):
+        return self.manifest['days'].get(day, {}).get('active', 0)
+
+    def wau(self, day):
+        """截至day的7天活跃用户数"""
+        return self.count(self.active_between(_shift_day(day, -6), day))
+
+    def mau(self, day):
+        """截至day的30天活跃用户数"""
+        return self.count(self.active_between(_shift_day(day, -29), day))
+
+    def cohort(self, day):
+        """day当天首次出现的用户位图（连续编号区间）"""
+        entry = self.manifest['days'].get(day)
+        bitmap = np.zeros(self.n_words, dtype=np.uint64)
+        if entry and entry['new_end'] > entry['new_start']:
+            bitmap = self.bitmap_of(np.arange(entry['new_start'], entry['new_end']))
+        return bitmap
+
+    def cohort_size(self, day):
+        entry = self.manifest['days'].get(day, {})
+        return entry.get('new_end', 0) - entry.get('new_start', 0)
+
+    def retention(self, day, n):
+        """day同期群（当天新用户）的N日留存: (留存人数, 同期群人数)"""
+        cohort_size = self.cohort_size(day)
+        if cohort_size == 0:
+            return 0, 0
+        return self.count(self.cohort(day) & self.active(_shift_day(day, n))), cohort_size
+
+    def segment_active(self, user_keys, start, end):
+        """分群与区间活跃用户的交集人数: (交集人数, 分群人数)"""
+        segment = self.user_bitmap(user_keys)
+        return self.count(segment & self.active_between(start, end)), self.count(segment)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+活跃用户位图索引查询（DAU/WAU/MAU、N日留存、分群活跃交集）
+Activity Index Queries
+
+用法: python src/retention/activity_query.py --date 2024-01-31 --retention 1 7 --segments champions
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import yaml
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from retention.activity_index import ActivityIndex, _shift_day
+from rfm_analysis.segments import compile_segment_lookup, assign_segments
+from rfm_analysis.result_store import store_to_frame
+
+
+def timed(label, query):
+    """执行查询并输出耗时"""
+    start = time.perf_counter()
+    result = query()
+    print(f"{label}: {result} ({(time.perf_counter() - start) * 1000:.1f} ms)")
+    return result
+
+
+def segment_user_keys(rfm_config, names):
+    """由RFM结果与分群规则得到各分群的用户标识"""
+    output = rfm_config['rfm_analysis'].get('output', {})
+    rfm_df = store_to_frame(output.get('store_path', 'data/results/rfm_scores.npy'))
+    lookup, segment_names = compile_segment_lookup(rfm_config['rfm_analysis']['segments'])
+    segments = assign_segments(rfm_df['R_score'], rfm_df['F_score'], rfm_df['M_score'],
+                               lookup, segment_names)
+    return {name: rfm_df['user_key'].to_numpy()[segments == name] for name in names}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='活跃用户位图索引查询')
+    parser.add_argument('--config', default='config/rfm_config.yaml', help='RFM配置文件')
+    parser.add_argument('--date', help='查询日期(yyyy-MM-dd)，默认为索引最后一天')
+    parser.add_argument('--retention', type=int, nargs='*', default=[1, 7],
+                        help='N日留存（同期群为 --date 往前N天的新用户）')
+    parser.add_argument('--segments', nargs='*', default=[],
+                        help='统计分群在截至 --date 的7天内的活跃人数')
+    args = parser.parse_args()
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        rfm_config = yaml.safe_load(f)
+
+    index = ActivityIndex(rfm_config['rfm_analysis'].get('activity_index', {}).get(
+        'path', 'data/activity_index'))
+    day = args.date or index.last_day
+    if day is None:
+        print("活跃索引为空，请先执行 python main.py --mode rfm_daily")
+        return
+    print(f"活跃索引: {len(index.days)} 天, {len(index.users)} 个用户, 查询日期 {day}")
+
+    timed('DAU', lambda: index.dau(day))
+    timed('WAU', lambda: index.wau(day))
+    timed('MAU', lambda: index.mau(day))
+
+    for n in args.retention:
+        cohort_day = _shift_day(day, -n)
+        retained, size = timed(f'{n}日留存 (同期群 {cohort_day})', lambda: index.retention(cohort_day, n))
+        if size:
+            print(f"  留存率 {retained / size * 100:.1f}%")
+
+    if args.segments:
+        for name, user_keys in segment_user_keys(rfm_config, args.segments).items():
+            active, size = timed(f'分群 {name} 近7天活跃',
+                                 lambda: index.segment_active(user_keys, _shift_day(day, -6), day))
+            if size:
+                print(f"  活跃占比 {active / size * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
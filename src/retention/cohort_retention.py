@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+同期群留存计算（按用户的活跃日位图 + 向量化位运算）
+Vectorized Cohort Retention
+
+一次遍历观看事件，为每个用户维护活跃日位图（每64天一个uint64字），
+首次活跃日由最低置位得到，同期群 x 距首次活跃天数 的完整矩阵由位移与按位与得到。
+留存曲线与7日留存表都从同一个矩阵导出。
+"""
+
+import os
+
+import pandas as pd
+import numpy as np
+
+WORD_DAYS = 64
+ONE = np.uint64(1)
+
+
+def _epoch_days(times):
+    """时间转换为距1970-01-01的天数"""
+    return pd.to_datetime(times).to_numpy().astype('datetime64[D]').astype(np.int64)
+
+
+def _lowest_bit(words):
+    """每个非零uint64字最低置位的位置"""
+    lowest = words & (~words + ONE)
+    return np.log2(lowest.astype(np.float64)).astype(np.int64)
+
+
+class RetentionMatrix:
+    """同期群留存矩阵: matrix[i, d] 为首次活跃日 cohort_days[i] 的用户在第d天仍活跃的人数
+
+    cohort_sizes 即第0天人数；last_day 为观测截止日，用于判断某期留存是否已可观测。
+    """
+
+    def __init__(self, cohort_days, matrix, last_day):
+        self.cohort_days = np.asarray(cohort_days, dtype=np.int64)
+        self.matrix = np.asarray(matrix, dtype=np.int64)
+        self.last_day = int(last_day)
+
+    @property
+    def cohort_sizes(self):
+        return self.matrix[:, 0]
+
+    @property
+    def max_offset(self):
+        return self.matrix.shape[1] - 1
+
+    @classmethod
+    def from_counts(cls, cohort_days, offsets, counts, max_offset, last_day=None):
+        """由 (首次活跃日, 距首次活跃天数, 用户数) 三元组构建矩阵（Hive端聚合结果）"""
+        cohort_days = np.asarray(cohort_days, dtype=np.int64)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        keep = (offsets >= 0) & (offsets <= max_offset)
+        cohorts, rows = np.unique(cohort_days[keep], return_inverse=True)
+        matrix = np.zeros((len(cohorts), max_offset + 1), dtype=np.int64)
+        np.add.at(matrix, (rows, offsets[keep]), np.asarray(counts, dtype=np.int64)[keep])
+        if last_day is None:
+            last_day = int((cohort_days + offsets).max()) if len(cohort_days) else 0
+        return cls(cohorts, matrix, last_day)
+
+    def observable(self, period):
+        """截止日前已满period天的同期群"""
+        return self.cohort_days + period <= self.last_day
+
+    def retention_rates(self, periods):
+        """各期留存率(%)，只统计截止日前已满该天数的同期群"""
+        rates = []
+        for period in periods:
+            eligible = self.observable(period)
+            base = self.cohort_sizes[eligible].sum()
+            rates.append(round(float(self.matrix[eligible, period].sum() / base * 100), 1) if base else 0.0)
+        return rates
+
+    def retention_table(self, period=7):
+        """按同期群的N日留存表（cohort_date, cohort_size, retained, retention_rate），不含尚未满N天的同期群"""
+        eligible = self.observable(period)
+        sizes = self.cohort_sizes[eligible]
+        retained = self.matrix[eligible, period]
+        return pd.DataFrame({
+            'cohort_date': self.cohort_days[eligible].astype('datetime64[D]'),
+            'cohort_size': sizes,
+            'retained': retained,
+            'retention_rate': np.round(retained / np.maximum(sizes, 1), 4)
+        })
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, cohort_days=self.cohort_days, matrix=self.matrix,
+                 last_day=np.array(self.last_day))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['cohort_days'], data['matrix'], int(data['last_day']))
+
+
+class ActivityBitmap:
+    """按用户的活跃日位图: words[u, w] 的第b位表示用户u在 origin_day + 64*w + b 当天活跃
+
+    origin_day 按64天对齐，出现更早或更晚的日期时在两侧补零字，已有位不需要移动。
+    """
+
+    def __init__(self):
+        """初始化空位图"""
+        self.user_index = pd.Index([])
+        self.words = np.zeros((0, 0), dtype=np.uint64)
+        self.origin_day = None
+
+    def __len__(self):
+        return len(self.user_index)
+
+    @property
+    def nbytes(self):
+        return self.user_index.memory_usage(deep=True) + self.words.nbytes
+
+    @property
+    def last_day(self):
+        """最后一个有活跃用户的日期（距1970-01-01天数）"""
+        active_words = np.flatnonzero(np.bitwise_or.reduce(self.words, axis=0)) if len(self) else []
+        if len(active_words) == 0:
+            return 0
+        word = np.bitwise_or.reduce(self.words[:, active_words[-1]])
+        return self.origin_day + WORD_DAYS * int(active_words[-1]) + int(word).bit_length() - 1
+
+    def _extend_days(self, first_day, last_day):
+        """扩展位图覆盖的日期范围"""
+        start = first_day - first_day % WORD_DAYS
+        if self.origin_day is None:
+            self.origin_day = start
+        before = max((self.origin_day - start) // WORD_DAYS, 0)
+        after = max((last_day - self.origin_day) // WORD_DAYS + 1 - self.words.shape[1], 0)
+        if before or after:
+            self.words = np.pad(self.words, ((0, 0), (before, after)))
+            self.origin_day -= before * WORD_DAYS
+
+    def _user_positions(self, users):
+        """用户对应的行号，新用户追加零行"""
+        users = pd.Index(users)
+        positions = self.user_index.get_indexer(users)
+        new = positions < 0
+        if new.any():
+            new_users = users[new].unique()
+            positions[new] = len(self) + new_users.get_indexer(users[new])
+            self.user_index = self.user_index.append(new_users)
+            self.words = np.pad(self.words, ((0, len(new_users)), (0, 0)))
+        return positions
+
+    def set_days(self, users, days):
+        """置位一批 (用户, 活跃日)"""
+        days = np.asarray(days, dtype=np.int64)
+        if len(days) == 0:
+            return
+        self._extend_days(int(days.min()), int(days.max()))
+        rows = self._user_positions(users)
+
+        # 同一 (用户, 字) 内的不同位去重后相加即按位或，再一次写回
+        n_words = self.words.shape[1]
+        bit_keys = np.sort((rows * n_words * WORD_DAYS) + (days - self.origin_day))
+        bit_keys = bit_keys[np.r_[True, bit_keys[1:] != bit_keys[:-1]]]
+        word_keys = bit_keys // WORD_DAYS
+        bits = ONE << (bit_keys % WORD_DAYS).astype(np.uint64)
+        starts = np.flatnonzero(np.r_[True, word_keys[1:] != word_keys[:-1]])
+        flat = self.words.reshape(-1)
+        flat[word_keys[starts]] |= np.add.reduceat(bits, starts)
+
+    def update(self, users, times):
+        """将一个观看事件分块折叠进位图"""
+        self.set_days(np.asarray(users), _epoch_days(times))
+
+    def first_positions(self):
+        """每个用户首次活跃日相对origin_day的位置"""
+        first_word = (self.words != 0).argmax(axis=1)
+        word = self.words[np.arange(len(self)), first_word]
+        return first_word * WORD_DAYS + _lowest_bit(word)
+
+    def first_days(self):
+        """每个用户的首次活跃日（距1970-01-01天数）"""
+        return self.origin_day + self.first_positions()
+
+    def _windows(self, positions, block):
+        """每个用户从首次活跃日起第 64*block ~ 64*block+63 天的活跃位（位移拼接相邻两个字）"""
+        rows = np.arange(len(self))
+        start = positions + block * WORD_DAYS
+        word_index = start // WORD_DAYS
+        shift = (start % WORD_DAYS).astype(np.uint64)
+        n_words = self.words.shape[1]
+        low = np.where(word_index < n_words, self.words[rows, np.minimum(word_index, n_words - 1)], 0)
+        high = np.where(word_index + 1 < n_words, self.words[rows, np.minimum(word_index + 1, n_words - 1)], 0)
+        high = np.where(shift > 0, high << ((np.uint64(WORD_DAYS) - shift) % np.uint64(WORD_DAYS)), 0)
+        return (low.astype(np.uint64) >> shift) | high.astype(np.uint64)
+
+    def retention_matrix(self, max_offset=30):
+        """同期群 x 距首次活跃天数(0..max_offset) 的留存人数矩阵"""
+        if len(self) == 0:
+            return RetentionMatrix(np.empty(0), np.zeros((0, max_offset + 1)), 0)
+
+        positions = self.first_positions()
+        cohorts, rows = np.unique(positions, return_inverse=True)
+        matrix = np.zeros((len(cohorts), max_offset + 1), dtype=np.int64)
+        for block in range(max_offset // WORD_DAYS + 1):
+            window = self._windows(positions, block)
+            for bit in range(min(WORD_DAYS, max_offset + 1 - block * WORD_DAYS)):
+                active = ((window >> np.uint64(bit)) & ONE).astype(bool)
+                matrix[:, block * WORD_DAYS + bit] = np.bincount(rows[active], minlength=len(cohorts))
+        return RetentionMatrix(self.origin_day + cohorts, matrix, self.last_day)
+
+
+def cohort_retention(chunks, user_column, time_column, max_offset=30):
+    """一次遍历事件分块，返回 (留存矩阵, 活跃日位图)"""
+    bitmap = ActivityBitmap()
+    for chunk in chunks:
+        bitmap.update(chunk[user_column], chunk[time_column])
+    return bitmap.retention_matrix(max_offset), bitmap
+
+
+def save_retention_table(retention, path, period=7):
+    """由留存矩阵导出按同期群的N日留存表"""
+    table = retention.retention_table(period)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    table.to_csv(path, index=False)
+    return table
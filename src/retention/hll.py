@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HyperLogLog近似去重计数（按单元格的可合并草图表）
+HyperLogLog Distinct-count Sketches
+
+每个单元格（如 (同期群, 偏移天数) 或 (省份, 城市, 年龄, 性别)）一组 2^p 个寄存器
+（人数少的单元格稀疏存储），合并即逐寄存器取最大值，因此可按任意维度子集上卷、
+按条件下钻而不重新扫描事件。HLL区间相对标准误差约为 1.04 / sqrt(2^p)，小基数的
+线性计数区间误差另行计算，均随每个估计值一同输出。
+"""
+
+import os
+import math
+
+import pandas as pd
+import numpy as np
+
+
+def precision_for_error(relative_error):
+    """满足目标相对标准误差的最小精度p（寄存器数 2^p，限制在4~16）"""
+    return int(min(max(math.ceil(2 * math.log2(1.04 / relative_error)), 4), 16))
+
+
+def hash_users(users):
+    """用户标识的64位哈希（整数与字符串标识均可，跨进程稳定）"""
+    return pd.util.hash_array(np.asarray(users))
+
+
+def _bit_length(values):
+    """uint64数组每个元素的有效位数"""
+    high = (values >> np.uint64(32)).astype(np.float64)
+    low = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    with np.errstate(divide='ignore'):
+        return np.where(high > 0, 33 + np.floor(np.log2(high)),
+                        np.where(low > 0, 1 + np.floor(np.log2(low)), 0)).astype(np.int64)
+
+
+def register_updates(hashes, precision):
+    """哈希值对应的 (寄存器下标, 秩): 高p位选寄存器，其余位的前导零个数+1为秩"""
+    p = np.uint64(precision)
+    slots = (hashes >> (np.uint64(64) - p)).astype(np.int64)
+    ranks = np.minimum(64 - precision + 1, 64 - _bit_length(hashes << p) + 1).astype(np.uint8)
+    return slots, ranks
+
+
+def _estimate_sums(harmonic, zeros, m):
+    """由每个单元格的 sum(2^-寄存器) 与零寄存器个数估计去重人数
+
+    返回 (估计值, 相对标准误差, 是否使用线性计数)。小基数时使用线性计数修正，
+    其相对标准误差为 sqrt(m(e^t - t - 1)) / n（t = n/m，Whang等 1990），
+    其余为HLL的 1.04 / sqrt(m)。
+    """
+    alpha = 0.7213 / (1 + 1.079 / m) if m >= 128 else {16: 0.673, 32: 0.697, 64: 0.709}[m]
+    raw = alpha * m * m / harmonic
+    with np.errstate(divide='ignore'):
+        linear = m * np.log(m / np.maximum(zeros, 1))
+    use_linear = (raw <= 2.5 * m) & (zeros > 0)
+    estimates = np.round(np.where(use_linear, linear, raw))
+    t = estimates / m
+    linear_error = np.divide(np.sqrt(m * (np.expm1(t) - t)), estimates,
+                             out=np.zeros(len(estimates)), where=estimates > 0)
+    errors = np.where(use_linear, linear_error, 1.04 / math.sqrt(m))
+    return estimates.astype(np.int64), errors, use_linear
+
+
+def estimate_registers(registers):
+    """按行估计去重人数（registers 形状为 (单元格数, 2^p)）"""
+    harmonic = np.ldexp(1.0, -registers.astype(np.int64)).sum(axis=-1)
+    zeros = (registers == 0).sum(axis=-1)
+    estimates, _, _ = _estimate_sums(harmonic, zeros, registers.shape[-1])
+    return estimates
+
+
+def _max_by_code(codes, ranks):
+    """按编号去重，同一编号保留最大的秩（结果按编号升序）"""
+    order = np.lexsort((ranks, codes))
+    codes, ranks = codes[order], ranks[order]
+    last = np.r_[codes[1:] != codes[:-1], True]
+    return codes[last], ranks[last]
+
+
+class HLLSketchTable:
+    """按单元格键组织的HyperLogLog草图: keys 为键列的DataFrame
+
+    寄存器为稀疏/稠密混合存储: 单元格起初只记录非零寄存器的 (单元格行号, 寄存器下标, 秩)，
+    非零寄存器数超过 2^p/8 后提升为一行 2^p 个寄存器的稠密存储（dense_row[i] 为第i个
+    单元格在 dense 中的行号，-1 表示稀疏）。人数少的单元格很多时（如用户维度组合）
+    不再为每个单元格分配完整的寄存器。
+    """
+
+    def __init__(self, key_columns, precision=12, keys=None, sparse=None, dense_cells=None, dense=None):
+        """初始化草图表，sparse 为 (行号, 寄存器下标, 秩) 数组，dense_cells 为稠密单元格的行号"""
+        self.key_columns = list(key_columns)
+        self.precision = int(precision)
+        self.m = 1 << self.precision
+        self.keys = (pd.DataFrame({column: [] for column in self.key_columns})
+                     if keys is None else keys.reset_index(drop=True))
+        self._index = None
+        if sparse is None:
+            sparse = (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.uint16), np.zeros(0, dtype=np.uint8))
+        self.sparse_rows, self.sparse_slots, self.sparse_ranks = sparse
+        self.dense_row = np.full(len(self.keys), -1, dtype=np.int64)
+        self._dense = np.zeros((0, self.m), dtype=np.uint8) if dense is None else dense
+        self.n_dense = len(self._dense)
+        if dense_cells is not None:
+            self.dense_row[dense_cells] = np.arange(len(dense_cells))
+
+    @classmethod
+    def for_error(cls, key_columns, relative_error=0.02):
+        return cls(key_columns, precision_for_error(relative_error))
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def relative_error(self):
+        """HLL估计区间的相对标准误差（线性计数区间的误差见 estimates() 的逐单元格结果）"""
+        return 1.04 / math.sqrt(self.m)
+
+    @property
+    def dense(self):
+        return self._dense[:self.n_dense]
+
+    @property
+    def sparse_threshold(self):
+        """稀疏单元格的非零寄存器数上限（每项约7字节，超过 2^p/8 后稠密存储更省）"""
+        return self.m // 8
+
+    @property
+    def nbytes(self):
+        return (self.dense.nbytes + self.sparse_rows.nbytes + self.sparse_slots.nbytes
+                + self.sparse_ranks.nbytes + self.dense_row.nbytes)
+
+    def _cell_rows(self, keys):
+        """单元格键对应的行号，新单元格追加为稀疏单元格（不分配寄存器）"""
+        cells = pd.MultiIndex.from_frame(keys)
+        if self._index is None:
+            self._index = pd.MultiIndex.from_frame(self.keys) if len(self) else None
+        rows = self._index.get_indexer(cells) if self._index is not None else np.full(len(cells), -1)
+        new = rows < 0
+        if new.any():
+            new_cells = cells[new].unique()
+            rows[new] = len(self) + new_cells.get_indexer(cells[new])
+            new_keys = new_cells.to_frame(index=False)
+            self.keys = new_keys if len(self) == 0 else pd.concat([self.keys, new_keys], ignore_index=True)
+            self._index = new_cells if self._index is None else self._index.append(new_cells)
+            self.dense_row = np.concatenate([self.dense_row, np.full(len(new_cells), -1, dtype=np.int64)])
+        return rows
+
+    def _make_dense(self, cells):
+        """把指定单元格提升为稠密存储（稠密块按容量倍增，不在每次更新时整体复制）"""
+        cells = np.unique(np.asarray(cells, dtype=np.int64))
+        cells = cells[self.dense_row[cells] < 0]
+        if len(cells) == 0:
+            return
+        needed = self.n_dense + len(cells)
+        if needed > len(self._dense):
+            grown = np.zeros((max(needed, 2 * len(self._dense), 16), self.m), dtype=np.uint8)
+            grown[:self.n_dense] = self.dense
+            self._dense = grown
+        self.dense_row[cells] = np.arange(self.n_dense, needed)
+        self.n_dense = needed
+
+        moved = self.dense_row[self.sparse_rows] >= 0
+        if moved.any():
+            self._dense[self.dense_row[self.sparse_rows[moved]], self.sparse_slots[moved]] = self.sparse_ranks[moved]
+            self._set_sparse(self.sparse_rows[~moved], self.sparse_slots[~moved], self.sparse_ranks[~moved])
+
+    def _set_sparse(self, rows, slots, ranks):
+        self.sparse_rows = rows.astype(np.int32)
+        self.sparse_slots = slots.astype(np.uint16)
+        self.sparse_ranks = ranks.astype(np.uint8)
+
+    def _apply(self, rows, slots, ranks):
+        """把 (单元格行号, 寄存器下标, 秩) 合并进寄存器: 先按寄存器去重取最大秩，再分别写入稠密/稀疏存储"""
+        if len(rows) == 0:
+            return
+        codes = np.asarray(rows, dtype=np.int64) * self.m + np.asarray(slots, dtype=np.int64)
+        codes, ranks = _max_by_code(codes, np.asarray(ranks, dtype=np.uint8))
+        rows, slots = np.divmod(codes, self.m)
+
+        dense = self.dense_row[rows]
+        hit = dense >= 0
+        if hit.any():
+            target = (dense[hit], slots[hit])
+            self._dense[target] = np.maximum(self._dense[target], ranks[hit])
+        if hit.all():
+            return
+
+        existing = self.sparse_rows.astype(np.int64) * self.m + self.sparse_slots
+        codes, ranks = _max_by_code(np.concatenate([existing, codes[~hit]]),
+                                    np.concatenate([self.sparse_ranks, ranks[~hit]]))
+        rows, slots = np.divmod(codes, self.m)
+        self._set_sparse(rows, slots, ranks)
+        counts = np.bincount(self.sparse_rows, minlength=len(self))
+        self._make_dense(np.flatnonzero(counts > self.sparse_threshold))
+
+    def update(self, keys, users):
+        """加入一批 (单元格键, 用户)，keys 为与 users 等长、含全部键列的DataFrame"""
+        if len(users) == 0:
+            return
+        keys = pd.DataFrame({column: np.asarray(keys[column]) for column in self.key_columns})
+        rows = self._cell_rows(keys)
+        slots, ranks = register_updates(hash_users(users), self.precision)
+        self._apply(rows, slots, ranks)
+
+    def merge(self, other):
+        """合并另一个草图表（精度与键列需一致）"""
+        if other.precision != self.precision or other.key_columns != self.key_columns:
+            raise ValueError("HLL草图精度或键列不一致，无法合并")
+        if len(other) == 0:
+            return
+        rows = self._cell_rows(other.keys)
+        dense_cells = np.flatnonzero(other.dense_row >= 0)
+        if len(dense_cells):
+            self._make_dense(rows[dense_cells])
+            target = self.dense_row[rows[dense_cells]]
+            self._dense[target] = np.maximum(self._dense[target], other.dense[other.dense_row[dense_cells]])
+        self._apply(rows[other.sparse_rows], other.sparse_slots, other.sparse_ranks)
+
+    def rollup(self, by=None, mask=None):
+        """按键列子集上卷（by为空时合并为一个单元格），mask 为可选的单元格筛选（下钻）"""
+        by = list(by or [])
+        selected = np.ones(len(self), dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+
+        table = HLLSketchTable(by, self.precision)
+        if not selected.any():
+            return table
+        keys = self.keys[selected]
+        if by:
+            codes, uniques = pd.MultiIndex.from_frame(keys[by]).factorize()
+            table.keys = uniques.to_frame(index=False)
+            table.keys.columns = by
+        else:
+            codes = np.zeros(len(keys), dtype=np.int64)
+            table.keys = pd.DataFrame(index=[0])
+        table.dense_row = np.full(len(table.keys), -1, dtype=np.int64)
+        groups = np.full(len(self), -1, dtype=np.int64)
+        groups[selected] = codes
+
+        # 稠密单元格: 同组内逐寄存器取最大后写入上卷结果
+        dense_cells = np.flatnonzero(selected & (self.dense_row >= 0))
+        if len(dense_cells):
+            order = np.argsort(groups[dense_cells], kind='stable')
+            dense_cells = dense_cells[order]
+            starts = np.flatnonzero(np.r_[True, np.diff(groups[dense_cells]) != 0])
+            targets = groups[dense_cells[starts]]
+            table._make_dense(targets)
+            table._dense[table.dense_row[targets]] = np.maximum.reduceat(
+                self.dense[self.dense_row[dense_cells]], starts, axis=0)
+
+        keep = selected[self.sparse_rows]
+        table._apply(groups[self.sparse_rows[keep]], self.sparse_slots[keep], self.sparse_ranks[keep])
+        return table
+
+    def estimates(self):
+        """每个单元格的去重人数估计值、所用估计方法（linear 线性计数 / hll）及其相对标准误差"""
+        nonzero = np.bincount(self.sparse_rows, minlength=len(self))
+        zeros = self.m - nonzero
+        harmonic = zeros + np.bincount(self.sparse_rows, weights=np.ldexp(1.0, -self.sparse_ranks.astype(np.int64)),
+                                       minlength=len(self))
+        dense_cells = np.flatnonzero(self.dense_row >= 0)
+        if len(dense_cells):
+            registers = self.dense[self.dense_row[dense_cells]]
+            harmonic[dense_cells] = np.ldexp(1.0, -registers.astype(np.int64)).sum(axis=1)
+            zeros[dense_cells] = (registers == 0).sum(axis=1)
+
+        result = self.keys.copy()
+        estimates, errors, linear = _estimate_sums(harmonic, zeros, self.m)
+        result['distinct_users'] = estimates
+        result['estimator'] = np.where(linear, 'linear', 'hll')
+        result['relative_error'] = np.round(errors, 4)
+        return result
+
+    def save(self, path):
+        """原子写入npz（键列逐列保存，字符串键存为定长Unicode数组）"""
+        dense_cells = np.empty(self.n_dense, dtype=np.int64)
+        cells = np.flatnonzero(self.dense_row >= 0)
+        dense_cells[self.dense_row[cells]] = cells
+        arrays = {'precision': np.array(self.precision), 'key_columns': np.array(self.key_columns, dtype=str),
+                  'sparse_rows': self.sparse_rows, 'sparse_slots': self.sparse_slots,
+                  'sparse_ranks': self.sparse_ranks, 'dense_cells': dense_cells, 'dense': self.dense}
+        for column in self.key_columns:
+            values = self.keys[column].to_numpy()
+            arrays[f'key_{column}'] = values if values.dtype.kind in 'iuf' else values.astype(str)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            key_columns = [str(column) for column in data['key_columns']]
+            keys = pd.DataFrame({column: data[f'key_{column}'] for column in key_columns})
+            sparse = (data['sparse_rows'], data['sparse_slots'], data['sparse_ranks'])
+            return cls(key_columns, int(data['precision']), keys, sparse, data['dense_cells'], data['dense'])
+
+
+def sketch_chunks(chunks, table, user_column, dimensions):
+    """透传事件分块，同时按用户维度写入维度单元格草图
+
+    dimensions 以用户标识为索引、维度值为字符串，维度表中不存在的用户记为 '未知'。
+    """
+    for chunk in chunks:
+        users = np.asarray(chunk[user_column])
+        table.update(dimensions.reindex(users).fillna('未知'), users)
+        yield chunk
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+增量同期群留存状态
+Incremental Cohort Retention State
+
+状态为每个用户的首次活跃日 + 同期群 x 偏移天数的留存人数矩阵。
+每个新的dt分区只需把当天活跃用户计入 (首次活跃日, 当天 - 首次活跃日) 单元格，
+单日分区最多影响 max_offset + 1 个同期群，无需重新扫描历史事件。
+"""
+
+import os
+import json
+from datetime import datetime
+
+import pandas as pd
+import numpy as np
+
+from rfm_analysis.incremental import validate_partition
+from retention.cohort_retention import RetentionMatrix, _epoch_days
+
+STATE_METADATA_KEY = b'retention_state'
+
+
+class RetentionBackfillError(ValueError):
+    """早于水位且未处理过的分区（补数）: 可能使用户的首次活跃日前移，增量状态无法修正，需全量重建"""
+
+
+class RetentionState:
+    """持久化的用户首次活跃日、同期群留存矩阵及已处理分区水位"""
+
+    def __init__(self, max_offset=30, user_index=None, first_day=None, retention=None,
+                 partitions=None, sketches=None):
+        """初始化留存状态，sketches 为可选的 (cohort_day, day_offset) HLL草图表"""
+        self.max_offset = int(max_offset)
+        self.user_index = pd.Index([]) if user_index is None else pd.Index(user_index)
+        self.first_day = np.empty(0, dtype=np.int64) if first_day is None else np.asarray(first_day, dtype=np.int64)
+        self.retention = retention or RetentionMatrix(np.empty(0), np.zeros((0, self.max_offset + 1)), 0)
+        self.partitions = sorted(partitions or [])
+        self.sketches = sketches
+
+    def __len__(self):
+        return len(self.user_index)
+
+    @property
+    def watermark(self):
+        """已处理的最新分区"""
+        return self.partitions[-1] if self.partitions else None
+
+    @classmethod
+    def load(cls, path, max_offset=30):
+        """加载状态文件，不存在或最大偏移天数变化时返回空状态"""
+        import pyarrow.parquet as pq
+
+        if not os.path.exists(path):
+            print(f"留存状态文件不存在，将从空状态开始: {path}")
+            return cls(max_offset)
+
+        table = pq.read_table(path)
+        metadata = json.loads(table.schema.metadata[STATE_METADATA_KEY])
+        if metadata['max_offset'] != max_offset:
+            print(f"留存状态最大偏移天数 {metadata['max_offset']} 与配置 {max_offset} 不一致，将从空状态开始")
+            return cls(max_offset)
+
+        frame = table.to_pandas()
+        retention = RetentionMatrix(metadata['cohort_days'],
+                                    np.array(metadata['matrix']).reshape(-1, max_offset + 1),
+                                    metadata['last_day'])
+        state = cls(max_offset, frame['user_key'], frame['first_day'], retention, metadata['partitions'])
+        print(f"加载留存状态: {len(state)} 个用户, {len(retention.cohort_days)} 个同期群, 水位 {state.watermark}")
+        return state
+
+    def save(self, path):
+        """原子写入状态文件（首次活跃日为Parquet列，留存矩阵与水位存于schema元数据）"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(pd.DataFrame({'user_key': self.user_index,
+                                                   'first_day': self.first_day}),
+                                     preserve_index=False)
+        schema_metadata = dict(table.schema.metadata or {})
+        schema_metadata[STATE_METADATA_KEY] = json.dumps({
+            'max_offset': self.max_offset,
+            'cohort_days': self.retention.cohort_days.tolist(),
+            'matrix': self.retention.matrix.ravel().tolist(),
+            'last_day': self.retention.last_day,
+            'partitions': self.partitions,
+            'updated_at': datetime.now().isoformat()
+        }).encode('utf-8')
+        table = table.replace_schema_metadata(schema_metadata)
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = path + '.tmp'
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+        print(f"留存状态已保存到 {path}（水位 {self.watermark}）")
+
+    def pending_partitions(self, available):
+        """返回水位之后尚未处理的分区"""
+        return sorted(p for p in available if self.watermark is None or p > self.watermark)
+
+    def _cohort_rows(self, cohort_days):
+        """同期群对应的矩阵行号，新同期群追加零行（保持按日期排序）"""
+        cohort_days = np.asarray(cohort_days, dtype=np.int64)
+        missing = np.setdiff1d(cohort_days, self.retention.cohort_days)
+        if len(missing):
+            days = np.concatenate([self.retention.cohort_days, missing])
+            matrix = np.vstack([self.retention.matrix,
+                                np.zeros((len(missing), self.max_offset + 1), dtype=np.int64)])
+            order = np.argsort(days, kind='stable')
+            self.retention = RetentionMatrix(days[order], matrix[order], self.retention.last_day)
+        return np.searchsorted(self.retention.cohort_days, cohort_days)
+
+    def apply_days(self, users, days):
+        """合并一个分区去重后的 (用户, 活跃日)，日期须晚于已处理的所有活跃日"""
+        users = pd.Index(users)
+        days = np.asarray(days, dtype=np.int64)
+        if len(days) == 0:
+            return 0
+
+        # 新用户的首次活跃日为其在本分区中最早的活跃日
+        positions = self.user_index.get_indexer(users)
+        new = positions < 0
+        if new.any():
+            first = pd.Series(days[new]).groupby(np.asarray(users[new])).min()
+            positions[new] = len(self) + first.index.get_indexer(users[new])
+            self.user_index = self.user_index.append(pd.Index(first.index))
+            self.first_day = np.concatenate([self.first_day, first.to_numpy(dtype=np.int64)])
+
+        offsets = days - self.first_day[positions]
+        keep = (offsets >= 0) & (offsets <= self.max_offset)
+        cohorts, cells = np.unique(self.first_day[positions][keep] * (self.max_offset + 1) + offsets[keep],
+                                   return_counts=True)
+        rows = self._cohort_rows(cohorts // (self.max_offset + 1))
+        self.retention.matrix[rows, cohorts % (self.max_offset + 1)] += cells
+        if self.sketches is not None:
+            self.sketches.update(pd.DataFrame({'cohort_day': self.first_day[positions][keep],
+                                               'day_offset': offsets[keep]}),
+                                 np.asarray(users)[keep])
+        self.retention.last_day = max(self.retention.last_day, int(days.max()))
+        return len(np.unique(rows))
+
+    def apply_partition(self, partition, chunks, user_column='user_key', time_column='full_time'):
+        """将一个分区的观看事件合并进状态，已处理的分区直接跳过
+
+        早于水位的未处理分区会改变已有用户的首次活跃日及其所有留存单元格，
+        只保存首次活跃日的增量状态无法修正，抛出 RetentionBackfillError 提示全量重建。
+        """
+        validate_partition(partition)
+        if partition in self.partitions:
+            print(f"分区 dt={partition} 已处理，跳过")
+            return False
+        if self.watermark is not None and partition < self.watermark:
+            raise RetentionBackfillError(
+                f"分区 dt={partition} 早于留存水位 {self.watermark} 且未处理过（补数），"
+                f"增量留存状态无法修正，请运行 --mode rfm_rebuild 全量重建")
+
+        pairs = []
+        n_events = 0
+        for chunk in chunks:
+            # 时间维度缺失（NULL）的事件无法确定活跃日，不计入留存
+            timed = chunk[time_column].notna().to_numpy()
+            pairs.append(pd.DataFrame({'user': np.asarray(chunk[user_column])[timed],
+                                       'day': _epoch_days(chunk[time_column][timed])}).drop_duplicates())
+            n_events += len(chunk)
+        pairs = pd.concat(pairs, ignore_index=True).drop_duplicates() if pairs else pd.DataFrame(
+            {'user': [], 'day': np.empty(0, dtype=np.int64)})
+
+        touched = self.apply_days(pairs['user'].to_numpy(), pairs['day'].to_numpy())
+        self.partitions = sorted(self.partitions + [partition])
+        print(f"分区 dt={partition} 留存更新完成: {n_events} 条事件, {len(pairs)} 个活跃用户日, "
+              f"更新 {touched} 个同期群")
+        return True
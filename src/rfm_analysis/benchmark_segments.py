@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+用户分群赋值性能基准（逐行apply vs 查找表）
+Segment Assignment Benchmark
+
+用法: python src/rfm_analysis/benchmark_segments.py --sizes 1000000 10000000
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import pandas as pd
+import numpy as np
+import yaml
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from rfm_analysis.segments import compile_segment_lookup, assign_segments
+
+
+def assign_segments_rowwise(rfm_df, segments):
+    """原逐行apply实现，仅用于对比"""
+    def assign_segment(row):
+        r, f, m = row['R_score'], row['F_score'], row['M_score']
+
+        for segment_name, rules in segments.items():
+            if (r in rules['recency'] and
+                f in rules['frequency'] and
+                m in rules['monetary']):
+                return segment_name
+        return 'other'
+
+    return rfm_df.apply(assign_segment, axis=1)
+
+
+def run_benchmark(n_users, segments, rowwise=True, seed=42):
+    """在n_users个随机分数上对比两种实现"""
+    rng = np.random.default_rng(seed)
+    rfm_df = pd.DataFrame({
+        'R_score': rng.integers(1, 6, n_users),
+        'F_score': rng.integers(1, 6, n_users),
+        'M_score': rng.integers(1, 6, n_users)
+    })
+
+    start = time.perf_counter()
+    lookup, names = compile_segment_lookup(segments)
+    vectorized = assign_segments(rfm_df['R_score'], rfm_df['F_score'],
+                                 rfm_df['M_score'], lookup, names)
+    lookup_seconds = time.perf_counter() - start
+    print(f"[{n_users:>10,d} 用户] 查找表: {lookup_seconds:.3f}s")
+
+    if rowwise:
+        start = time.perf_counter()
+        expected = assign_segments_rowwise(rfm_df, segments)
+        rowwise_seconds = time.perf_counter() - start
+        assert (np.asarray(vectorized, dtype=object) == expected.values).all(), "分群结果不一致"
+        print(f"[{n_users:>10,d} 用户] 逐行apply: {rowwise_seconds:.3f}s "
+              f"(加速 {rowwise_seconds / lookup_seconds:.0f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='用户分群赋值性能基准')
+    parser.add_argument('--config', default='config/rfm_config.yaml', help='RFM配置文件')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000000, 10000000],
+                        help='测试的用户数量')
+    parser.add_argument('--skip-rowwise', action='store_true', help='跳过逐行apply基线')
+    args = parser.parse_args()
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        segments = yaml.safe_load(f)['rfm_analysis']['segments']
+
+    for n_users in args.sizes:
+        run_benchmark(n_users, segments, rowwise=not args.skip_rowwise)
+
+
+if __name__ == "__main__":
+    main()
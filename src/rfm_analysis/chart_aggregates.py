@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图表预聚合数据（按日期x小时的活跃度立方体、留存矩阵、R/F/M固定分箱直方图）
+Pre-aggregated Chart Inputs
+
+由RFM/ETL阶段生成，图表只读取这些O(分箱数)的小文件，不接触明细数据。
+"""
+
+import os
+
+import pandas as pd
+import numpy as np
+
+from retention.cohort_retention import RetentionMatrix
+from retention.hll import precision_for_error, hash_users, register_updates, estimate_registers
+
+ACTIVITY_CUBE_FILE = 'activity_cube.npz'
+RETENTION_FILE = 'retention_matrix.npz'
+RFM_HISTOGRAM_FILE = 'rfm_histograms.npz'
+
+RFM_COLUMNS = ['recency_days', 'frequency', 'monetary_value']
+
+# 默认固定分箱: 超出上限的值计入最后一个分箱
+DEFAULT_HISTOGRAM_BINS = {
+    'recency_days': {'max': 60, 'bins': 30},
+    'frequency': {'max': 200, 'bins': 40},
+    'monetary_value': {'max': 10000, 'bins': 50}
+}
+
+
+def _save_npz(path, **arrays):
+    """原子写入npz文件"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def _day_number(day):
+    """日期（yyyy-MM-dd 或 date）转换为距1970-01-01的天数"""
+    return int(np.datetime64(day, 'D').astype(np.int64))
+
+
+def _day_bounds(days, start=None, end=None):
+    """[start, end] 日期区间（含两端，为空表示不限）在有序日期数组中的行号范围"""
+    lo = 0 if start is None else int(np.searchsorted(days, _day_number(start), side='left'))
+    hi = len(days) if end is None else int(np.searchsorted(days, _day_number(end), side='right'))
+    return lo, max(hi, lo)
+
+
+class ActivityCube:
+    """按 (日期, 小时) 的活跃度立方体: 观看次数、观看时长合计、去重用户HLL草图
+
+    星期由日期推出，任意日期区间切片后按 (星期, 小时) 汇总即为7x24热力图。
+    保存时附带按日期累加的 星期 x 小时 前缀和，次数/时长热力图只需两行相减，与区间天数无关；
+    去重用户数需逐日合并寄存器，读取量与区间天数成正比。
+    sketched[i] 标记第i天是否写入了去重草图（Hive端分组聚合结果不含草图）。
+    按分区增量合并，last_day 之前的日期视为已处理。
+    """
+
+    def __init__(self, precision=10, days=None, sessions=None, duration=None, registers=None,
+                 sketched=None):
+        self.precision = int(precision)
+        self.days = np.empty(0, dtype=np.int64) if days is None else np.asarray(days, dtype=np.int64)
+        n_days = len(self.days)
+        self.sessions = np.zeros((n_days, 24), dtype=np.int64) if sessions is None else sessions
+        self.duration = np.zeros((n_days, 24), dtype=np.float64) if duration is None else duration
+        self.registers = (np.zeros((n_days, 24, 1 << self.precision), dtype=np.uint8)
+                          if registers is None else registers)
+        self.sketched = np.ones(n_days, dtype=bool) if sketched is None else np.asarray(sketched, dtype=bool)
+
+    @classmethod
+    def for_error(cls, relative_error=0.05):
+        return cls(precision_for_error(relative_error))
+
+    @property
+    def last_day(self):
+        """最后一个有数据的日期（距1970-01-01天数），空立方体为None"""
+        return int(self.days[-1]) if len(self.days) else None
+
+    @property
+    def weekdays(self):
+        """每个日期的星期（周一为0；1970-01-01为周四）"""
+        return (self.days + 3) % 7
+
+    def _day_rows(self, days, sketched):
+        """日期对应的行号，新日期插入零行（保持按日期排序），sketched 为新行是否写入去重草图"""
+        missing = np.setdiff1d(days, self.days)
+        if len(missing):
+            order = np.argsort(np.concatenate([self.days, missing]), kind='stable')
+            self.days = np.concatenate([self.days, missing])[order]
+            self.sessions = np.concatenate([self.sessions, np.zeros((len(missing), 24), dtype=np.int64)])[order]
+            self.duration = np.concatenate([self.duration, np.zeros((len(missing), 24))])[order]
+            self.registers = np.concatenate([self.registers, np.zeros(
+                (len(missing), 24, self.registers.shape[2]), dtype=np.uint8)])[order]
+            self.sketched = np.concatenate([self.sketched, np.full(len(missing), sketched)])[order]
+        rows = np.searchsorted(self.days, days)
+        if not sketched:
+            self.sketched[rows] = False
+        return rows
+
+    def update(self, times, durations, users=None):
+        """累加一批观看事件（users 为空时只累计次数与时长，相应日期标记为无去重草图）
+
+        时间缺失（NaT）的事件无法归入 (日期, 小时) 单元格，直接忽略。
+        """
+        times = pd.DatetimeIndex(pd.to_datetime(times))
+        timed = ~times.isna()
+        if not timed.all():
+            times = times[timed]
+            durations = np.asarray(durations)[timed]
+            users = None if users is None else np.asarray(users)[timed]
+        days = times.to_numpy().astype('datetime64[D]').astype(np.int64)
+        hours = times.hour.to_numpy()
+        if len(days) == 0:
+            return
+        rows = self._day_rows(days, users is not None)
+        cells = rows * 24 + hours
+        size = len(self.days) * 24
+        self.sessions += np.bincount(cells, minlength=size).reshape(-1, 24)
+        self.duration += np.bincount(cells, weights=np.asarray(durations, dtype=np.float64),
+                                     minlength=size).reshape(-1, 24)
+        if users is not None:
+            slots, ranks = register_updates(hash_users(users), self.precision)
+            np.maximum.at(self.registers, (rows, hours, slots), ranks)
+
+    def update_counts(self, days, hours, sessions, duration):
+        """累加已分组的 (日期, 小时, 次数, 时长合计)，用于Hive端聚合结果（不含去重草图）"""
+        days = np.asarray(days, dtype=np.int64)
+        hours = np.asarray(hours, dtype=np.int64)
+        rows = self._day_rows(days, False)
+        np.add.at(self.sessions, (rows, hours), np.asarray(sessions, dtype=np.int64))
+        np.add.at(self.duration, (rows, hours), np.asarray(duration, dtype=np.float64))
+
+    def slice(self, start=None, end=None):
+        """[start, end] 日期区间（yyyy-MM-dd，含两端，为空表示不限）的子立方体"""
+        lo, hi = _day_bounds(self.days, start, end)
+        return ActivityCube(self.precision, self.days[lo:hi], self.sessions[lo:hi],
+                            self.duration[lo:hi], self.registers[lo:hi], self.sketched[lo:hi])
+
+    def weekday_prefix(self, values):
+        """按日期累加的 星期 x 小时 前缀和: prefix[j] - prefix[i] 为第i~j-1天的7x24汇总"""
+        daily = np.zeros((len(self.days) + 1, 7, 24), dtype=values.dtype)
+        daily[np.arange(1, len(self.days) + 1), self.weekdays] = values
+        return np.cumsum(daily, axis=0)
+
+    def heatmap(self, metric='sessions'):
+        """按 (星期, 小时) 汇总的7x24矩阵: sessions 观看次数 / duration 时长合计 / users 去重用户数"""
+        if metric == 'users':
+            if not self.sketched.all():
+                missing = self.days[~self.sketched].astype('datetime64[D]')
+                raise ValueError(f"活跃度立方体中 {len(missing)} 天（{missing[0]} ~ {missing[-1]}）没有去重用户草图"
+                                 "（Hive端全量聚合只含次数与时长），请执行 python main.py --mode rfm_rebuild "
+                                 "按分区重建立方体，或改用 sessions/duration 指标")
+            registers = np.zeros((7, 24, self.registers.shape[2]), dtype=np.uint8)
+            np.maximum.at(registers, self.weekdays, self.registers)
+            return estimate_registers(registers)
+        values = {'sessions': self.sessions, 'duration': self.duration}.get(metric)
+        if values is None:
+            raise ValueError(f"不支持的热力图指标: {metric}")
+        prefix = self.weekday_prefix(values)
+        return prefix[-1] - prefix[0]
+
+    def save(self, path):
+        _save_npz(path, precision=np.array(self.precision), days=self.days, sessions=self.sessions,
+                  duration=self.duration, registers=self.registers, sketched=self.sketched,
+                  sessions_prefix=self.weekday_prefix(self.sessions),
+                  duration_prefix=self.weekday_prefix(self.duration))
+
+    @classmethod
+    def load(cls, path, start=None, end=None, registers=True):
+        """读取立方体；npz按成员延迟读取，不需要去重草图时跳过寄存器数组"""
+        with np.load(path) as data:
+            days = data['days']
+            lo, hi = _day_bounds(days, start, end)
+            precision = int(data['precision'])
+            sessions = data['sessions'][lo:hi]
+            day_registers = (data['registers'][lo:hi] if registers else
+                             np.zeros((hi - lo, 24, 1 << precision), dtype=np.uint8))
+            if 'sketched' in data.files:
+                sketched = data['sketched'][lo:hi]
+            else:
+                # 旧版文件无标记: 有观看但寄存器全零的日期视为没有草图
+                sketched = day_registers.reshape(hi - lo, -1).any(axis=1) | (sessions.sum(axis=1) == 0)
+            return cls(precision, days[lo:hi], sessions, data['duration'][lo:hi], day_registers, sketched)
+
+    @classmethod
+    def load_heatmap(cls, path, start=None, end=None, metric='sessions'):
+        """日期区间的7x24热力图: 次数/时长只读取日期数组与前缀和的两行，去重用户数切片合并寄存器"""
+        with np.load(path) as data:
+            prefix_key = f'{metric}_prefix'
+            if metric == 'users' or prefix_key not in data.files:
+                return cls.load(path, start, end, registers=metric == 'users').heatmap(metric)
+            lo, hi = _day_bounds(data['days'], start, end)
+            prefix = data[prefix_key]
+            return prefix[hi] - prefix[lo]
+
+
+class RFMStatsAccumulator:
+    """R/F/M流式统计: 固定分箱直方图 + 均值与协方差（Welford/Chan合并公式）
+
+    按块更新、可跨分区合并，内存只与分箱数相关；相关系数矩阵由协方差得出。
+    """
+
+    def __init__(self, bins_config=None):
+        bins_config = {**DEFAULT_HISTOGRAM_BINS, **(bins_config or {})}
+        self.edges = {column: np.linspace(0, bins_config[column]['max'], bins_config[column]['bins'] + 1)
+                      for column in RFM_COLUMNS}
+        self.counts = {column: np.zeros(len(edges) - 1, dtype=np.int64)
+                       for column, edges in self.edges.items()}
+        self.n = 0
+        self.mean = np.zeros(len(RFM_COLUMNS))
+        self.comoment = np.zeros((len(RFM_COLUMNS), len(RFM_COLUMNS)))  # Σ(x-均值)(y-均值)
+
+    def _combine(self, n, mean, comoment):
+        """合并另一组 (样本数, 均值, 协方差累积量)"""
+        if n == 0:
+            return
+        total = self.n + n
+        delta = mean - self.mean
+        self.comoment += comoment + np.outer(delta, delta) * self.n * n / total
+        self.mean += delta * n / total
+        self.n = total
+
+    def update(self, rfm_df):
+        """加入一块RFM原始值"""
+        if len(rfm_df) == 0:
+            return
+        X = np.column_stack([rfm_df[column].to_numpy(dtype=np.float64) for column in RFM_COLUMNS])
+        for i, column in enumerate(RFM_COLUMNS):
+            edges = self.edges[column]
+            counts, _ = np.histogram(np.clip(X[:, i], edges[0], edges[-1]), bins=edges)
+            self.counts[column] += counts
+        mean = X.mean(axis=0)
+        centered = X - mean
+        self._combine(len(X), mean, centered.T @ centered)
+
+    def merge(self, other):
+        """合并另一个分区的统计（分箱需一致）"""
+        for column in RFM_COLUMNS:
+            if not np.array_equal(self.edges[column], other.edges[column]):
+                raise ValueError(f"{column} 分箱不一致，无法合并")
+            self.counts[column] += other.counts[column]
+        self._combine(other.n, other.mean, other.comoment)
+
+    def covariance(self):
+        return self.comoment / max(self.n - 1, 1)
+
+    def correlation(self):
+        std = np.sqrt(np.diag(self.comoment))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.comoment / np.outer(std, std)
+
+    def to_arrays(self):
+        """图表与持久化使用的数组（直方图、相关系数及可继续合并的统计量）"""
+        arrays = {'n': np.array(self.n), 'mean': self.mean, 'comoment': self.comoment,
+                  'correlation': self.correlation()}
+        for column in RFM_COLUMNS:
+            arrays[f'{column}_edges'] = self.edges[column]
+            arrays[f'{column}_counts'] = self.counts[column]
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        accumulator = cls()
+        accumulator.edges = {column: arrays[f'{column}_edges'] for column in RFM_COLUMNS}
+        accumulator.counts = {column: arrays[f'{column}_counts'].astype(np.int64) for column in RFM_COLUMNS}
+        accumulator.n = int(arrays['n'])
+        accumulator.mean = arrays['mean'].astype(np.float64)
+        accumulator.comoment = arrays['comoment'].astype(np.float64)
+        return accumulator
+
+    def save(self, path):
+        _save_npz(path, **self.to_arrays())
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls.from_arrays({key: data[key] for key in data.files})
+
+
+def rfm_histograms(rfm_df, bins_config=None, chunk_size=1000000):
+    """分块计算R/F/M固定分箱直方图及相关系数矩阵"""
+    accumulator = RFMStatsAccumulator(bins_config)
+    for start in range(0, len(rfm_df), chunk_size):
+        accumulator.update(rfm_df.iloc[start:start + chunk_size])
+    return accumulator
+
+
+def save_rfm_histograms(rfm_df, directory, bins_config=None, chunk_size=1000000):
+    path = os.path.join(directory, RFM_HISTOGRAM_FILE)
+    rfm_histograms(rfm_df, bins_config, chunk_size).save(path)
+    return path
+
+
+def load_activity_heatmap(directory, start=None, end=None, metric='sessions'):
+    """由活跃度立方体切片得到7x24热力图，不存在时返回None"""
+    path = os.path.join(directory, ACTIVITY_CUBE_FILE)
+    if not os.path.exists(path):
+        return None
+    return ActivityCube.load_heatmap(path, start, end, metric)
+
+
+def load_retention_matrix(directory):
+    """读取留存矩阵，不存在时返回None"""
+    path = os.path.join(directory, RETENTION_FILE)
+    return RetentionMatrix.load(path) if os.path.exists(path) else None
+
+
+def load_rfm_histograms(directory):
+    """读取R/F/M直方图，不存在时返回None"""
+    path = os.path.join(directory, RFM_HISTOGRAM_FILE)
+    if not os.path.exists(path):
+        return None
+    return RFMStatsAccumulator.load(path).to_arrays()
@@ -1,7 +1,7 @@
 USE video_analysis;
 
 CREATE TABLE IF NOT EXISTS user_retention_rate (
-    register_date DATE,
+    cohort_date DATE,
     retention_day_7 DECIMAL(5,4)
 ROW FORMAT DELIMITED
 FIELDS TERMINATED BY '\t'
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+增量RFM状态
+Incremental RFM State
+"""
+
+import os
+from datetime import datetime
+
+from rfm_analysis.streaming import RFMAccumulator, save_accumulator, load_accumulator
+
+STATE_METADATA_KEY = b'rfm_state'
+
+
+def validate_partition(partition):
+    """校验分区值格式（yyyy-MM-dd）"""
+    datetime.strptime(partition, '%Y-%m-%d')
+    return partition
+
+
+class RFMState:
+    """持久化的用户RFM累计状态及已处理分区水位"""
+
+    def __init__(self, accumulator=None, partitions=None):
+        """初始化RFM状态"""
+        self.accumulator = accumulator or RFMAccumulator()
+        self.partitions = sorted(partitions or [])
+
+    @property
+    def watermark(self):
+        """已处理的最新分区"""
+        return self.partitions[-1] if self.partitions else None
+
+    @classmethod
+    def load(cls, path):
+        """加载状态文件，不存在时返回空状态"""
+        if not os.path.exists(path):
+            print(f"RFM状态文件不存在，将从空状态开始: {path}")
+            return cls()
+
+        accumulator, metadata = load_accumulator(path, STATE_METADATA_KEY)
+        state = cls(accumulator, metadata['partitions'])
+        print(f"加载RFM状态: {len(state.accumulator)} 个用户, 水位 {state.watermark}")
+        return state
+
+    def save(self, path):
+        """原子写入状态文件（用户累计值与水位在同一文件中）"""
+        save_accumulator(self.accumulator, path, STATE_METADATA_KEY, {
+            'partitions': self.partitions,
+            'updated_at': datetime.now().isoformat()
+        })
+        print(f"RFM状态已保存到 {path}（水位 {self.watermark}）")
+
+    def pending_partitions(self, available):
+        """返回尚未处理的分区"""
+        processed = set(self.partitions)
+        return sorted(p for p in available if p not in processed)
+
+    def apply_partition(self, partition, chunks, user_column='user_key',
+                        time_column='full_time', duration_column='duration_min'):
+        """将一个分区的观看事件合并进状态，已处理的分区直接跳过"""
+        validate_partition(partition)
+        if partition in self.partitions:
+            print(f"分区 dt={partition} 已处理，跳过")
+            return False
+
+        n_events = 0
+        for chunk in chunks:
+            self.accumulator.update(chunk[user_column], chunk[time_column],
+                                    chunk[duration_column])
+            n_events += len(chunk)
+
+        self.partitions = sorted(self.partitions + [partition])
+        print(f"分区 dt={partition} 合并完成: {n_events} 条事件, 累计 {len(self.accumulator)} 个用户")
+        return True
+
+    def to_frame(self, snapshot_date=None):
+        """按快照日期输出RFM原始值"""
+        return self.accumulator.to_frame(snapshot_date)
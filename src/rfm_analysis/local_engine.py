@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地列式RFM计算引擎
+Local Columnar RFM Engine
+"""
+
+import os
+import glob
+
+import pandas as pd
+import numpy as np
+
+SECONDS_PER_DAY = 86400
+# 没有有效观看时间（full_time 为NULL/NaT）时的最后观看秒数，取最大值时自然被忽略
+NO_TIME = np.iinfo(np.int64).min
+
+
+def days_since_epoch(value):
+    """将日期转换为自1970-01-01起的天数"""
+    if value is None:
+        value = pd.Timestamp.now()
+    return int(np.datetime64(pd.Timestamp(value).date(), 'D').astype(np.int64))
+
+
+def reduce_events(user_ids, timestamps, durations):
+    """按用户归约观看事件，返回(用户标识, 最后观看秒数, 次数, 时长合计)，按用户标识排序"""
+    codes, uniques = pd.factorize(pd.Series(user_ids), sort=True)
+
+    # 丢弃缺失用户标识的记录
+    valid = codes >= 0
+    codes = codes[valid]
+    # 缺失时间（NaT）记为 NO_TIME: 只不参与R，仍计入F、M
+    seconds = np.asarray(pd.to_datetime(pd.Series(timestamps)[valid]),
+                         dtype='datetime64[s]').astype(np.int64)
+    durations = np.asarray(durations, dtype=np.float64)[valid]
+    n_users = len(uniques)
+
+    if n_users == 0:
+        return (uniques, np.empty(0, dtype=np.int64),
+                np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))
+
+    # F、M: 按整数用户编码直接累加
+    frequency = np.bincount(codes, minlength=n_users)
+    monetary = np.bincount(codes, weights=durations, minlength=n_users)
+
+    # R: 按编码排序后分段求最大时间
+    order = np.argsort(codes, kind='stable')
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    last_seen = np.maximum.reduceat(seconds[order], starts)
+
+    return uniques, last_seen, frequency, monetary
+
+
+def build_rfm_frame(user_keys, last_seen, frequency, monetary, snapshot_date=None):
+    """由按用户归约的结果构造RFM原始值表
+
+    没有任何有效观看时间的用户无法计算R，不输出（与融合查询的 HAVING MAX(full_time) IS NOT NULL 一致）。
+    """
+    timed = np.asarray(last_seen) != NO_TIME
+    recency = days_since_epoch(snapshot_date) - last_seen[timed] // SECONDS_PER_DAY
+
+    return pd.DataFrame({
+        'user_key': user_keys[timed],
+        'recency_days': recency,
+        'frequency': frequency[timed],
+        'monetary_value': monetary[timed]
+    })
+
+
+def aggregate_rfm(user_ids, timestamps, durations, snapshot_date=None):
+    """按用户聚合观看事件，返回按user_key排序的RFM原始值"""
+    return build_rfm_frame(*reduce_events(user_ids, timestamps, durations),
+                           snapshot_date=snapshot_date)
+
+
+class LocalRFMEngine:
+    """基于本地观看记录文件（CSV/Parquet）的RFM计算引擎"""
+
+    def __init__(self, config):
+        """初始化本地引擎"""
+        self.path = config.get('path', 'data/simulated_watch_records.csv')
+        self.user_column = config.get('user_column', 'user_id')
+        self.time_column = config.get('time_column', 'watch_date')
+        self.duration_column = config.get('duration_column', 'watch_duration')
+        self.snapshot_date = config.get('snapshot_date')
+        self.partition_root = config.get('partition_root', 'data/fact_watching')
+
+    @property
+    def columns(self):
+        """需要读取的列"""
+        return [self.user_column, self.time_column, self.duration_column]
+
+    def load_events(self):
+        """只读取RFM所需的三列"""
+        if self.path.endswith('.parquet'):
+            return pd.read_parquet(self.path, columns=self.columns)
+        return pd.read_csv(self.path, usecols=self.columns,
+                           parse_dates=[self.time_column])
+
+    def iter_events(self, chunk_size, path=None):
+        """按固定行数分块读取观看记录"""
+        path = path or self.path
+        if path.endswith('.parquet'):
+            import pyarrow.parquet as pq
+
+            parquet_file = pq.ParquetFile(path)
+            for batch in parquet_file.iter_batches(batch_size=chunk_size,
+                                                   columns=self.columns):
+                yield batch.to_pandas()
+        else:
+            yield from pd.read_csv(path, usecols=self.columns,
+                                   parse_dates=[self.time_column],
+                                   chunksize=chunk_size)
+
+    def list_partitions(self):
+        """列出 partition_root 下的 dt=yyyy-MM-dd 分区"""
+        directories = glob.glob(os.path.join(self.partition_root, 'dt=*'))
+        return sorted(os.path.basename(d)[len('dt='):] for d in directories)
+
+    def iter_partition_events(self, partition, chunk_size):
+        """分块读取单个dt分区目录下的所有CSV/Parquet文件"""
+        directory = os.path.join(self.partition_root, f'dt={partition}')
+        for path in sorted(glob.glob(os.path.join(directory, '*'))):
+            if path.endswith(('.csv', '.csv.gz', '.parquet')):
+                yield from self.iter_events(chunk_size, path)
+
+    def calculate_rfm(self):
+        """计算R、F、M原始值"""
+        events = self.load_events()
+        print(f"加载本地观看记录: {len(events)} 条 ({self.path})")
+
+        return aggregate_rfm(events[self.user_column],
+                             events[self.time_column],
+                             events[self.duration_column],
+                             self.snapshot_date)
+
+    def calculate_rfm_streaming(self, chunk_size):
+        """分块流式计算R、F、M原始值"""
+        from rfm_analysis.streaming import fold_chunks
+
+        print(f"流式读取本地观看记录: {self.path} (每块 {chunk_size} 条)")
+        return fold_chunks(self.iter_events(chunk_size), self.user_column,
+                           self.time_column, self.duration_column,
+                           self.snapshot_date)
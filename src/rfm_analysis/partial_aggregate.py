@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+可合并的RFM部分聚合（多进程/多节点）
+Mergeable Partial RFM Aggregates
+
+单机多进程: python main.py --mode rfm_parallel
+多节点:     每台机器执行 map，结果放到共享目录后执行一次 reduce
+  python src/rfm_analysis/partial_aggregate.py map --shard 0 --num-shards 8 --output partials/part-0.parquet
+  python src/rfm_analysis/partial_aggregate.py reduce partials/*.parquet
+"""
+
+import os
+import sys
+import argparse
+
+import pandas as pd
+import numpy as np
+import yaml
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from rfm_analysis.streaming import RFMAccumulator, save_accumulator, load_accumulator
+from rfm_analysis.quantile_sketch import RFMQuantileScorer
+
+PARTIAL_METADATA_KEY = b'rfm_partial'
+
+
+def shard_mask(user_ids, shard_index, num_shards):
+    """按用户标识的稳定哈希选出属于某个分片的行（跨进程结果一致）"""
+    hashes = pd.util.hash_array(np.asarray(user_ids))
+    return (hashes % np.uint64(num_shards)) == shard_index
+
+
+class PartialRFMAggregate:
+    """单个worker输出的部分聚合: 每用户最大时间、次数、时长合计，以及分位数草图
+
+    按用户哈希分片时各分片用户互不重叠，草图可直接合并；
+    按日期分区拆分时同一用户可能出现在多个分片，草图需在合并累加器后重建。
+    """
+
+    def __init__(self, accumulator=None, scorer=None, snapshot_date=None):
+        """初始化部分聚合"""
+        self.accumulator = accumulator or RFMAccumulator()
+        self.scorer = scorer
+        self.snapshot_date = snapshot_date
+
+    def merge(self, other):
+        """合并另一个部分聚合"""
+        self.accumulator.merge(other.accumulator)
+        if self.scorer is not None and other.scorer is not None:
+            self.scorer.merge(other.scorer)
+        else:
+            self.scorer = None
+
+    def to_frame(self):
+        """输出RFM原始值"""
+        return self.accumulator.to_frame(self.snapshot_date)
+
+    def save(self, path):
+        """保存部分聚合（累加器 + 草图）"""
+        save_accumulator(self.accumulator, path, PARTIAL_METADATA_KEY, {
+            'snapshot_date': self.snapshot_date,
+            'sketch': self.scorer.to_dict() if self.scorer is not None else None
+        })
+
+    @classmethod
+    def load(cls, path):
+        """加载部分聚合"""
+        accumulator, metadata = load_accumulator(path, PARTIAL_METADATA_KEY)
+        scorer = RFMQuantileScorer.from_dict(metadata['sketch']) if metadata['sketch'] else None
+        return cls(accumulator, scorer, metadata['snapshot_date'])
+
+
+def compute_partial(config, snapshot_date, shard=None, partitions=None):
+    """worker: 计算一个用户哈希分片或一组dt分区的部分聚合"""
+    from rfm_analysis.rfm_calculator import RFMCalculator
+
+    rfm_config = config['rfm_analysis']
+    chunk_size = rfm_config.get('streaming', {}).get('chunk_size', 1000000)
+    chunks, columns = RFMCalculator(config).iter_worker_events(chunk_size, shard, partitions)
+
+    partial = PartialRFMAggregate(snapshot_date=snapshot_date)
+    for chunk in chunks:
+        partial.accumulator.update(*(chunk[column] for column in columns))
+
+    # 用户不重叠时，在worker内直接构建草图
+    if shard is not None:
+        relative_accuracy = rfm_config.get('scoring', {}).get('relative_accuracy', 0.01)
+        partial.scorer = RFMQuantileScorer(relative_accuracy)
+        partial.scorer.update(partial.to_frame())
+
+    return partial
+
+
+def run_partial_task(config, snapshot_date, output_path, shard=None, partitions=None):
+    """进程池任务: 计算部分聚合并写入文件，返回文件路径"""
+    partial = compute_partial(config, snapshot_date, shard, partitions)
+    partial.save(output_path)
+    print(f"部分聚合已保存到 {output_path}: {len(partial.accumulator)} 个用户")
+    return output_path
+
+
+def reduce_partials(paths):
+    """合并所有部分聚合文件"""
+    merged = None
+    for path in paths:
+        partial = PartialRFMAggregate.load(path)
+        if merged is None:
+            merged = partial
+        else:
+            merged.merge(partial)
+    if merged is None:
+        raise ValueError("没有可合并的部分聚合文件")
+
+    print(f"已合并 {len(paths)} 个部分聚合: {len(merged.accumulator)} 个用户")
+    return merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description='RFM部分聚合（多节点map/reduce）')
+    parser.add_argument('--config', default='config/rfm_config.yaml', help='RFM配置文件')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    map_parser = subparsers.add_parser('map', help='计算一个用户哈希分片的部分聚合')
+    map_parser.add_argument('--shard', type=int, required=True, help='分片序号')
+    map_parser.add_argument('--num-shards', type=int, required=True, help='分片总数')
+    map_parser.add_argument('--snapshot-date', required=True,
+                            help='所有分片统一的快照日期(yyyy-MM-dd)')
+    map_parser.add_argument('--output', required=True, help='部分聚合输出文件')
+
+    reduce_parser = subparsers.add_parser('reduce', help='合并部分聚合并输出RFM分数')
+    reduce_parser.add_argument('paths', nargs='+', help='部分聚合文件')
+
+    args = parser.parse_args()
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+
+    if args.command == 'map':
+        run_partial_task(config, args.snapshot_date, args.output,
+                         shard=(args.shard, args.num_shards))
+    else:
+        from rfm_analysis.rfm_calculator import RFMCalculator
+
+        merged = reduce_partials(args.paths)
+        RFMCalculator(config).score_rfm(merged.to_frame(), merged.scorer)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+可合并分位数草图与RFM近似分位打分
+Mergeable Quantile Sketch and Approximate RFM Scoring
+"""
+
+import os
+import json
+import math
+
+import numpy as np
+
+# 分位切点（与qcut 5等分一致）
+SCORE_QUANTILES = [0.2, 0.4, 0.6, 0.8]
+
+
+def quintile_bins(below, total):
+    """按 "小于该值的个数 / 总数" 分到0~4档: 相同取值总在同一档，大量并列时各档人数可能不均"""
+    return np.clip((np.asarray(below) * 5 // max(total, 1)).astype(np.int64), 0, 4)
+
+# 列名 -> 是否反向打分（最近活跃天数越小分数越高）
+RFM_SCORE_COLUMNS = {
+    'recency_days': ('R_score', True),
+    'frequency': ('F_score', False),
+    'monetary_value': ('M_score', False)
+}
+
+
+class _BucketStore:
+    """连续整数桶计数（offset为counts[0]对应的桶编号）"""
+
+    def __init__(self, offset=0, counts=None):
+        self.offset = offset
+        self.counts = np.asarray(counts if counts is not None else [], dtype=np.int64)
+
+    @property
+    def total(self):
+        return int(self.counts.sum())
+
+    def _extend(self, min_key, max_key):
+        """扩展桶范围以覆盖 [min_key, max_key]"""
+        if len(self.counts) == 0:
+            self.offset = min_key
+            self.counts = np.zeros(max_key - min_key + 1, dtype=np.int64)
+            return
+        new_offset = min(self.offset, min_key)
+        new_end = max(self.offset + len(self.counts) - 1, max_key)
+        if new_offset == self.offset and new_end == self.offset + len(self.counts) - 1:
+            return
+        counts = np.zeros(new_end - new_offset + 1, dtype=np.int64)
+        start = self.offset - new_offset
+        counts[start:start + len(self.counts)] = self.counts
+        self.offset, self.counts = new_offset, counts
+
+    def add_keys(self, keys):
+        """批量加入桶编号"""
+        if len(keys) == 0:
+            return
+        min_key, max_key = int(keys.min()), int(keys.max())
+        self._extend(min_key, max_key)
+        self.counts += np.bincount(keys - self.offset, minlength=len(self.counts))
+
+    def merge(self, other):
+        """合并另一个桶计数"""
+        if len(other.counts) == 0:
+            return
+        self._extend(other.offset, other.offset + len(other.counts) - 1)
+        start = other.offset - self.offset
+        self.counts[start:start + len(other.counts)] += other.counts
+
+    def key_at_rank(self, rank, descending=False):
+        """返回累计计数首次超过rank的桶编号"""
+        counts = self.counts[::-1] if descending else self.counts
+        index = int(np.searchsorted(np.cumsum(counts), rank, side='right'))
+        index = min(index, len(counts) - 1)
+        if descending:
+            return self.offset + len(counts) - 1 - index
+        return self.offset + index
+
+    def counts_at(self, keys):
+        """各桶编号的 (编号更小的桶累计计数, 本桶计数)，超出范围的编号本桶计数为0"""
+        keys = np.asarray(keys, dtype=np.int64) - self.offset
+        cumulative = np.concatenate([[0], np.cumsum(self.counts)])
+        inside = (keys >= 0) & (keys < len(self.counts))
+        count = np.zeros(len(keys), dtype=np.int64)
+        count[inside] = self.counts[keys[inside]]
+        return cumulative[np.clip(keys, 0, len(self.counts))], count
+
+    def to_dict(self):
+        return {'offset': self.offset, 'counts': self.counts.tolist()}
+
+
+class QuantileSketch:
+    """相对误差分位数草图（对数分桶，DDSketch风格）
+
+    任意分位数估计值与真实值的相对误差不超过 relative_accuracy；
+    可分块构建、跨进程/机器合并，并以JSON持久化。
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        """初始化草图"""
+        if not 0 < relative_accuracy < 1:
+            raise ValueError(f"relative_accuracy 必须在(0, 1)之间: {relative_accuracy}")
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.min_indexable = 1e-9
+        self.positive = _BucketStore()
+        self.negative = _BucketStore()
+        self.zero_count = 0
+
+    @property
+    def count(self):
+        return self.positive.total + self.negative.total + self.zero_count
+
+    def _keys(self, magnitudes):
+        return np.ceil(np.log(magnitudes) / self.log_gamma).astype(np.int64)
+
+    def _value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def update(self, values):
+        """加入一批数值（忽略NaN）"""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+
+        positive = values > self.min_indexable
+        negative = values < -self.min_indexable
+        self.zero_count += int(len(values) - positive.sum() - negative.sum())
+        self.positive.add_keys(self._keys(values[positive]))
+        self.negative.add_keys(self._keys(-values[negative]))
+
+    def merge(self, other):
+        """合并另一个相同精度的草图"""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("只能合并相同 relative_accuracy 的草图")
+        self.positive.merge(other.positive)
+        self.negative.merge(other.negative)
+        self.zero_count += other.zero_count
+
+    def quantile(self, q):
+        """估计q分位数"""
+        if self.count == 0:
+            return float('nan')
+        rank = q * (self.count - 1)
+
+        if rank < self.negative.total:
+            return -self._value(self.negative.key_at_rank(rank, descending=True))
+        rank -= self.negative.total
+        if rank < self.zero_count:
+            return 0.0
+        rank -= self.zero_count
+        return self._value(self.positive.key_at_rank(rank))
+
+    def rank_below(self, values):
+        """每个数值所在桶之前（更小的桶）的计数，即该桶的起始排名
+
+        同一个桶内的数值得到相同结果，与批次内其他行及行顺序无关。
+        """
+        values = np.asarray(values, dtype=np.float64)
+        below = np.zeros(len(values))
+
+        negative = values < -self.min_indexable
+        if negative.any():
+            # 负数按绝对值降序排列: 绝对值更大的桶排在前面
+            before, count = self.negative.counts_at(self._keys(-values[negative]))
+            below[negative] = self.negative.total - before - count
+
+        positive = values > self.min_indexable
+        zero = ~negative & ~positive & ~np.isnan(values)
+        below[zero] = self.negative.total
+
+        if positive.any():
+            before, _ = self.positive.counts_at(self._keys(values[positive]))
+            below[positive] = self.negative.total + self.zero_count + before
+        return below
+
+    def to_dict(self):
+        return {
+            'relative_accuracy': self.relative_accuracy,
+            'zero_count': self.zero_count,
+            'positive': self.positive.to_dict(),
+            'negative': self.negative.to_dict()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data['relative_accuracy'])
+        sketch.zero_count = data['zero_count']
+        sketch.positive = _BucketStore(**data['positive'])
+        sketch.negative = _BucketStore(**data['negative'])
+        return sketch
+
+
+class RFMQuantileScorer:
+    """基于分位数草图的R、F、M 1-5分打分器"""
+
+    def __init__(self, relative_accuracy=0.01):
+        """初始化打分器"""
+        self.relative_accuracy = relative_accuracy
+        self.sketches = {column: QuantileSketch(relative_accuracy)
+                         for column in RFM_SCORE_COLUMNS}
+
+    @property
+    def count(self):
+        return self.sketches['frequency'].count
+
+    def update(self, rfm_df):
+        """加入一块RFM原始值"""
+        for column, sketch in self.sketches.items():
+            sketch.update(rfm_df[column])
+
+    def merge(self, other):
+        """合并另一个打分器的草图"""
+        for column, sketch in self.sketches.items():
+            sketch.merge(other.sketches[column])
+
+    def edges(self, column):
+        """某列的五等分切点"""
+        return np.array([self.sketches[column].quantile(q) for q in SCORE_QUANTILES])
+
+    def score(self, rfm_df):
+        """按数值所在桶的起始排名打1-5分（同一桶内的数值分数相同，重复打分结果稳定）"""
+        for column, (score_column, reverse) in RFM_SCORE_COLUMNS.items():
+            sketch = self.sketches[column]
+            bins = quintile_bins(sketch.rank_below(rfm_df[column].to_numpy()), sketch.count)
+            scores = 5 - bins if reverse else bins + 1
+            rfm_df[score_column] = scores.astype(np.int8)
+        return rfm_df
+
+    def to_dict(self):
+        return {column: sketch.to_dict() for column, sketch in self.sketches.items()}
+
+    @classmethod
+    def from_dict(cls, data):
+        scorer = cls(data['frequency']['relative_accuracy'])
+        scorer.sketches = {column: QuantileSketch.from_dict(data[column])
+                           for column in RFM_SCORE_COLUMNS}
+        return scorer
+
+    def save(self, path):
+        """保存草图到JSON文件"""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path):
+        """从JSON文件加载草图"""
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+RFM结果紧凑存储（内存映射NumPy记录数组）
+Compact Typed RFM Result Store
+"""
+
+import os
+import time
+
+import pandas as pd
+import numpy as np
+
+# 定长记录布局，下游可通过 np.load(mmap_mode='r') 零拷贝打开
+RFM_RECORD_DTYPE = np.dtype([
+    ('user_key', '<i4'),
+    ('recency_days', '<i2'),
+    ('frequency', '<i4'),
+    ('monetary_value', '<f4'),
+    ('R_score', 'i1'),
+    ('F_score', 'i1'),
+    ('M_score', 'i1')
+])
+
+
+def user_ids_path(path):
+    """非整数用户标识的旁路文件路径"""
+    root, _ = os.path.splitext(path)
+    return root + '.user_ids.npy'
+
+
+def _checked_cast(values, dtype, name):
+    """转换为目标整数类型，超出范围时报错"""
+    values = np.asarray(values)
+    info = np.iinfo(dtype)
+    if len(values) and (values.min() < info.min or values.max() > info.max):
+        raise ValueError(f"{name} 超出 {np.dtype(dtype).name} 取值范围")
+    return values.astype(dtype)
+
+
+def write_rfm_store(rfm_df, path):
+    """将RFM结果原子写入定长记录文件
+
+    user_key 非整数（如模拟数据的 'U000001'）时，记录中保存行号，
+    原始标识写入旁路文件 *.user_ids.npy（整数标识时旁路文件为空数组）。
+    两个文件都写到临时路径后设置相同的修改时间（纳秒）作为本次写入的代次，
+    先替换旁路文件、再替换记录文件；读取方发现代次不一致时重试。
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp.npy'
+    sidecar_tmp_path = user_ids_path(path) + '.tmp.npy'
+    records = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=RFM_RECORD_DTYPE,
+                                        shape=(len(rfm_df),))
+
+    user_keys = rfm_df['user_key']
+    if pd.api.types.is_integer_dtype(user_keys):
+        records['user_key'] = _checked_cast(user_keys, np.int32, 'user_key')
+        np.save(sidecar_tmp_path, np.empty(0, dtype=str))
+    else:
+        records['user_key'] = np.arange(len(rfm_df), dtype=np.int32)
+        np.save(sidecar_tmp_path, np.asarray(user_keys, dtype=str))
+
+    records['recency_days'] = _checked_cast(rfm_df['recency_days'], np.int16, 'recency_days')
+    records['frequency'] = _checked_cast(rfm_df['frequency'], np.int32, 'frequency')
+    records['monetary_value'] = rfm_df['monetary_value'].to_numpy(dtype=np.float32)
+    for column in ('R_score', 'F_score', 'M_score'):
+        records[column] = np.asarray(rfm_df[column], dtype=np.int8)
+
+    records.flush()
+    del records
+    generation = time.time_ns()
+    for written in (sidecar_tmp_path, tmp_path):
+        os.utime(written, ns=(generation, generation))
+    os.replace(sidecar_tmp_path, user_ids_path(path))
+    os.replace(tmp_path, path)
+
+
+def open_rfm_store(path):
+    """以只读内存映射方式打开RFM结果（零拷贝）"""
+    return np.load(path, mmap_mode='r')
+
+
+def open_rfm_store_with_ids(path, retries=10):
+    """打开RFM结果及同一次写入的用户标识，返回 (记录, 用户标识或None)
+
+    记录文件与旁路文件的修改时间不一致说明正读到写入方替换的中途，稍后重试。
+    没有旁路文件的旧结果视为整数标识。
+    """
+    sidecar = user_ids_path(path)
+    for _ in range(retries):
+        generation = os.stat(path).st_mtime_ns
+        records = open_rfm_store(path)
+        if not os.path.exists(sidecar):
+            user_ids = None
+        else:
+            user_ids = np.load(sidecar, mmap_mode='r')
+            if os.stat(sidecar).st_mtime_ns != generation:
+                user_ids = False
+            elif len(user_ids) == 0:
+                user_ids = None
+        if user_ids is not False and os.stat(path).st_mtime_ns == generation:
+            return records, user_ids
+        time.sleep(0.1)
+    raise RuntimeError(f"RFM结果 {path} 与用户标识文件 {sidecar} 的写入代次不一致，结果可能正在更新")
+
+
+def load_user_ids(path):
+    """读取与当前记录文件同一次写入的非整数用户标识，整数标识时返回None"""
+    return open_rfm_store_with_ids(path)[1]
+
+
+def store_to_frame(path, columns=None):
+    """将RFM结果读为DataFrame（按列取值，无文本解析）"""
+    records, user_ids = open_rfm_store_with_ids(path)
+    columns = columns or list(RFM_RECORD_DTYPE.names)
+    df = pd.DataFrame({column: records[column] for column in columns})
+
+    if user_ids is not None and 'user_key' in df:
+        df['user_key'] = np.asarray(user_ids)[df['user_key'].to_numpy()]
+    return df
+
+
+def iter_store_frames(path, chunk_size, columns=None):
+    """按块将RFM结果读为DataFrame（内存映射切片，每次只读入chunk_size条记录）"""
+    records, user_ids = open_rfm_store_with_ids(path)
+    columns = columns or list(RFM_RECORD_DTYPE.names)
+    for start in range(0, len(records), chunk_size):
+        block = records[start:start + chunk_size]
+        df = pd.DataFrame({column: np.asarray(block[column]) for column in columns})
+        if user_ids is not None and 'user_key' in df:
+            df['user_key'] = np.asarray(user_ids[df['user_key'].to_numpy()])
+        yield df
@@ -5,12 +5,38 @@ RFM分析计算器
 RFM Analysis Calculator
 """
 
+import os
+import shutil
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
-from pyhive import hive
+from datetime import datetime, timedelta, date
+from concurrent.futures import ProcessPoolExecutor
 import yaml
 
+from rfm_analysis.local_engine import LocalRFMEngine
+from rfm_analysis.streaming import fold_chunks
+from rfm_analysis.incremental import RFMState, validate_partition
+from rfm_analysis.segments import compile_segment_lookup, assign_segments
+from rfm_analysis.quantile_sketch import RFMQuantileScorer, quintile_bins
+from rfm_analysis.partial_aggregate import shard_mask, run_partial_task, reduce_partials
+from rfm_analysis.result_store import write_rfm_store, store_to_frame
+from rfm_analysis.chart_aggregates import (
+    ActivityCube, save_rfm_histograms, ACTIVITY_CUBE_FILE, RETENTION_FILE
+)
+from retention.cohort_retention import RetentionMatrix, ActivityBitmap, save_retention_table
+from retention.incremental_retention import RetentionState
+from retention.activity_index import ActivityIndex
+from retention.hll import HLLSketchTable, sketch_chunks
+
+def exact_quintile_scores(values, labels):
+    """全量qcut五等分打分；分位切点重复（大量并列值）时qcut无法切分，
+    改按 "小于该值的个数" 分档，相同取值的用户分数相同，与行顺序无关"""
+    edges = values.quantile([0, 0.2, 0.4, 0.6, 0.8, 1])
+    if edges.is_unique:
+        return pd.qcut(values, 5, labels=labels)
+    bins = quintile_bins(values.rank(method='min').to_numpy() - 1, len(values))
+    return pd.Categorical.from_codes(bins, categories=labels, ordered=True)
+
 class RFMCalculator:
     """RFM分析计算器"""
     
@@ -21,6 +47,8 @@ class RFMCalculator:
         
     def connect_hive(self):
         """连接Hive数据库"""
+        from pyhive import hive
+        
         try:
             self.connection = hive.Connection(
                 host='localhost',
@@ -66,51 +94,548 @@ class RFMCalculator:
         """
         return pd.read_sql(query, self.connection)
     
-    def calculate_rfm_scores(self):
-        """计算RFM分数"""
-        print("开始计算RFM分数...")
+    def calculate_rfm_fused(self):
+        """单次扫描同时计算R、F、M
         
-        # 连接数据库
-        self.connect_hive()
+        LEFT JOIN 保证F、M统计全部观看事件（与原F/M查询一致），
+        HAVING 只保留至少有一条事件关联到时间维度的用户（与原R查询内连接后合并一致）。
+        """
+        query = """
+        SELECT 
+            fw.user_key,
+            DATEDIFF(CURRENT_DATE(), MAX(dt.full_time)) as recency_days,
+            COUNT(*) as frequency,
+            SUM(fw.duration_min) as monetary_value
+        FROM fact_watching fw
+        LEFT JOIN dim_time dt ON fw.time_key = dt.time_key
+        GROUP BY fw.user_key
+        HAVING MAX(dt.full_time) IS NOT NULL
+        """
+        return pd.read_sql(query, self.connection)
+    
+    def iter_fact_events(self, chunk_size, partition=None, shard=None):
+        """通过游标fetchmany分块读取观看事件，可限定单个dt分区或用户哈希分片
         
-        # 计算R、F、M
+        LEFT JOIN 保留时间维度缺失的事件（full_time 为NULL），F、M统计全部事件，
+        只有R及按时间归档的聚合（留存、活跃度立方体）忽略这些事件，与融合查询一致。
+        """
+        query = """
+        SELECT 
+            fw.user_key,
+            dt.full_time,
+            fw.duration_min
+        FROM fact_watching fw
+        LEFT JOIN dim_time dt ON fw.time_key = dt.time_key
+        """
+        conditions = []
+        if partition is not None:
+            conditions.append(f"fw.dt = '{validate_partition(partition)}'")
+        if shard is not None:
+            shard_index, num_shards = shard
+            conditions.append(f"pmod(hash(fw.user_key), {int(num_shards)}) = {int(shard_index)}")
+        if conditions:
+            query += "WHERE " + " AND ".join(conditions)
+        columns = ['user_key', 'full_time', 'duration_min']
+        
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(query)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield pd.DataFrame(rows, columns=columns)
+        finally:
+            cursor.close()
+    
+    def list_fact_partitions(self):
+        """列出fact_watching的dt分区"""
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute("SHOW PARTITIONS fact_watching")
+            return sorted(row[0].split('=', 1)[1] for row in cursor.fetchall())
+        finally:
+            cursor.close()
+    
+    def iter_partition_events(self, partition, chunk_size):
+        """分块读取单个dt分区的观看事件"""
+        return self.iter_fact_events(chunk_size, partition)
+    
+    def iter_worker_events(self, chunk_size, shard=None, partitions=None):
+        """并行worker读取的观看事件（用户哈希分片或dt分区子集），返回(分块迭代器, 事件列名)"""
+        rfm_config = self.config['rfm_analysis']
+        
+        if rfm_config.get('backend', 'hive') == 'local':
+            engine = LocalRFMEngine(rfm_config.get('local', {}))
+            if partitions is not None:
+                chunks = (chunk for partition in partitions
+                          for chunk in engine.iter_partition_events(partition, chunk_size))
+            else:
+                chunks = engine.iter_events(chunk_size)
+            if shard is not None:
+                chunks = (chunk[shard_mask(chunk[engine.user_column], *shard)] for chunk in chunks)
+            return chunks, engine.columns
+        
+        self.connect_hive()
+        if partitions is not None:
+            chunks = (chunk for partition in partitions
+                      for chunk in self.iter_fact_events(chunk_size, partition, shard))
+        else:
+            chunks = self.iter_fact_events(chunk_size, shard=shard)
+        return chunks, ['user_key', 'full_time', 'duration_min']
+    
+    def calculate_rfm_streaming(self, chunk_size):
+        """分块流式计算R、F、M（内存只与用户数相关）"""
+        print(f"流式读取fact_watching (每块 {chunk_size} 条)")
+        return fold_chunks(self.iter_fact_events(chunk_size),
+                           'user_key', 'full_time', 'duration_min')
+    
+    def calculate_rfm_three_pass(self):
+        """分别计算R、F、M后合并（原三次扫描方式，保留用于对比）"""
         recency_df = self.calculate_recency()
         frequency_df = self.calculate_frequency()
         monetary_df = self.calculate_monetary()
         
-        # 合并数据
         rfm_df = recency_df.merge(frequency_df, on='user_key')
         rfm_df = rfm_df.merge(monetary_df, on='user_key')
+        return rfm_df
+    
+    def calculate_rfm_values(self):
+        """按配置的计算后端和查询模式计算R、F、M原始值"""
+        rfm_config = self.config['rfm_analysis']
+        backend = rfm_config.get('backend', 'hive')
+        streaming = rfm_config.get('streaming', {})
+        chunk_size = streaming.get('chunk_size', 1000000)
+        
+        if backend == 'local':
+            engine = LocalRFMEngine(rfm_config.get('local', {}))
+            if streaming.get('enabled', False):
+                return engine.calculate_rfm_streaming(chunk_size)
+            return engine.calculate_rfm()
+        if backend != 'hive':
+            raise ValueError(f"不支持的计算后端: {backend}")
+        
+        # 连接数据库
+        self.connect_hive()
+        
+        if streaming.get('enabled', False):
+            return self.calculate_rfm_streaming(chunk_size)
+        
+        query_mode = rfm_config.get('query_mode', 'fused')
+        
+        if query_mode == 'fused':
+            return self.calculate_rfm_fused()
+        if query_mode == 'three_pass':
+            return self.calculate_rfm_three_pass()
+        raise ValueError(f"不支持的查询模式: {query_mode}")
+    
+    def _partition_source(self):
+        """增量计算的分区数据源: (可用分区, 分区读取函数, 事件列名)"""
+        rfm_config = self.config['rfm_analysis']
+        
+        if rfm_config.get('backend', 'hive') == 'local':
+            engine = LocalRFMEngine(rfm_config.get('local', {}))
+            return engine.list_partitions(), engine.iter_partition_events, engine.columns
+        
+        self.connect_hive()
+        return (self.list_fact_partitions(), self.iter_partition_events,
+                ['user_key', 'full_time', 'duration_min'])
+    
+    def _state_path(self):
+        """增量RFM状态文件路径"""
+        incremental = self.config['rfm_analysis'].get('incremental', {})
+        return incremental.get('state_path', 'data/state/rfm_state.parquet')
+    
+    def _apply_partitions(self, state, partitions, iter_partition, columns):
+        """将指定分区依次合并进RFM状态，保存后返回快照RFM原始值"""
+        rfm_config = self.config['rfm_analysis']
+        chunk_size = rfm_config.get('streaming', {}).get('chunk_size', 1000000)
+        
+        for partition in partitions:
+            state.apply_partition(partition, iter_partition(partition, chunk_size), *columns)
+        
+        state.save(self._state_path())
+        return state.to_frame(rfm_config.get('local', {}).get('snapshot_date'))
+    
+    def update_rfm_incremental(self, partition=None):
+        """增量更新: 只合并新的dt分区（未指定时补齐所有未处理分区）"""
+        print("开始增量更新RFM状态...")
+        state = RFMState.load(self._state_path())
+        available, iter_partition, columns = self._partition_source()
+        
+        partitions = [partition] if partition else state.pending_partitions(available)
+        print(f"待处理分区: {partitions}")
+        
+        rfm_df = self._apply_partitions(state, partitions, iter_partition, columns)
+        return self.score_rfm(rfm_df)
+    
+    def rebuild_rfm_state(self):
+        """全量重建RFM状态（用于对账）"""
+        print("开始全量重建RFM状态...")
+        available, iter_partition, columns = self._partition_source()
+        
+        rfm_df = self._apply_partitions(RFMState(), available, iter_partition, columns)
+        return self.score_rfm(rfm_df)
+    
+    def _default_split(self):
+        """未配置拆分方式时: Hive按用户哈希（在Hive端过滤），本地按dt分区（各worker只读自己的分区文件），
+        本地没有dt分区时只能按哈希拆分"""
+        rfm_config = self.config['rfm_analysis']
+        if rfm_config.get('backend', 'hive') != 'local':
+            return 'hash'
+        engine = LocalRFMEngine(rfm_config.get('local', {}))
+        return 'partition' if engine.list_partitions() else 'hash'
+    
+    def calculate_rfm_parallel(self):
+        """多进程计算部分聚合后归约（按用户哈希或dt分区拆分）"""
+        rfm_config = self.config['rfm_analysis']
+        parallel = rfm_config.get('parallel', {})
+        workers = parallel.get('workers') or os.cpu_count()
+        split = parallel.get('split') or self._default_split()
+        partials_dir = parallel.get('partials_dir', 'data/state/rfm_partials')
+        
+        # 所有worker使用同一快照日期，保证最近活跃天数及草图一致
+        snapshot_date = rfm_config.get('local', {}).get('snapshot_date') or date.today().isoformat()
+        
+        if split == 'hash':
+            if rfm_config.get('backend', 'hive') == 'local':
+                print("注意: 本地后端按哈希拆分时每个worker都要读取并解析全部观看记录，只在内存中过滤")
+            tasks = [{'shard': (i, workers)} for i in range(workers)]
+        elif split == 'partition':
+            available, _, _ = self._partition_source()
+            tasks = [{'partitions': available[i::workers]} for i in range(min(workers, len(available)))]
+        else:
+            raise ValueError(f"不支持的拆分方式: {split}")
         
-        # 计算RFM分数（1-5分）
-        rfm_df['R_score'] = pd.qcut(rfm_df['recency_days'], 5, labels=[5,4,3,2,1])
-        rfm_df['F_score'] = pd.qcut(rfm_df['frequency'], 5, labels=[1,2,3,4,5])
-        rfm_df['M_score'] = pd.qcut(rfm_df['monetary_value'], 5, labels=[1,2,3,4,5])
+        print(f"开始并行计算RFM: {workers} 个进程, 按{split}拆分")
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(run_partial_task, self.config, snapshot_date,
+                                   os.path.join(partials_dir, f'part-{i:05d}.parquet'), **task)
+                       for i, task in enumerate(tasks)]
+            paths = [future.result() for future in futures]
+        
+        merged = reduce_partials(paths)
+        return self.score_rfm(merged.to_frame(), merged.scorer)
+    
+    def calculate_rfm_scores(self):
+        """计算RFM分数"""
+        print("开始计算RFM分数...")
+        
+        # 计算R、F、M
+        rfm_df = self.calculate_rfm_values()
+        
+        return self.score_rfm(rfm_df)
+    
+    def build_quantile_scorer(self, rfm_df):
+        """分块构建R、F、M分位数草图，或复用已保存的草图"""
+        scoring = self.config['rfm_analysis'].get('scoring', {})
+        sketch_path = scoring.get('sketch_path', 'data/state/rfm_quantile_sketch.json')
+        
+        if scoring.get('reuse_sketch', False) and os.path.exists(sketch_path):
+            scorer = RFMQuantileScorer.load(sketch_path)
+            print(f"复用分位数草图: {sketch_path} ({scorer.count} 个用户)")
+            return scorer
+        
+        scorer = RFMQuantileScorer(scoring.get('relative_accuracy', 0.01))
+        chunk_size = self.config['rfm_analysis'].get('streaming', {}).get('chunk_size', 1000000)
+        for start in range(0, len(rfm_df), chunk_size):
+            scorer.update(rfm_df.iloc[start:start + chunk_size])
+        
+        scorer.save(sketch_path)
+        print(f"分位数草图已保存到 {sketch_path}（相对误差 {scorer.relative_accuracy}）")
+        return scorer
+    
+    def score_rfm(self, rfm_df, scorer=None):
+        """对RFM原始值打分并保存结果（可传入已合并的分位数草图）"""
+        method = self.config['rfm_analysis'].get('scoring', {}).get('method', 'exact')
+        
+        if method == 'sketch':
+            # 基于分位数草图的近似五等分，无需全量排序
+            scorer = scorer or self.build_quantile_scorer(rfm_df)
+            scorer.score(rfm_df)
+        elif method == 'exact':
+            # 计算RFM分数（1-5分）
+            rfm_df['R_score'] = exact_quintile_scores(rfm_df['recency_days'], [5,4,3,2,1])
+            rfm_df['F_score'] = exact_quintile_scores(rfm_df['frequency'], [1,2,3,4,5])
+            rfm_df['M_score'] = exact_quintile_scores(rfm_df['monetary_value'], [1,2,3,4,5])
+        else:
+            raise ValueError(f"不支持的打分方式: {method}")
         
         # 保存结果
-        rfm_df.to_csv('data/results/rfm_scores.csv', index=False)
-        print("RFM分数计算完成，结果保存到 data/results/rfm_scores.csv")
+        self.save_rfm_results(rfm_df)
         
         return rfm_df
     
+    def save_rfm_results(self, rfm_df):
+        """保存RFM结果: 定长二进制记录为主，CSV/Parquet为可选导出"""
+        output = self.config['rfm_analysis'].get('output', {})
+        store_path = output.get('store_path', 'data/results/rfm_scores.npy')
+        
+        write_rfm_store(rfm_df, store_path)
+        print(f"RFM分数计算完成，结果保存到 {store_path}")
+        
+        # 图表使用的R/F/M固定分箱直方图
+        aggregates = self._aggregates_config()
+        histogram_path = save_rfm_histograms(
+            rfm_df, aggregates.get('path', 'data/aggregates'), aggregates.get('histogram_bins'),
+            self.config['rfm_analysis'].get('streaming', {}).get('chunk_size', 1000000))
+        print(f"R/F/M直方图已保存到 {histogram_path}")
+        
+        if output.get('csv_export', True):
+            rfm_df.to_csv('data/results/rfm_scores.csv', index=False)
+            print("已导出CSV: data/results/rfm_scores.csv")
+        
+        if output.get('parquet_export', False):
+            # 供Superset等外部工具读取的类型化Parquet
+            store_to_frame(store_path).to_parquet('data/results/rfm_scores.parquet', index=False)
+            print("已导出Parquet: data/results/rfm_scores.parquet")
+    
+    def _aggregates_config(self):
+        return self.config['rfm_analysis'].get('aggregates', {})
+    
+    def _aggregate_hive(self, max_offset):
+        """在Hive端完成时段与留存聚合，只取回分组结果
+        
+        活跃度立方体只含次数与时长（日期标记为无去重草图，users指标会报错），
+        去重用户草图由 rfm_daily/rfm_rebuild 按分区读取事件时写入。
+        """
+        cube = self._new_activity_cube()
+        cube_query = """
+        SELECT 
+            datediff(to_date(dt.full_time), '1970-01-01') AS activity_day,
+            hour(dt.full_time) AS hour_of_day,
+            COUNT(*) AS sessions,
+            SUM(fw.duration_min) AS duration
+        FROM fact_watching fw
+        JOIN dim_time dt ON fw.time_key = dt.time_key
+        GROUP BY datediff(to_date(dt.full_time), '1970-01-01'), hour(dt.full_time)
+        """
+        rows = pd.read_sql(cube_query, self.connection)
+        cube.update_counts(rows['activity_day'], rows['hour_of_day'], rows['sessions'], rows['duration'])
+        
+        retention_query = f"""
+        WITH active AS (
+            SELECT DISTINCT fw.user_key, to_date(dt.full_time) AS active_date
+            FROM fact_watching fw
+            JOIN dim_time dt ON fw.time_key = dt.time_key
+        ),
+        cohort AS (
+            SELECT user_key, MIN(active_date) AS cohort_date
+            FROM active
+            GROUP BY user_key
+        )
+        SELECT 
+            datediff(c.cohort_date, '1970-01-01') AS cohort_day,
+            datediff(a.active_date, c.cohort_date) AS day_offset,
+            COUNT(*) AS users
+        FROM active a
+        JOIN cohort c ON a.user_key = c.user_key
+        WHERE datediff(a.active_date, c.cohort_date) <= {int(max_offset)}
+        GROUP BY c.cohort_date, datediff(a.active_date, c.cohort_date)
+        """
+        rows = pd.read_sql(retention_query, self.connection)
+        last_day = pd.read_sql(
+            "SELECT datediff(MAX(to_date(dt.full_time)), '1970-01-01') AS last_day "
+            "FROM fact_watching fw JOIN dim_time dt ON fw.time_key = dt.time_key",
+            self.connection)['last_day'].iloc[0]
+        retention = RetentionMatrix.from_counts(rows['cohort_day'], rows['day_offset'], rows['users'],
+                                                max_offset, last_day)
+        return cube, retention
+    
+    def _new_activity_cube(self):
+        relative_error = self._aggregates_config().get('activity_cube', {}).get('relative_error', 0.05)
+        return ActivityCube.for_error(relative_error)
+    
+    def save_activity_cube(self, cube):
+        directory = self._aggregates_config().get('path', 'data/aggregates')
+        cube.save(os.path.join(directory, ACTIVITY_CUBE_FILE))
+        print(f"活跃度立方体已保存到 {directory}: {len(cube.days)} 天, {int(cube.sessions.sum())} 次观看")
+    
+    def update_activity_cube(self, partition=None, rebuild=False):
+        """将新的dt分区合并进活跃度立方体（未指定时补齐立方体最后一天之后的所有分区）
+        
+        rebuild 为True时从空立方体开始按顺序合并全部分区，已保存的立方体被整体替换。
+        """
+        path = os.path.join(self._aggregates_config().get('path', 'data/aggregates'), ACTIVITY_CUBE_FILE)
+        cube = ActivityCube.load(path) if os.path.exists(path) and not rebuild else self._new_activity_cube()
+        available, iter_partition, columns = self._partition_source()
+        chunk_size = self.config['rfm_analysis'].get('streaming', {}).get('chunk_size', 1000000)
+        
+        last_day = None if cube.last_day is None else str(np.datetime64(cube.last_day, 'D'))
+        partitions = [partition] if partition and not rebuild else [
+            p for p in available if last_day is None or p > last_day]
+        print(f"活跃度立方体待合并分区: {partitions}")
+        for partition in sorted(partitions):
+            if last_day is not None and partition <= last_day:
+                print(f"分区 dt={partition} 不晚于活跃度立方体最后一天 {last_day}，跳过")
+                continue
+            for chunk in iter_partition(partition, chunk_size):
+                cube.update(chunk[columns[1]], chunk[columns[2]], chunk[columns[0]])
+        self.save_activity_cube(cube)
+        return cube
+    
+    def build_chart_aggregates(self):
+        """生成图表预聚合数据: 活跃度立方体与同期群留存矩阵（R/F/M直方图随结果保存）"""
+        rfm_config = self.config['rfm_analysis']
+        max_offset = self._aggregates_config().get('retention_max_offset', 30)
+        print("生成图表预聚合数据...")
+        
+        if rfm_config.get('backend', 'hive') == 'local':
+            engine = LocalRFMEngine(rfm_config.get('local', {}))
+            chunk_size = rfm_config.get('streaming', {}).get('chunk_size', 1000000)
+            cube = self._new_activity_cube()
+            bitmap = ActivityBitmap()
+            for chunk in engine.iter_events(chunk_size):
+                cube.update(chunk[engine.time_column], chunk[engine.duration_column],
+                            chunk[engine.user_column])
+                bitmap.update(chunk[engine.user_column], chunk[engine.time_column])
+            retention = bitmap.retention_matrix(max_offset)
+        else:
+            if self.connection is None:
+                self.connect_hive()
+            cube, retention = self._aggregate_hive(max_offset)
+        
+        self.save_activity_cube(cube)
+        self.save_retention(retention)
+    
+    def save_retention(self, retention):
+        """保存留存矩阵，并由同一矩阵导出N日留存表"""
+        aggregates = self._aggregates_config()
+        directory = aggregates.get('path', 'data/aggregates')
+        retention.save(os.path.join(directory, RETENTION_FILE))
+        print(f"留存矩阵已保存到 {directory}: {len(retention.cohort_days)} 个同期群")
+        
+        table_config = aggregates.get('retention_table', {})
+        table_path = table_config.get('path', 'data/results/user_retention_rate.csv')
+        period = table_config.get('period', 7)
+        if period <= retention.max_offset:
+            table = save_retention_table(retention, table_path, period)
+            print(f"{period}日留存表已保存到 {table_path}: {len(table)} 个同期群")
+    
+    def _retention_state_path(self):
+        """增量留存状态文件路径"""
+        incremental = self.config['rfm_analysis'].get('incremental', {})
+        return incremental.get('retention_state_path', 'data/state/retention_state.parquet')
+    
+    def _distinct_config(self):
+        return self._aggregates_config().get('approximate_distinct', {})
+    
+    def _load_sketches(self, path, key_columns, fresh=False):
+        """加载HLL草图表，不存在、需要重建或误差配置变化时新建"""
+        relative_error = self._distinct_config().get('relative_error', 0.02)
+        table = HLLSketchTable.for_error(key_columns, relative_error)
+        if not fresh and os.path.exists(path):
+            saved = HLLSketchTable.load(path)
+            if saved.precision == table.precision and saved.key_columns == table.key_columns:
+                return saved
+            print(f"HLL草图 {path} 的精度或键列与配置不一致，将重新开始累积（需 rfm_rebuild 补齐历史）")
+        return table
+    
+    def _user_dimensions(self, dimensions):
+        """用户维度表（以用户标识为索引，维度值为字符串）"""
+        distinct = self._distinct_config()
+        if self.config['rfm_analysis'].get('backend', 'hive') == 'local':
+            users = pd.read_csv(distinct.get('users_path', 'data/simulated_users.csv'))
+            users = users.rename(columns=distinct.get('column_map', {'region': 'province'}))
+            users = users.set_index(distinct.get('user_column', 'user_id'))
+        else:
+            users = pd.read_sql(f"SELECT user_key, {', '.join(dimensions)} FROM dim_user",
+                                self.connection).set_index('user_key')
+        return users[dimensions].astype(str)
+    
+    def _apply_retention_partitions(self, state, partitions, rebuild=False):
+        """将指定分区依次合并进留存状态，保存状态并刷新留存矩阵与N日留存表"""
+        available, iter_partition, columns = self._partition_source()
+        chunk_size = self.config['rfm_analysis'].get('streaming', {}).get('chunk_size', 1000000)
+        
+        # 近似去重模式: (同期群, 偏移天数) 与用户维度单元格的HLL草图随分区一同更新
+        distinct = self._distinct_config()
+        dimension_sketches = None
+        if distinct.get('enabled', False):
+            cohort_path = distinct.get('cohort_path', 'data/state/cohort_hll.npz')
+            dimension_path = distinct.get('dimension_path', 'data/state/dimension_hll.npz')
+            dimensions = distinct.get('dimensions', ['province', 'city', 'age', 'gender'])
+            state.sketches = self._load_sketches(cohort_path, ['cohort_day', 'day_offset'], rebuild)
+            dimension_sketches = self._load_sketches(dimension_path, dimensions, rebuild)
+            user_dimensions = self._user_dimensions(dimensions)
+        
+        for partition in sorted(partitions):
+            chunks = iter_partition(partition, chunk_size)
+            if dimension_sketches is not None and (state.watermark is None or partition > state.watermark):
+                chunks = sketch_chunks(chunks, dimension_sketches, columns[0], user_dimensions)
+            state.apply_partition(partition, chunks, columns[0], columns[1])
+        
+        state.save(self._retention_state_path())
+        self.save_retention(state.retention)
+        if dimension_sketches is not None:
+            self.save_distinct_counts(state.sketches, cohort_path, 'cohort_distinct.csv')
+            self.save_distinct_counts(dimension_sketches, dimension_path, 'dimension_distinct.csv')
+        return state.retention
+    
+    def save_distinct_counts(self, sketches, path, filename):
+        """保存HLL草图，并导出各单元格的去重人数估计值、估计方法及相对误差"""
+        sketches.save(path)
+        output_path = os.path.join('data/results', filename)
+        os.makedirs('data/results', exist_ok=True)
+        sketches.estimates().to_csv(output_path, index=False)
+        print(f"HLL草图已保存到 {path}（{len(sketches)} 个单元格, {sketches.nbytes / 1024 / 1024:.1f} MB, "
+              f"HLL区间相对误差 {sketches.relative_error:.2%}），估计值及逐单元格误差导出到 {output_path}")
+    
+    def update_retention_incremental(self, partition=None):
+        """增量更新留存: 只合并水位之后的dt分区，不重新扫描历史事件"""
+        print("开始增量更新留存状态...")
+        max_offset = self._aggregates_config().get('retention_max_offset', 30)
+        state = RetentionState.load(self._retention_state_path(), max_offset)
+        available, _, _ = self._partition_source()
+        
+        partitions = [partition] if partition else state.pending_partitions(available)
+        print(f"待处理分区: {partitions}")
+        return self._apply_retention_partitions(state, partitions)
+    
+    def rebuild_retention_state(self):
+        """按分区顺序全量重建留存状态（用于补数或对账）"""
+        print("开始全量重建留存状态...")
+        max_offset = self._aggregates_config().get('retention_max_offset', 30)
+        available, _, _ = self._partition_source()
+        return self._apply_retention_partitions(RetentionState(max_offset), available, rebuild=True)
+    
+    def update_activity_index(self, partition=None, rebuild=False):
+        """为新的dt分区追加按日活跃用户位图（未指定时补齐索引最后一天之后的所有分区）
+        
+        rebuild 为True时在临时目录从空索引重建全部分区，完成后替换原索引目录。
+        """
+        directory = self.config['rfm_analysis'].get('activity_index', {}).get('path', 'data/activity_index')
+        index_dir = directory + '.rebuild' if rebuild else directory
+        if rebuild:
+            shutil.rmtree(index_dir, ignore_errors=True)
+        index = ActivityIndex(index_dir)
+        available, iter_partition, columns = self._partition_source()
+        chunk_size = self.config['rfm_analysis'].get('streaming', {}).get('chunk_size', 1000000)
+        
+        partitions = [partition] if partition and not rebuild else [
+            p for p in available if index.last_day is None or p > index.last_day]
+        print(f"活跃索引待追加分区: {partitions}")
+        for partition in sorted(partitions):
+            index.append_partition(partition, iter_partition(partition, chunk_size), columns[0])
+        
+        if rebuild:
+            shutil.rmtree(directory, ignore_errors=True)
+            if os.path.exists(index_dir):
+                os.replace(index_dir, directory)
+            index = ActivityIndex(directory)
+            print(f"活跃索引已重建: {len(index.days)} 天, {len(index.users)} 个用户")
+        return index
+    
     def segment_users(self, rfm_df):
         """用户分群"""
         print("开始用户分群...")
         
-        # 定义分群规则
+        # 将分群规则编译为(R, F, M)查找表后一次性查表
         segments = self.config['rfm_analysis']['segments']
+        lookup, names = compile_segment_lookup(segments)
         
-        def assign_segment(row):
-            r, f, m = row['R_score'], row['F_score'], row['M_score']
-            
-            for segment_name, rules in segments.items():
-                if (r in rules['recency'] and 
-                    f in rules['frequency'] and 
-                    m in rules['monetary']):
-                    return segment_name
-            return 'other'
-        
-        rfm_df['segment'] = rfm_df.apply(assign_segment, axis=1)
+        rfm_df['segment'] = assign_segments(rfm_df['R_score'], rfm_df['F_score'],
+                                            rfm_df['M_score'], lookup, names)
         
         # 保存分群结果
         rfm_df.to_csv('data/results/user_segments.csv', index=False)
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+RFM分群规则编译
+RFM Segment Rule Compilation
+"""
+
+import pandas as pd
+import numpy as np
+
+SCORE_LEVELS = 5
+OTHER_SEGMENT = 'other'
+
+
+def compile_segment_lookup(segments):
+    """将分群规则编译为按(R, F, M)分数索引的5x5x5查找表
+
+    规则按配置顺序匹配，靠前的规则优先；未命中任何规则的格子为 'other'。
+    返回 (查找表, 分群名称列表)，查找表中的值为分群名称的下标。
+    """
+    names = list(segments) + [OTHER_SEGMENT]
+    lookup = np.full((SCORE_LEVELS,) * 3, len(names) - 1, dtype=np.int8)
+
+    # 倒序写入，使靠前的规则覆盖靠后的规则
+    for code in reversed(range(len(segments))):
+        rules = segments[names[code]]
+        axes = [[score - 1 for score in rules[key] if 1 <= score <= SCORE_LEVELS]
+                for key in ('recency', 'frequency', 'monetary')]
+        lookup[np.ix_(*axes)] = code
+
+    return lookup, names
+
+
+def assign_segments(r_scores, f_scores, m_scores, lookup, names):
+    """按分数一次性查表得到每个用户的分群"""
+    r = np.asarray(r_scores, dtype=np.intp) - 1
+    f = np.asarray(f_scores, dtype=np.intp) - 1
+    m = np.asarray(m_scores, dtype=np.intp) - 1
+
+    return pd.Categorical.from_codes(lookup[r, f, m], categories=names)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式RFM计算
+Streaming RFM Computation
+"""
+
+import os
+import json
+import resource
+
+import pandas as pd
+import numpy as np
+
+from rfm_analysis.local_engine import reduce_events, build_rfm_frame, NO_TIME
+
+
+class RFMAccumulator:
+    """按用户维护的RFM累加器（最后观看时间、次数、时长合计）"""
+
+    def __init__(self):
+        """初始化空累加器"""
+        self.user_index = pd.Index([])
+        self.last_seen = np.empty(0, dtype=np.int64)
+        self.frequency = np.empty(0, dtype=np.int64)
+        self.monetary = np.empty(0, dtype=np.float64)
+
+    @classmethod
+    def from_frame(cls, frame):
+        """由累计状态表（user_key, last_seen, frequency, monetary）恢复累加器"""
+        accumulator = cls()
+        accumulator.user_index = pd.Index(frame['user_key'])
+        accumulator.last_seen = np.array(frame['last_seen'], dtype=np.int64)
+        accumulator.frequency = np.array(frame['frequency'], dtype=np.int64)
+        accumulator.monetary = np.array(frame['monetary'], dtype=np.float64)
+        return accumulator
+
+    def __len__(self):
+        return len(self.user_index)
+
+    @property
+    def nbytes(self):
+        """累加器占用的字节数"""
+        return (self.user_index.memory_usage(deep=True) + self.last_seen.nbytes
+                + self.frequency.nbytes + self.monetary.nbytes)
+
+    def merge_reduced(self, users, last_seen, frequency, monetary):
+        """合并一批已按用户归约的结果（users内无重复）"""
+        users = pd.Index(users)
+        positions = self.user_index.get_indexer(users)
+        new = positions < 0
+
+        if new.any():
+            n_new = int(new.sum())
+            positions[new] = np.arange(len(self), len(self) + n_new)
+            self.user_index = self.user_index.append(users[new])
+            self.last_seen = np.concatenate(
+                [self.last_seen, np.full(n_new, NO_TIME)])
+            self.frequency = np.concatenate(
+                [self.frequency, np.zeros(n_new, dtype=np.int64)])
+            self.monetary = np.concatenate(
+                [self.monetary, np.zeros(n_new, dtype=np.float64)])
+
+        self.last_seen[positions] = np.maximum(self.last_seen[positions], last_seen)
+        self.frequency[positions] += frequency
+        self.monetary[positions] += monetary
+
+    def merge(self, other):
+        """合并另一个累加器（如其他worker的部分聚合）"""
+        self.merge_reduced(other.user_index, other.last_seen,
+                           other.frequency, other.monetary)
+
+    def update(self, user_ids, timestamps, durations):
+        """将一个观看事件分块折叠进累加器"""
+        self.merge_reduced(*reduce_events(user_ids, timestamps, durations))
+
+    def state_frame(self):
+        """输出累计状态表（按user_key排序）"""
+        order = self.user_index.argsort()
+        return pd.DataFrame({
+            'user_key': self.user_index[order],
+            'last_seen': self.last_seen[order],
+            'frequency': self.frequency[order],
+            'monetary': self.monetary[order]
+        })
+
+    def to_frame(self, snapshot_date=None):
+        """输出按user_key排序的RFM原始值"""
+        order = self.user_index.argsort()
+        return build_rfm_frame(self.user_index[order], self.last_seen[order],
+                               self.frequency[order], self.monetary[order],
+                               snapshot_date=snapshot_date)
+
+
+def save_accumulator(accumulator, path, metadata_key, metadata):
+    """原子写入累加器及附带元数据（JSON存于Parquet schema元数据）"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(accumulator.state_frame(), preserve_index=False)
+    schema_metadata = dict(table.schema.metadata or {})
+    schema_metadata[metadata_key] = json.dumps(metadata).encode('utf-8')
+    table = table.replace_schema_metadata(schema_metadata)
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_accumulator(path, metadata_key):
+    """读取累加器及附带元数据"""
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path)
+    metadata = json.loads(table.schema.metadata[metadata_key])
+    return RFMAccumulator.from_frame(table.to_pandas()), metadata
+
+
+def peak_memory_mb():
+    """进程峰值常驻内存（MB）"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def fold_chunks(chunks, user_column, time_column, duration_column, snapshot_date=None):
+    """逐块折叠观看事件并计算RFM，内存占用只与用户数相关"""
+    accumulator = RFMAccumulator()
+    n_events = 0
+    n_chunks = 0
+
+    for chunk in chunks:
+        accumulator.update(chunk[user_column], chunk[time_column], chunk[duration_column])
+        n_events += len(chunk)
+        n_chunks += 1
+
+    print(f"流式RFM计算完成: {n_events} 条事件, {n_chunks} 个分块, {len(accumulator)} 个用户")
+    print(f"累加器占用 {accumulator.nbytes / 1024 / 1024:.1f} MB, "
+          f"进程峰值内存 {peak_memory_mb():.1f} MB")
+
+    return accumulator.to_frame(snapshot_date)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+内容寻址图表缓存（输入数据 + 样式配置 + 构建代码的哈希，LRU容量淘汰）
+Content-addressed Chart Cache
+"""
+
+import os
+import json
+import shutil
+import hashlib
+
+import pandas as pd
+import numpy as np
+
+
+def _update_digest(digest, value):
+    """将图表输入递归写入哈希（数组按字节，DataFrame按逐行哈希）"""
+    if isinstance(value, pd.DataFrame):
+        digest.update(json.dumps([str(c) for c in value.columns]).encode('utf-8'))
+        digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, pd.Series):
+        digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        digest.update(str((value.dtype, value.shape)).encode('utf-8'))
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        for key in sorted(value, key=str):
+            digest.update(repr(key).encode('utf-8'))
+            _update_digest(digest, value[key])
+    elif isinstance(value, (list, tuple)):
+        digest.update(f'{type(value).__name__}{len(value)}'.encode('utf-8'))
+        for item in value:
+            _update_digest(digest, item)
+    else:
+        digest.update(repr(value).encode('utf-8'))
+
+
+def chart_key(job, formats, dpi):
+    """图表缓存键: 构建函数代码、输入数据、尺寸、样式配置、输出格式和分辨率"""
+    digest = hashlib.sha256()
+    code = job.build.__code__
+    digest.update(f'{job.build.__module__}.{job.build.__qualname__}'.encode('utf-8'))
+    digest.update(code.co_code)
+    digest.update(repr(code.co_consts).encode('utf-8'))
+    _update_digest(digest, [job.data, job.figsize, job.style, list(formats), dpi])
+    return digest.hexdigest()
+
+
+class ChartCache:
+    """按缓存键保存已渲染文件（<key>.<格式>），命中时复制到输出目录
+
+    文件修改时间作为最近使用时间，总大小超过上限时淘汰最久未使用的条目。
+    """
+
+    def __init__(self, cache_dir='outputs/.chart_cache', max_size_mb=200):
+        """初始化缓存"""
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key, fmt):
+        return os.path.join(self.cache_dir, f'{key}.{fmt}')
+
+    def fetch(self, key, output_dir, filename, formats):
+        """缓存命中时将文件复制到输出目录并返回路径列表，否则返回None"""
+        cached = [self._path(key, fmt) for fmt in formats]
+        if not all(os.path.exists(path) for path in cached):
+            return None
+
+        os.makedirs(output_dir, exist_ok=True)
+        paths = []
+        for fmt, path in zip(formats, cached):
+            output_path = os.path.join(output_dir, f'{filename}.{fmt}')
+            shutil.copyfile(path, output_path)
+            os.utime(path)
+            paths.append(output_path)
+        return paths
+
+    def store(self, key, paths):
+        """将渲染结果写入缓存（先写临时文件再原子替换），并按容量淘汰"""
+        for path in paths:
+            fmt = os.path.splitext(path)[1].lstrip('.')
+            tmp_path = self._path(key, fmt) + '.tmp'
+            shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, self._path(key, fmt))
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """总大小超过上限时按最近使用时间淘汰整条缓存（同一键的所有格式），keep为刚写入的键"""
+        entries = {}
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.tmp') or not os.path.isfile(path):
+                continue
+            stat = os.stat(path)
+            key = name.split('.', 1)[0]
+            size, used = entries.get(key, (0, 0))
+            entries[key] = (size + stat.st_size, max(used, stat.st_mtime))
+
+        total = sum(size for size, _ in entries.values())
+        for key, (size, _) in sorted(entries.items(), key=lambda item: item[1][1]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            for name in os.listdir(self.cache_dir):
+                if name.startswith(key + '.'):
+                    os.remove(os.path.join(self.cache_dir, name))
+            total -= size
+            print(f"图表缓存淘汰: {key[:12]}（{size / 1024:.0f} KB）")
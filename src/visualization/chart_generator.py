@@ -5,13 +5,96 @@
 Chart Generator
 """
 
+import os
 import pandas as pd
-import matplotlib.pyplot as plt
 import seaborn as sns
 import numpy as np
 from datetime import datetime, timedelta
 import yaml
 
+from visualization.render_pipeline import ChartJob, apply_style, render_job, run_chart_jobs
+from visualization.chart_cache import ChartCache
+from rfm_analysis.chart_aggregates import (
+    load_activity_heatmap, load_retention_matrix, load_rfm_histograms
+)
+
+WEEKDAYS = ['周一', '周二', '周三', '周四', '周五', '周六', '周日']
+
+
+HEATMAP_METRICS = {'sessions': '观看次数', 'duration': '观看时长(分钟)', 'users': '去重用户数'}
+
+
+def build_heatmap(fig, data):
+    """时段热力图（data: (7x24 指标矩阵, 指标名称)）"""
+    values, label = data
+    ax = fig.add_subplot()
+    sns.heatmap(values, 
+                xticklabels=list(range(24)),
+                yticklabels=WEEKDAYS,
+                cmap='YlOrRd',
+                annot=True,
+                fmt='d',
+                cbar_kws={'label': label},
+                ax=ax)
+    
+    ax.set_title('用户观看行为时段热力图', fontsize=16, fontweight='bold')
+    ax.set_xlabel('小时', fontsize=12)
+    ax.set_ylabel('星期', fontsize=12)
+
+
+def build_retention_curve(fig, data):
+    """留存曲线（data: (留存天数, 留存率%)）"""
+    periods, retention_rates = data
+    ax = fig.add_subplot()
+    ax.plot(periods, retention_rates, 'o-', linewidth=2, markersize=8, color='#2E86AB')
+    ax.fill_between(periods, retention_rates, alpha=0.3, color='#2E86AB')
+    
+    ax.set_title('用户留存曲线', fontsize=16, fontweight='bold')
+    ax.set_xlabel('留存天数', fontsize=12)
+    ax.set_ylabel('留存率 (%)', fontsize=12)
+    ax.grid(True, alpha=0.3)
+    ax.set_ylim(0, 100)
+    
+    # 添加数据标签
+    for period, rate in zip(periods, retention_rates):
+        ax.annotate(f'{rate}%', (period, rate), 
+                   textcoords="offset points", xytext=(0,10), ha='center')
+
+
+def build_rfm_distribution(fig, histograms):
+    """RFM分布图（data: R/F/M固定分箱直方图及相关系数矩阵）"""
+    axes = fig.subplots(2, 2)
+    panels = [
+        (axes[0, 0], 'recency_days', 'skyblue', '最近活跃度分布 (R)', '天数'),
+        (axes[0, 1], 'frequency', 'lightgreen', '观看频次分布 (F)', '次数'),
+        (axes[1, 0], 'monetary_value', 'salmon', '观看时长分布 (M)', '分钟')
+    ]
+    
+    # R、F、M分布（最后一箱包含超出上限的值）
+    for ax, column, color, title, xlabel in panels:
+        ax.stairs(histograms[f'{column}_counts'], histograms[f'{column}_edges'],
+                  fill=True, alpha=0.7, color=color, edgecolor='black')
+        ax.set_title(title, fontweight='bold')
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel('用户数量')
+    
+    # RFM相关性
+    labels = ['Recency', 'Frequency', 'Monetary']
+    correlation = histograms['correlation']
+    axes[1, 1].imshow(correlation, cmap='coolwarm', aspect='auto')
+    axes[1, 1].set_xticks(range(len(labels)))
+    axes[1, 1].set_yticks(range(len(labels)))
+    axes[1, 1].set_xticklabels(labels)
+    axes[1, 1].set_yticklabels(labels)
+    axes[1, 1].set_title('RFM相关性矩阵', fontweight='bold')
+    
+    # 添加相关系数标签
+    for i in range(len(labels)):
+        for j in range(len(labels)):
+            axes[1, 1].text(j, i, f'{correlation[i, j]:.2f}',
+                            ha="center", va="center", color="black")
+
+
 class ChartGenerator:
     """图表生成器"""
     
@@ -22,142 +105,111 @@ class ChartGenerator:
         
     def setup_style(self):
         """设置图表样式"""
-        plt.rcParams['font.sans-serif'] = ['SimHei']
-        plt.rcParams['axes.unicode_minus'] = False
-        plt.style.use('seaborn-v0_8')
-        
+        apply_style()
+    
+    @property
+    def output_options(self):
+        """输出目录、格式列表、分辨率与渲染进程数"""
+        viz_config = self.config.get('visualization', {})
+        output_config = viz_config.get('output', {})
+        formats = output_config.get('format', ['png'])
+        return {
+            'output_dir': output_config.get('path', './outputs/charts'),
+            'formats': [formats] if isinstance(formats, str) else formats,
+            'dpi': viz_config.get('style', {}).get('dpi', 300)
+        }
+    
+    def style_config(self, section=None):
+        """全局样式及图表专属配置（参与缓存键计算）"""
+        viz_config = self.config.get('visualization', {})
+        return {'style': viz_config.get('style', {}),
+                section: viz_config.get(section, {}) if section else None}
+    
+    @property
+    def cache(self):
+        """图表缓存，未启用时返回None"""
+        cache_config = self.config.get('visualization', {}).get('cache', {})
+        if not cache_config.get('enabled', False):
+            return None
+        return ChartCache(cache_config.get('path', 'outputs/.chart_cache'),
+                          cache_config.get('max_size_mb', 200))
+    
+    @property
+    def aggregates_dir(self):
+        """RFM/ETL阶段生成的图表预聚合数据目录"""
+        return self.config.get('visualization', {}).get('aggregates', {}).get('path', 'data/aggregates')
+    
+    def _missing(self, name):
+        print(f"缺少{name}的预聚合数据（{self.aggregates_dir}），请先运行RFM分析，跳过该图表")
+        return None
+    
+    def heatmap_job(self):
+        """时段热力图任务（活跃度立方体按日期区间切片后汇总为7x24）"""
+        heatmap_config = self.config.get('visualization', {}).get('heatmap', {})
+        metric = heatmap_config.get('metric', 'sessions')
+        date_range = heatmap_config.get('date_range') or {}
+        values = load_activity_heatmap(self.aggregates_dir, date_range.get('start'),
+                                       date_range.get('end'), metric)
+        if values is None:
+            return self._missing('时段热力图')
+        data = (np.rint(values).astype(np.int64), HEATMAP_METRICS[metric])
+        return ChartJob('时段热力图', build_heatmap, data, (12, 8), 'hourly_heatmap',
+                        self.style_config('heatmap'))
+    
+    def retention_job(self):
+        """留存曲线任务（由同期群留存矩阵汇总各期留存率）"""
+        retention = load_retention_matrix(self.aggregates_dir)
+        if retention is None:
+            return self._missing('留存曲线')
+        periods = self.config.get('visualization', {}).get('retention', {}).get(
+            'periods', [1, 3, 7, 14, 30])
+        periods = [p for p in periods if p < retention.matrix.shape[1]]
+        retention_rates = retention.retention_rates(periods)
+        return ChartJob('留存曲线', build_retention_curve, (periods, retention_rates), (10, 6),
+                        'retention_curve', self.style_config('retention'))
+    
+    def rfm_distribution_job(self):
+        """RFM分布图任务（固定分箱直方图）"""
+        histograms = load_rfm_histograms(self.aggregates_dir)
+        if histograms is None:
+            return self._missing('RFM分布图')
+        return ChartJob('RFM分布图', build_rfm_distribution, histograms, (15, 10),
+                        'rfm_distribution', self.style_config())
+    
+    def render(self, job):
+        """在当前进程渲染单个图表"""
+        if job is None:
+            return
+        print(f"生成{job.name}...")
+        name, paths, seconds = render_job(job, **self.output_options)
+        print(f"{name}已保存到 {', '.join(paths)}（{seconds:.2f}s）")
+    
     def generate_heatmap(self):
         """生成时段热力图"""
-        print("生成时段热力图...")
-        
-        # 模拟时段数据
-        hours = list(range(24))
-        days = ['周一', '周二', '周三', '周四', '周五', '周六', '周日']
-        
-        # 生成模拟数据
-        np.random.seed(42)
-        data = np.random.poisson(100, (7, 24))
-        
-        # 创建热力图
-        fig, ax = plt.subplots(figsize=(12, 8))
-        sns.heatmap(data, 
-                    xticklabels=hours,
-                    yticklabels=days,
-                    cmap='YlOrRd',
-                    annot=True,
-                    fmt='d',
-                    cbar_kws={'label': '观看次数'})
-        
-        ax.set_title('用户观看行为时段热力图', fontsize=16, fontweight='bold')
-        ax.set_xlabel('小时', fontsize=12)
-        ax.set_ylabel('星期', fontsize=12)
-        
-        plt.tight_layout()
-        plt.savefig('outputs/charts/hourly_heatmap.png', dpi=300, bbox_inches='tight')
-        plt.close()
-        
-        print("时段热力图已保存到 outputs/charts/hourly_heatmap.png")
+        self.render(self.heatmap_job())
     
     def generate_retention_curve(self):
         """生成留存曲线"""
-        print("生成留存曲线...")
-        
-        # 模拟留存数据
-        periods = [1, 3, 7, 14, 30]
-        retention_rates = [100, 85, 70, 55, 40]
-        
-        fig, ax = plt.subplots(figsize=(10, 6))
-        ax.plot(periods, retention_rates, 'o-', linewidth=2, markersize=8, color='#2E86AB')
-        ax.fill_between(periods, retention_rates, alpha=0.3, color='#2E86AB')
-        
-        ax.set_title('用户留存曲线', fontsize=16, fontweight='bold')
-        ax.set_xlabel('留存天数', fontsize=12)
-        ax.set_ylabel('留存率 (%)', fontsize=12)
-        ax.grid(True, alpha=0.3)
-        ax.set_ylim(0, 100)
-        
-        # 添加数据标签
-        for i, (period, rate) in enumerate(zip(periods, retention_rates)):
-            ax.annotate(f'{rate}%', (period, rate), 
-                       textcoords="offset points", xytext=(0,10), ha='center')
-        
-        plt.tight_layout()
-        plt.savefig('outputs/charts/retention_curve.png', dpi=300, bbox_inches='tight')
-        plt.close()
-        
-        print("留存曲线已保存到 outputs/charts/retention_curve.png")
+        self.render(self.retention_job())
     
     def generate_rfm_distribution(self):
         """生成RFM分布图"""
-        print("生成RFM分布图...")
-        
-        # 模拟RFM数据
-        np.random.seed(42)
-        n_users = 1000
-        
-        rfm_data = {
-            'Recency': np.random.normal(15, 10, n_users),
-            'Frequency': np.random.poisson(5, n_users),
-            'Monetary': np.random.exponential(100, n_users)
-        }
-        
-        df = pd.DataFrame(rfm_data)
-        
-        # 创建子图
-        fig, axes = plt.subplots(2, 2, figsize=(15, 10))
-        
-        # R分布
-        axes[0, 0].hist(df['Recency'], bins=30, alpha=0.7, color='skyblue', edgecolor='black')
-        axes[0, 0].set_title('最近活跃度分布 (R)', fontweight='bold')
-        axes[0, 0].set_xlabel('天数')
-        axes[0, 0].set_ylabel('用户数量')
-        
-        # F分布
-        axes[0, 1].hist(df['Frequency'], bins=20, alpha=0.7, color='lightgreen', edgecolor='black')
-        axes[0, 1].set_title('观看频次分布 (F)', fontweight='bold')
-        axes[0, 1].set_xlabel('次数')
-        axes[0, 1].set_ylabel('用户数量')
-        
-        # M分布
-        axes[1, 0].hist(df['Monetary'], bins=30, alpha=0.7, color='salmon', edgecolor='black')
-        axes[1, 0].set_title('观看时长分布 (M)', fontweight='bold')
-        axes[1, 0].set_xlabel('分钟')
-        axes[1, 0].set_ylabel('用户数量')
-        
-        # RFM相关性
-        correlation = df.corr()
-        im = axes[1, 1].imshow(correlation, cmap='coolwarm', aspect='auto')
-        axes[1, 1].set_xticks(range(len(correlation.columns)))
-        axes[1, 1].set_yticks(range(len(correlation.columns)))
-        axes[1, 1].set_xticklabels(correlation.columns)
-        axes[1, 1].set_yticklabels(correlation.columns)
-        axes[1, 1].set_title('RFM相关性矩阵', fontweight='bold')
-        
-        # 添加相关系数标签
-        for i in range(len(correlation.columns)):
-            for j in range(len(correlation.columns)):
-                text = axes[1, 1].text(j, i, f'{correlation.iloc[i, j]:.2f}',
-                                      ha="center", va="center", color="black")
-        
-        plt.tight_layout()
-        plt.savefig('outputs/charts/rfm_distribution.png', dpi=300, bbox_inches='tight')
-        plt.close()
-        
-        print("RFM分布图已保存到 outputs/charts/rfm_distribution.png")
+        self.render(self.rfm_distribution_job())
     
     def generate_all_charts(self):
-        """生成所有图表"""
+        """生成所有图表（各图表相互独立，在进程池中并行渲染）"""
         print("开始生成所有可视化图表...")
         
         # 创建输出目录
-        import os
-        os.makedirs('outputs/charts', exist_ok=True)
+        options = self.output_options
+        os.makedirs(options['output_dir'], exist_ok=True)
         os.makedirs('outputs/reports', exist_ok=True)
         
         # 生成各种图表
-        self.generate_heatmap()
-        self.generate_retention_curve()
-        self.generate_rfm_distribution()
+        jobs = [self.heatmap_job(), self.retention_job(), self.rfm_distribution_job()]
+        jobs = [job for job in jobs if job is not None]
+        workers = self.config.get('visualization', {}).get('output', {}).get('workers')
+        run_chart_jobs(jobs, workers=workers, cache=self.cache, **options)
         
         print("所有图表生成完成！")
-        print("图表保存位置: outputs/charts/")
+        print(f"图表保存位置: {options['output_dir']}")
@@ -1,73 +1,44 @@
 # -*- coding: utf-8 -*-
-import pandas as pd
-import matplotlib.pyplot as plt
+"""
+时段热力图（读取RFM/ETL阶段维护的活跃度立方体，与ChartGenerator使用同一份数据）
+"""
 import os
-import matplotlib as mpl
+import sys
+import argparse
+
+import yaml
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from visualization.chart_generator import ChartGenerator
+from visualization.render_pipeline import apply_style, render_job
+
+
+def generate_hourly_heatmap(config_path='config/visualization_config.yaml',
+                            output_path='docs/hourly_heatmap_v2.png', start=None, end=None):
+    """按日期区间切片活跃度立方体并输出 星期 x 小时 热力图"""
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    if start or end:
+        config['visualization'].setdefault('heatmap', {})['date_range'] = {'start': start, 'end': end}
+    
+    job = ChartGenerator(config).heatmap_job()
+    if job is None:
+        return None
+    
+    output_dir, filename = os.path.split(output_path)
+    job.filename, fmt = os.path.splitext(filename)
+    apply_style()
+    _, paths, _ = render_job(job, output_dir or '.', [fmt.lstrip('.') or 'png'], 150)
+    print(f"热力图已生成: {paths[0]}")
+    return paths[0]
+
 
-def generate_hourly_heatmap():
-    # 设置中文字体
-    try:
-        # 尝试使用文泉驿微米黑字体
-        plt.rcParams['font.sans-serif'] = ['WenQuanYi Micro Hei']
-        plt.rcParams['axes.unicode_minus'] = False
-    except:
-        # 回退到默认字体
-        print("中文支持警告: 无法设置中文字体，图表中文可能显示异常")
-    
-    try:
-        # 从 HDFS 获取预处理数据
-        import subprocess
-        subprocess.run(["hdfs", "dfs", "-get", "/results/time_heatmap/000000_0", "time_heatmap.csv"])
-        df = pd.read_csv('time_heatmap.csv', 
-                         names=['hour_of_day', 'day_of_week', 'sessions', 'avg_duration'])
-        
-        # 重命名列
-        df = df.rename(columns={'sessions': 'active_users'})
-        print("成功从 HDFS 获取数据")
-    except Exception as e:
-        print(f"数据获取失败: {str(e)}")
-        print("使用示例数据生成热力图...")
-        # 创建示例数据
-        data = {
-            'hour_of_day': list(range(0, 24)) * 7,
-            'day_of_week': [d for d in range(1, 8) for _ in range(24)],
-            'active_users': [max(50, (h*10) % 200) for h in range(24*7)]
-        }
-        df = pd.DataFrame(data)
-    
-    # 确保目录存在
-    os.makedirs("docs", exist_ok=True)
-    
-    # 转换星期几为中文标签
-    #weekdays = ['周一', '周二', '周三', '周四', '周五', '周六', '周日']
-    #df['day_of_week'] = df['day_of_week'].apply(
-     #   lambda x: weekdays[int(x)-1] if 1 <= int(x) <= 7 else '未知'
-    )#
-weekdays = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
-df['day_of_week'] = df['day_of_week'].apply(lambda x: weekdays[x-1] if 1 <= x <= 7 else "Invalid")
-    
-    # 创建热力图矩阵
-    heatmap_data = df.pivot_table(index="hour_of_day", 
-                                 columns="day_of_week", 
-                                 values="active_users", 
-                                 fill_value=0)
-    
-    # 简化图表生成
-    plt.figure(figsize=(12, 8))
-    plt.imshow(heatmap_data, cmap="YlGnBu", aspect='auto')
-    plt.colorbar(label='活跃用户数')
-    
-    # 设置坐标轴
-    plt.yticks(range(len(heatmap_data.index)), heatmap_data.index)
-    plt.xticks(range(len(heatmap_data.columns)), heatmap_data.columns)
-    
-    plt.title("用户活跃时段热力图")
-    plt.xlabel("星期")
-    plt.ylabel("小时")
-    plt.tight_layout()
-    
-    plt.savefig("docs/hourly_heatmap_v2.png", dpi=150)
-    print("热力图已生成: docs/hourly_heatmap_v2.png")
-    
 if __name__ == "__main__":
-    generate_hourly_heatmap()
+    parser = argparse.ArgumentParser(description='时段热力图')
+    parser.add_argument('--config', default='config/visualization_config.yaml', help='可视化配置文件')
+    parser.add_argument('--output', default='docs/hourly_heatmap_v2.png', help='输出文件')
+    parser.add_argument('--start', help='开始日期(yyyy-MM-dd)')
+    parser.add_argument('--end', help='结束日期(yyyy-MM-dd)')
+    args = parser.parse_args()
+    generate_hourly_heatmap(args.config, args.output, args.start, args.end)
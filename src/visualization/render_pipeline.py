@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图表渲染流水线（多进程、面向对象Agg API、一次构建多格式输出）
+Chart Rendering Pipeline
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+from visualization.chart_cache import chart_key
+
+
+def apply_style():
+    """设置图表样式（进程级rcParams，进程池中每个worker初始化时调用）"""
+    import matplotlib.style
+
+    matplotlib.style.use('seaborn-v0_8')
+    matplotlib.rcParams['font.sans-serif'] = ['SimHei']
+    matplotlib.rcParams['axes.unicode_minus'] = False
+
+
+class ChartJob:
+    """一个独立的图表任务: 构建函数（模块级，可跨进程序列化）+ 输入数据 + 输出文件名"""
+
+    def __init__(self, name, build, data, figsize, filename, style=None):
+        self.name = name
+        self.build = build
+        self.data = data
+        self.figsize = figsize
+        self.filename = filename
+        self.style = style  # 影响渲染结果的样式配置，参与缓存键计算
+
+
+def save_figure(fig, output_dir, filename, formats, dpi):
+    """同一个Figure按多种格式输出，返回文件路径列表"""
+    FigureCanvasAgg(fig)
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+    for fmt in formats:
+        path = os.path.join(output_dir, f'{filename}.{fmt}')
+        fig.savefig(path, format=fmt, dpi=dpi, bbox_inches='tight')
+        paths.append(path)
+    return paths
+
+
+def render_job(job, output_dir, formats, dpi):
+    """渲染一个图表任务: 构建一次Figure，输出所有格式，返回 (名称, 路径, 耗时)"""
+    start = time.perf_counter()
+    # 不经过pyplot，Figure不注册到全局状态，可在任意进程/线程中独立渲染
+    fig = Figure(figsize=job.figsize)
+    job.build(fig, job.data)
+    fig.tight_layout()
+    paths = save_figure(fig, output_dir, job.filename, formats, dpi)
+    return job.name, paths, time.perf_counter() - start
+
+
+def run_chart_jobs(jobs, output_dir, formats=('png',), dpi=300, workers=None, cache=None):
+    """在进程池中并行渲染图表任务，输出每个图表的渲染耗时
+
+    workers 为1时在当前进程内顺序渲染；指定 cache 时输入与样式未变化的图表直接从缓存复制。
+    """
+    start = time.perf_counter()
+    results = []
+    pending = []
+    for job in jobs:
+        key = chart_key(job, formats, dpi) if cache is not None else None
+        paths = cache.fetch(key, output_dir, job.filename, formats) if cache is not None else None
+        if paths is not None:
+            results.append((job.name, paths, 0.0))
+            print(f"{job.name}: 缓存命中 ({key[:12]})")
+        else:
+            pending.append((job, key))
+
+    if workers == 1 or len(pending) <= 1:
+        apply_style()
+        rendered = [render_job(job, output_dir, formats, dpi) for job, _ in pending]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=apply_style) as executor:
+            futures = [executor.submit(render_job, job, output_dir, formats, dpi) for job, _ in pending]
+            rendered = [future.result() for future in futures]
+
+    for (job, key), (name, paths, seconds) in zip(pending, rendered):
+        if cache is not None:
+            cache.store(key, paths)
+        print(f"{name}: {seconds:.2f}s -> {', '.join(paths)}")
+    results.extend(rendered)
+    print(f"共 {len(jobs)} 个图表，渲染 {len(rendered)} 个，缓存命中 {len(jobs) - len(rendered)} 个，"
+          f"总耗时 {time.perf_counter() - start:.2f}s")
+    return results
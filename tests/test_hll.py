@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""HLL草图表：上卷估计值与精确去重人数对比，稀疏存储与合并、持久化"""
+import numpy as np
+import pandas as pd
+
+from retention.hll import HLLSketchTable
+
+DIMENSIONS = ['province', 'city', 'age', 'gender']
+
+
+def _events(n_users=20000, n_events=80000, seed=0):
+    rng = np.random.default_rng(seed)
+    users = pd.DataFrame({
+        'province': rng.choice([f'P{i}' for i in range(6)], n_users),
+        'city': rng.choice([f'C{i}' for i in range(20)], n_users),
+        'age': rng.integers(18, 60, n_users).astype(str),
+        'gender': rng.choice(['男', '女'], n_users),
+    })
+    user_ids = rng.integers(0, n_users, n_events)
+    return users.iloc[user_ids].reset_index(drop=True).assign(user_id=user_ids)
+
+
+def _sketch(events, chunk_size=10000):
+    table = HLLSketchTable.for_error(DIMENSIONS, 0.02)
+    for start in range(0, len(events), chunk_size):
+        chunk = events.iloc[start:start + chunk_size]
+        table.update(chunk, chunk['user_id'].to_numpy())
+    return table
+
+
+def _assert_close(estimates, exact, by):
+    merged = estimates.merge(exact.rename('exact').reset_index(), on=by)
+    assert len(merged) == len(exact)
+    # 4倍标准误差以内（小单元格另给2人的取整余量）
+    bound = 4 * merged['relative_error'] * merged['exact'] + 2
+    assert ((merged['distinct_users'] - merged['exact']).abs() <= bound).all()
+
+
+def test_rollup_matches_exact_nunique():
+    events = _events()
+    table = _sketch(events)
+    for by in [['province'], ['province', 'gender'], ['age']]:
+        _assert_close(table.rollup(by).estimates(), events.groupby(by)['user_id'].nunique(), by)
+    total = table.rollup().estimates()
+    assert total['estimator'].iloc[0] == 'hll'
+    assert abs(total['distinct_users'].iloc[0] - events['user_id'].nunique()) <= 4 * total['relative_error'].iloc[0] * events['user_id'].nunique()
+
+
+def test_drilldown_matches_exact_nunique():
+    events = _events()
+    table = _sketch(events)
+    mask = (table.keys['province'] == 'P1').to_numpy()
+    subset = events[events['province'] == 'P1']
+    _assert_close(table.rollup(['city'], mask).estimates(), subset.groupby(['city'])['user_id'].nunique(), ['city'])
+
+
+def test_small_cells_stay_sparse():
+    events = _events()
+    table = _sketch(events)
+    assert table.n_dense == 0
+    assert table.nbytes < len(table) * table.m // 10
+    # 小单元格使用线性计数，误差按线性计数公式报告（小于HLL区间误差）
+    estimates = table.estimates()
+    assert (estimates['estimator'] == 'linear').all()
+    assert (estimates['relative_error'] < table.relative_error).all()
+
+
+def test_merge_and_save_roundtrip(tmp_path):
+    events = _events()
+    whole = _sketch(events)
+    left, right = _sketch(events.iloc[:50000]), _sketch(events.iloc[50000:])
+    left.merge(right)
+    path = str(tmp_path / 'dimension_hll.npz')
+    left.save(path)
+    loaded = HLLSketchTable.load(path)
+
+    expected = whole.rollup(['province']).estimates().sort_values('province').reset_index(drop=True)
+    for table in [left, loaded]:
+        result = table.rollup(['province']).estimates().sort_values('province').reset_index(drop=True)
+        pd.testing.assert_frame_equal(result, expected)
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""增量留存状态：已处理分区跳过，早于水位的补数分区要求全量重建"""
+import pandas as pd
+import pytest
+
+from retention.incremental_retention import RetentionState, RetentionBackfillError
+
+
+def _partition(day, users):
+    return [pd.DataFrame({'user_key': users, 'full_time': pd.to_datetime([f'{day} 12:00'] * len(users))})]
+
+
+def test_backfill_partition_requires_rebuild():
+    state = RetentionState(max_offset=7)
+    state.apply_partition('2024-05-01', _partition('2024-05-01', [1, 2]))
+    state.apply_partition('2024-05-03', _partition('2024-05-03', [1, 3]))
+
+    # 重复处理已合并的分区直接跳过
+    assert state.apply_partition('2024-05-03', _partition('2024-05-03', [1, 3])) is False
+    with pytest.raises(RetentionBackfillError):
+        state.apply_partition('2024-05-02', _partition('2024-05-02', [3]))
+    assert state.partitions == ['2024-05-01', '2024-05-03']
+    assert state.retention.cohort_sizes.sum() == 3
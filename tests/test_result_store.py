@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""RFM结果存储：记录文件与用户标识旁路文件按写入代次配对"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from rfm_analysis.result_store import (write_rfm_store, store_to_frame, load_user_ids,
+                                       open_rfm_store_with_ids, user_ids_path)
+
+
+def _rfm(user_keys):
+    n = len(user_keys)
+    return pd.DataFrame({'user_key': user_keys, 'recency_days': np.arange(n), 'frequency': np.arange(n) + 1,
+                         'monetary_value': np.linspace(1, 2, n), 'R_score': 1, 'F_score': 2, 'M_score': 3})
+
+
+def test_string_then_integer_keys(tmp_path):
+    path = str(tmp_path / 'rfm_scores.npy')
+    write_rfm_store(_rfm(['U1', 'U2', 'U3']), path)
+    assert list(store_to_frame(path)['user_key']) == ['U1', 'U2', 'U3']
+
+    write_rfm_store(_rfm([7, 8]), path)
+    assert load_user_ids(path) is None
+    assert list(store_to_frame(path)['user_key']) == [7, 8]
+
+
+def test_mismatched_generation_is_rejected(tmp_path):
+    path = str(tmp_path / 'rfm_scores.npy')
+    write_rfm_store(_rfm(['U1', 'U2']), path)
+    # 模拟写入方已替换旁路文件、尚未替换记录文件
+    np.save(user_ids_path(path), np.array(['V1', 'V2', 'V3']))
+    with pytest.raises(RuntimeError):
+        open_rfm_store_with_ids(path, retries=1)
+
+    write_rfm_store(_rfm(['U1', 'U2']), path)
+    assert list(load_user_ids(path)) == ['U1', 'U2']
+    assert not any(name.endswith('.tmp.npy') for name in os.listdir(tmp_path))
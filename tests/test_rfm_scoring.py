@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""RFM五等分打分：相同取值的用户分数相同，且与行顺序无关"""
+import numpy as np
+import pandas as pd
+
+from rfm_analysis.quantile_sketch import RFMQuantileScorer
+from rfm_analysis.rfm_calculator import exact_quintile_scores
+
+
+def _tied_rfm(n=4000, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'user_id': np.arange(n),
+        # 最近活跃天数大量为0，与生成数据一致，qcut切点会重复
+        'recency_days': np.where(rng.random(n) < 0.8, 0, rng.integers(1, 9, n)),
+        'frequency': rng.integers(1, 6, n),
+        'monetary_value': np.round(rng.gamma(2.0, 50.0, n), 2),
+    })
+
+
+def _assert_equal_values_equal_scores(df, value_column, score_column):
+    distinct = df.groupby(value_column)[score_column].nunique()
+    assert (distinct == 1).all()
+
+
+def _score_exact(df):
+    df = df.copy()
+    df['R_score'] = exact_quintile_scores(df['recency_days'], [5, 4, 3, 2, 1])
+    df['F_score'] = exact_quintile_scores(df['frequency'], [1, 2, 3, 4, 5])
+    df['M_score'] = exact_quintile_scores(df['monetary_value'], [1, 2, 3, 4, 5])
+    return df
+
+
+def _score_sketch(df, fit_df=None):
+    scorer = RFMQuantileScorer()
+    scorer.update(df if fit_df is None else fit_df)
+    return scorer.score(df.copy())
+
+
+def test_exact_scores_equal_for_equal_values():
+    df = _score_exact(_tied_rfm())
+    for value_column, score_column in [('recency_days', 'R_score'),
+                                       ('frequency', 'F_score'),
+                                       ('monetary_value', 'M_score')]:
+        _assert_equal_values_equal_scores(df, value_column, score_column)
+
+
+def test_exact_scores_match_qcut_without_ties():
+    values = pd.Series(np.random.default_rng(1).permutation(1000).astype(float))
+    expected = pd.qcut(values, 5, labels=[1, 2, 3, 4, 5])
+    assert (exact_quintile_scores(values, [1, 2, 3, 4, 5]) == expected).all()
+
+
+def test_exact_scores_independent_of_row_order():
+    df = _tied_rfm()
+    shuffled = df.sample(frac=1, random_state=3)
+    scored = _score_exact(df).set_index('user_id').sort_index()
+    reshuffled = _score_exact(shuffled).set_index('user_id').sort_index()
+    for column in ['R_score', 'F_score', 'M_score']:
+        assert (scored[column].astype(int) == reshuffled[column].astype(int)).all()
+
+
+def test_sketch_scores_equal_for_equal_values():
+    df = _score_sketch(_tied_rfm())
+    for value_column, score_column in [('recency_days', 'R_score'),
+                                       ('frequency', 'F_score'),
+                                       ('monetary_value', 'M_score')]:
+        _assert_equal_values_equal_scores(df, value_column, score_column)
+
+
+def test_sketch_scores_stable_across_batches():
+    df = _tied_rfm()
+    full = _score_sketch(df).set_index('user_id')
+    # 同一草图对打乱后的子集重新打分，分数不变
+    subset = df.sample(n=500, random_state=4)
+    partial = _score_sketch(subset, fit_df=df).set_index('user_id')
+    for column in ['R_score', 'F_score', 'M_score']:
+        assert (partial[column] == full.loc[partial.index, column]).all()
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""流式RFM累加器：时间维度缺失（NULL）的事件只不参与R，仍计入F、M"""
+import numpy as np
+import pandas as pd
+
+from rfm_analysis.streaming import RFMAccumulator, fold_chunks
+from retention.incremental_retention import RetentionState
+
+
+def _events():
+    return pd.DataFrame({
+        'user_key': [1, 1, 1, 2, 2, 3],
+        'full_time': pd.to_datetime(['2024-05-01 10:00', None, '2024-05-03 09:00',
+                                     None, '2024-05-02 20:00', None]),
+        'duration_min': [10.0, 5.0, 1.0, 2.0, 3.0, 7.0],
+    })
+
+
+def test_null_time_counted_in_frequency_and_monetary():
+    events = _events()
+    chunks = [events.iloc[:2], events.iloc[2:4], events.iloc[4:]]
+    rfm = fold_chunks(chunks, 'user_key', 'full_time', 'duration_min', snapshot_date='2024-05-10')
+    rfm = rfm.set_index('user_key')
+
+    # 用户3只有缺失时间的事件，无法计算R，不输出
+    assert list(rfm.index) == [1, 2]
+    assert rfm.loc[1, 'frequency'] == 3 and rfm.loc[1, 'monetary_value'] == 16.0
+    assert rfm.loc[2, 'frequency'] == 2 and rfm.loc[2, 'monetary_value'] == 5.0
+    assert rfm.loc[1, 'recency_days'] == 7 and rfm.loc[2, 'recency_days'] == 8
+
+
+def test_null_time_user_recovers_after_merge():
+    events = _events()
+    left, right = RFMAccumulator(), RFMAccumulator()
+    left.update(events['user_key'][5:], events['full_time'][5:], events['duration_min'][5:])
+    right.update([3], pd.to_datetime(['2024-05-09']), [1.0])
+    left.merge(right)
+    rfm = left.to_frame('2024-05-10').set_index('user_key')
+    assert rfm.loc[3, 'frequency'] == 2 and rfm.loc[3, 'recency_days'] == 1
+
+
+def test_null_time_ignored_by_retention():
+    state = RetentionState(max_offset=7)
+    state.apply_partition('2024-05-01', [_events()], 'user_key', 'full_time')
+    assert state.retention.cohort_sizes.sum() == 2